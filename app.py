@@ -65,6 +65,7 @@ def api_generate_report():
     deepseek_api_key = request.form['deepseek_api_key']
     current_industry = request.form.get('current_industry', '')
     output_format = request.form.get('output_format', 'markdown')  # 默认为markdown
+    enable_thinkcite = request.form.get('enable_thinkcite', 'false').lower() == 'true'  # 是否启用Think&Cite增强
     
     # 生成唯一的任务ID
     task_id = str(uuid.uuid4())
@@ -125,7 +126,8 @@ def api_generate_report():
                 template_path=local_template_path,
                 current_industry=current_industry,
                 callback=progress_callback,
-                output_format=output_format  # 传递输出格式参数
+                output_format=output_format,  # 传递输出格式参数
+                enable_thinkcite=enable_thinkcite
             )
             
             # 如果需要PDF格式，使用pandoc转换
@@ -0,0 +1,50 @@
+# Microbenchmark: per-chart render time for each supported chart_type.
+# Usage: python bench_charts.py [repeats] [profile]
+import os
+import sys
+import time
+import tempfile
+import statistics
+import warnings
+
+import chart_renderer
+
+SAMPLE_DATA = {
+    "labels": ["2019年", "2020年", "2021年", "2022年", "2023年"],
+    "values": [120.5, 135.2, 150.8, 171.3, 190.6],
+    "additional_series": [
+        {"name": "国内", "values": [80.1, 88.4, 97.2, 110.5, 121.9]},
+        {"name": "海外", "values": [40.4, 46.8, 53.6, 60.8, 68.7]}
+    ],
+    "sizes": [300, 500, 700, 900, 1100]
+}
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    profile, _ = chart_renderer.get_chart_profile(sys.argv[2] if len(sys.argv) > 2 else None)
+    warnings.filterwarnings("ignore")
+    # Measure actual rendering, not render cache hits
+    os.environ["REPORT_CHART_CACHE_DIR"] = "off"
+    font_name = chart_renderer.resolve_chinese_font()
+    chart_types = list(chart_renderer.CHART_RENDERERS)
+    
+    print(f"renderer v{chart_renderer.RENDERER_VERSION}, profile={profile}, font={font_name}, repeats={repeats}")
+    print(f"{'chart_type':<16}{'median ms':>12}{'min ms':>12}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for chart_type in chart_types:
+            spec = {"chart_type": chart_type, "chart_title": f"{chart_type} 基准测试",
+                    "x_label": "年份", "y_label": "市场规模（亿元）", "data": SAMPLE_DATA}
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        chart_renderer.render_chart(spec, 0, output_dir, chart_type, font_name, profile)
+                    finally:
+                        sys.stdout = stdout
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{chart_type:<16}{statistics.median(timings):>12.1f}{min(timings):>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Local chart placement: insert chart references after the paragraph that best matches
+# each chart, so optimize_content no longer needs the rendered charts in its prompt
+# and can run while the charts are still being extracted and rendered.
+import re
+
+_CJK_RUN = re.compile(r"[\u4e00-\u9fa5]+")
+_LATIN_WORD = re.compile(r"[A-Za-z][A-Za-z0-9\-]{1,}")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# Title words that say nothing about which paragraph a chart belongs to
+_GENERIC_TERMS = {"图表", "数据", "分析", "情况", "对比", "分布", "趋势", "变化", "单位"}
+
+# Score weights: an exact label or number in a paragraph is stronger evidence than title words
+LABEL_WEIGHT = 2.0
+NUMBER_WEIGHT = 3.0
+TERM_WEIGHT = 1.0
+# Applied to paragraphs that already received a chart, so charts spread over the section
+REUSE_PENALTY = 0.5
+
+
+def _terms(text):
+    """Chinese bigrams and Latin words of a text"""
+    terms = set()
+    for run in _CJK_RUN.findall(text or ""):
+        terms.update(run[i:i+2] for i in range(len(run) - 1))
+    terms.update(word.lower() for word in _LATIN_WORD.findall(text or ""))
+    return terms - _GENERIC_TERMS
+
+def _number_forms(value):
+    """Ways a chart value is likely written in the text: 120.5, 120.50, 1,234"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return set()
+    forms = {f"{number:g}", f"{number:.1f}", f"{number:.2f}"}
+    if number.is_integer():
+        forms.add(f"{int(number)}")
+        forms.add(f"{int(number):,}")
+    # Short numbers such as list markers match almost any paragraph
+    return {form for form in forms if len(form) >= 3}
+
+def _chart_features(chart_info, chart_data):
+    """Title terms, labels and number strings describing one chart"""
+    data = (chart_data or {}).get("data", {})
+    labels = [str(label) for label in data.get("labels", []) if len(str(label)) >= 2]
+    numbers = set()
+    for value in data.get("values", []):
+        numbers |= _number_forms(value)
+    for series in data.get("additional_series") or []:
+        labels.append(str(series.get("name", "")))
+        for value in series.get("values", []):
+            numbers |= _number_forms(value)
+    return _terms(chart_info.get("title", "")), labels, numbers
+
+def split_blocks(content):
+    """Split markdown into blocks separated by blank lines"""
+    return [block for block in re.split(r"\n\s*\n", content.strip()) if block.strip()]
+
+def _is_placeable(block):
+    """Charts go after prose paragraphs or tables, never after headings or other charts"""
+    first_line = block.lstrip().splitlines()[0]
+    return not first_line.startswith("#") and not first_line.startswith("![")
+
+def score_block(block, title_terms, labels, numbers):
+    """Keyword and number overlap between a block and a chart"""
+    score = TERM_WEIGHT * len(title_terms & _terms(block))
+    score += LABEL_WEIGHT * sum(1 for label in labels if label and label in block)
+    block_numbers = set(_NUMBER.findall(block.replace(",", "")))
+    score += NUMBER_WEIGHT * len({n.replace(",", "") for n in numbers} & block_numbers)
+    return score
+
+def place_charts(content, charts_info, visualization_data=None):
+    """
+    Insert each chart's markdown reference after its best matching block.
+    charts_info entries carry the index of their spec in visualization_data;
+    charts without any match go after the last placeable block.
+    """
+    if not charts_info:
+        return content
+    blocks = split_blocks(content)
+    placeable = [i for i, block in enumerate(blocks) if _is_placeable(block)]
+    if not placeable:
+        return content.rstrip() + "\n\n" + "\n\n".join(c["markdown_ref"] for c in charts_info) + "\n"
+
+    insertions = {}
+    for chart_info in charts_info:
+        if chart_info["markdown_ref"] in content:
+            continue
+        index = chart_info.get("index")
+        chart_data = visualization_data[index] if visualization_data and index is not None and index < len(visualization_data) else None
+        title_terms, labels, numbers = _chart_features(chart_info, chart_data)
+
+        best_block, best_score = placeable[-1], 0.0
+        for i in placeable:
+            score = score_block(blocks[i], title_terms, labels, numbers)
+            if i in insertions:
+                score *= REUSE_PENALTY
+            if score > best_score:
+                best_block, best_score = i, score
+        insertions.setdefault(best_block, []).append(chart_info["markdown_ref"])
+
+    output = []
+    for i, block in enumerate(blocks):
+        output.append(block)
+        output.extend(insertions.get(i, []))
+    return "\n\n".join(output) + "\n"
@@ -0,0 +1,560 @@
+# Chart rendering shared by step2 and the chart rendering service.
+# Kept free of API clients so that worker processes can import it cheaply.
+# Simple chart types are drawn by svg_charts under every profile; matplotlib (and numpy) are
+# imported only when a chart needs them: scatter, bubble, radar and stacked bar charts, and PNG
+# output when the optional cairosvg rasterizer is not installed.
+# Figures are built with the object-oriented Figure/Axes API, so no pyplot global state is involved.
+import os
+import json
+import shutil
+import hashlib
+import svg_charts
+
+# Chinese fonts tried in order when rendering charts
+DEFAULT_CHINESE_FONTS = [
+    'SimHei', 'Microsoft YaHei', 'STSong', 'STFangsong', 'FangSong', 'KaiTi', 
+    'SimSun', 'NSimSun', 'STXihei', 'STZhongsong', 'STKaiti', 'STLiti', 
+    'STHupo', 'STCaiyun', 'STXingkai', 'STXinwei'
+]
+
+# On-disk cache of the resolved chart font, invalidated when any font directory changes
+FONT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "industry_report", "font_cache.json")
+
+# Per-process cache: (preferred fonts, font path) -> font family name
+_resolved_fonts = {}
+
+def _font_directories_signature():
+    """
+    Map each existing system font directory to the newest mtime found in its tree.
+    Only directories are stat'ed, so this is much cheaper than parsing the fonts.
+    """
+    import matplotlib.font_manager as fm
+    font_dirs = (fm.X11FontDirectories + fm.OSXFontDirectories
+                 + fm.MSFontDirectories + fm.MSUserFontDirectories)
+    signature = {}
+    for font_dir in font_dirs:
+        if not os.path.isdir(font_dir):
+            continue
+        latest = os.path.getmtime(font_dir)
+        for root, dirs, _ in os.walk(font_dir):
+            for d in dirs:
+                try:
+                    latest = max(latest, os.path.getmtime(os.path.join(root, d)))
+                except OSError:
+                    pass
+        signature[font_dir] = latest
+    return signature
+
+def resolve_chinese_font(preferred_fonts=None, font_path=None):
+    """
+    Resolve the font family used for chart text, scanning the system fonts at most
+    once per process and reusing the on-disk cache while the font directories are unchanged.
+    An explicit font file path takes precedence over the preferred font list.
+    """
+    import matplotlib.font_manager as fm
+    preferred_fonts = list(preferred_fonts or DEFAULT_CHINESE_FONTS)
+    cache_key = (tuple(preferred_fonts), font_path or "")
+    if cache_key in _resolved_fonts:
+        return _resolved_fonts[cache_key]
+    
+    # Explicit font file: register it with matplotlib and use its family name
+    if font_path:
+        try:
+            fm.fontManager.addfont(font_path)
+            font_name = fm.FontProperties(fname=font_path).get_name()
+            _resolved_fonts[cache_key] = font_name
+            return font_name
+        except Exception as e:
+            print(f"Unable to load chart font file {font_path}: {str(e)}")
+    
+    signature = _font_directories_signature()
+    try:
+        with open(FONT_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("directories") == signature and cached.get("preferred_fonts") == preferred_fonts:
+            _resolved_fonts[cache_key] = cached["font"]
+            return cached["font"]
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    # Cache miss: scan the system fonts once and check every candidate against the result
+    system_fonts = [f.lower() for f in fm.findSystemFonts()]
+    font_name = None
+    for font in preferred_fonts:
+        if any(font.lower() in f for f in system_fonts):
+            font_name = font
+            break
+    
+    if not font_name:
+        # If no Chinese font found, use a default available font
+        font_name = 'DejaVu Sans'
+        print("Warning: No specific Chinese font found. Using default font.")
+    
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE_PATH), exist_ok=True)
+        with open(FONT_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"directories": signature, "preferred_fonts": preferred_fonts, "font": font_name}, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"Unable to write font cache: {str(e)}")
+    
+    _resolved_fonts[cache_key] = font_name
+    return font_name
+
+# Bump when the rendering output changes
+RENDERER_VERSION = "3"
+
+# Precompiled style sheet applied to every chart
+CHART_STYLE = {
+    "axes.unicode_minus": False,
+    "axes.titlesize": 16,
+    "axes.titleweight": "bold",
+    "axes.titlepad": 20,
+    "axes.labelsize": 12,
+    "axes.labelpad": 10,
+    "axes.edgecolor": "gray",
+    "axes.linewidth": 0.5,
+    "grid.linestyle": "--",
+    "grid.alpha": 0.7,
+    "legend.fontsize": 10,
+}
+
+FIGURE_SIZE = (12, 8)
+CHART_DPI = 300
+
+# Output profiles selectable per report (ReportConfig.chart_profile / REPORT_CHART_PROFILE)
+CHART_PROFILES = {
+    # Lightweight PNG for on-screen reading and the base64 self-contained report
+    "screen": {"format": "png", "dpi": 120, "figure_size": (10, 6.5)},
+    # Screen PNG reduced to a 256-color palette
+    "screen_quantized": {"format": "png", "dpi": 120, "figure_size": (10, 6.5), "quantize": True},
+    # High resolution PNG for print and PDF output
+    "print": {"format": "png", "dpi": CHART_DPI, "figure_size": FIGURE_SIZE},
+    # Resolution independent vector output
+    "svg": {"format": "svg", "dpi": 72, "figure_size": FIGURE_SIZE},
+}
+DEFAULT_CHART_PROFILE = "print"
+
+# Content-addressed store of rendered charts shared by all reports
+CHART_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "industry_report", "charts")
+
+# Matplotlib colormap names for different chart types
+COLOR_SCHEMES = {
+    "bar": "Blues",
+    "line": "Oranges",
+    "pie": "Greens",
+    "scatter": "Purples",
+    "horizontal_bar": "Reds",
+    "stacked_bar": "YlOrBr",
+    "area": "PuBu",
+    "bubble": "RdYlBu",
+    "radar": "tab10",
+    "donut": "Pastel1"
+}
+
+# chart_type -> renderer(fig, spec) returning the Axes it drew on
+CHART_RENDERERS = {}
+
+def register_renderer(chart_type):
+    def decorator(func):
+        CHART_RENDERERS[chart_type] = func
+        return func
+    return decorator
+
+def _matching_series(spec):
+    """Additional series whose length matches the labels"""
+    series_list = spec["additional_series"]
+    for j, series in enumerate(series_list):
+        series_values = series.get("values", [])
+        if len(series_values) == len(spec["labels"]):
+            yield j, series.get("name", f"系列 {j+1}"), series_values
+
+@register_renderer("bar")
+def _render_bar(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    bars = ax.bar(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
+    # Add value labels on top of bars
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height + max(values)*0.01,
+                f'{height:.1f}', ha='center', va='bottom', fontsize=9)
+    return ax
+
+@register_renderer("horizontal_bar")
+def _render_horizontal_bar(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    bars = ax.barh(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
+    # Add value labels at end of bars
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + max(values)*0.01, bar.get_y() + bar.get_height()/2.,
+                f'{width:.1f}', ha='left', va='center', fontsize=9)
+    return ax
+
+@register_renderer("stacked_bar")
+def _render_stacked_bar(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    series_count = len(spec["additional_series"])
+    if series_count:
+        bottom = np.zeros(len(labels))
+        for j, series_name, series_values in _matching_series(spec):
+            ax.bar(labels, series_values, bottom=bottom,
+                   label=series_name, color=cmap(0.3 + 0.5*j/series_count))
+            bottom += np.array(series_values)
+        ax.legend(loc='best')
+    else:
+        ax.bar(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
+    return ax
+
+@register_renderer("line")
+def _render_line(fig, spec):
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    # Use markers and line style
+    ax.plot(labels, values, marker='o', linestyle='-', linewidth=2.5,
+            color=cmap(0.6), markersize=8, markerfacecolor=cmap(0.8))
+    # Add value labels above points
+    for pos, y in enumerate(values):
+        ax.text(pos, y + max(values)*0.02, f'{y:.1f}', ha='center', fontsize=9)
+    
+    # Handle multiple lines if additional series exist
+    series_count = len(spec["additional_series"])
+    if series_count:
+        for j, series_name, series_values in _matching_series(spec):
+            ax.plot(labels, series_values, marker='s', linestyle='--',
+                    label=series_name, color=cmap(0.3 + 0.5*j/series_count))
+        ax.legend(loc='best')
+    return ax
+
+@register_renderer("area")
+def _render_area(fig, spec):
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    positions = range(len(labels))
+    ax.fill_between(positions, values, alpha=0.5, color=cmap(0.6))
+    ax.plot(positions, values, 'o-', color=cmap(0.8))
+    ax.set_xticks(positions, labels)
+    return ax
+
+def _render_pie_wedges(ax, spec):
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    wedges, texts, autotexts = ax.pie(
+        values,
+        labels=None,  # We'll add custom legend
+        autopct='%1.1f%%',
+        startangle=90,
+        colors=[cmap(0.2 + 0.6*i/len(values)) for i in range(len(values))],
+        textprops={'fontsize': 10}
+    )
+    # Add legend with labels
+    ax.legend(wedges, labels, title="分类", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+    ax.axis('equal')
+    return wedges, autotexts
+
+@register_renderer("pie")
+def _render_pie(fig, spec):
+    ax = fig.add_subplot()
+    wedges, autotexts = _render_pie_wedges(ax, spec)
+    # Enhance text visibility
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontsize(9)
+    return ax
+
+@register_renderer("donut")
+def _render_donut(fig, spec):
+    from matplotlib.patches import Circle
+    ax = fig.add_subplot()
+    _render_pie_wedges(ax, spec)
+    # Make a hole in the center
+    ax.add_artist(Circle((0, 0), 0.70, fc='white'))
+    return ax
+
+@register_renderer("scatter")
+def _render_scatter(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    # Create scatter plot with varying point sizes if available
+    sizes = spec["sizes"] if len(spec["sizes"] or []) == len(values) else [50] * len(values)
+    positions = range(len(labels))
+    scatter = ax.scatter(positions, values, s=sizes, c=np.arange(len(labels)), cmap=cmap, alpha=0.7)
+    ax.set_xticks(positions, labels)
+    
+    # Add a colorbar if there are enough data points
+    if len(values) > 3:
+        fig.colorbar(scatter, ax=ax)
+    return ax
+
+@register_renderer("bubble")
+def _render_bubble(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot()
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    # Bubble chart with varying sizes
+    sizes = spec["sizes"] if len(spec["sizes"] or []) == len(values) else [v*10 for v in values]
+    x_pos = np.arange(len(labels))
+    ax.scatter(x_pos, values, s=sizes, alpha=0.6, c=x_pos, cmap=cmap, edgecolors='black')
+    ax.set_xticks(x_pos, labels)
+    return ax
+
+@register_renderer("radar")
+def _render_radar(fig, spec):
+    import numpy as np
+    ax = fig.add_subplot(polar=True)
+    labels, values = spec["labels"], spec["values"]
+    # Convert to radar coordinates and close the loop
+    angles = np.linspace(0, 2*np.pi, len(labels), endpoint=False).tolist()
+    closed_values = values + values[:1]
+    closed_angles = angles + angles[:1]
+    
+    ax.set_xticks(angles, labels, fontsize=10)
+    ax.plot(closed_angles, closed_values, 'o-', linewidth=2)
+    ax.fill(closed_angles, closed_values, alpha=0.25)
+    ax.set_rlabel_position(0)
+    
+    # Add value labels
+    for angle, value in zip(angles, values):
+        ax.text(angle, value*1.1, f'{value:.1f}', ha='center', va='center')
+    return ax
+
+def get_chart_profile(profile=None):
+    """
+    Resolve a profile name (or the REPORT_CHART_PROFILE environment variable) to its settings
+    """
+    name = profile or os.environ.get("REPORT_CHART_PROFILE") or DEFAULT_CHART_PROFILE
+    if name not in CHART_PROFILES:
+        print(f"Unknown chart profile '{name}', using '{DEFAULT_CHART_PROFILE}'")
+        name = DEFAULT_CHART_PROFILE
+    return name, CHART_PROFILES[name]
+
+def build_figure(chart_data, font_name, index=0, figure_size=FIGURE_SIZE):
+    """
+    Build the Figure for a chart spec; returns (figure, chart_type, chart_title),
+    or None if the spec is incomplete
+    """
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.artist import setp
+    chart_type = chart_data.get("chart_type", "bar").lower()
+    chart_title = chart_data.get("chart_title", f"图表 {index+1}")
+    data = chart_data.get("data", {})
+    
+    labels = list(data.get("labels", []))
+    values = list(data.get("values", []))
+    if not labels or not values or len(labels) != len(values):
+        print(f"Chart '{chart_title}' data incomplete or mismatched, skipping generation")
+        return None
+    
+    spec = {
+        "labels": labels,
+        "values": values,
+        # Handle additional data series if available
+        "additional_series": data.get("additional_series") or [],
+        "sizes": data.get("sizes"),
+        "cmap": matplotlib.colormaps[COLOR_SCHEMES.get(chart_type, COLOR_SCHEMES["bar"])],
+    }
+    # Unknown chart types default to a bar chart
+    renderer = CHART_RENDERERS.get(chart_type, CHART_RENDERERS["bar"])
+    
+    with matplotlib.rc_context({**CHART_STYLE, "font.family": font_name}):
+        fig = Figure(figsize=figure_size)
+        FigureCanvasAgg(fig)
+        ax = renderer(fig, spec)
+        
+        ax.set_title(chart_title)
+        if chart_type not in ["pie", "donut", "radar"]:
+            ax.set_xlabel(chart_data.get("x_label", ""))
+            ax.set_ylabel(chart_data.get("y_label", ""))
+            
+            # Rotate x-axis labels for better readability
+            if chart_type != "horizontal_bar":
+                setp(ax.get_xticklabels(), rotation=45, ha='right', fontsize=10)
+        
+        # Grid for better readability (except for pie and donut)
+        if chart_type not in ["pie", "donut"]:
+            ax.grid(True)
+        
+        fig.tight_layout()
+    return fig, chart_type, chart_title
+
+def get_chart_cache_dir():
+    """
+    Directory of the content-addressed chart store; set REPORT_CHART_CACHE_DIR=off to disable
+    """
+    cache_dir = os.environ.get("REPORT_CHART_CACHE_DIR", CHART_CACHE_DIR)
+    if cache_dir.lower() in ("", "off", "none", "0"):
+        return None
+    return cache_dir
+
+def _normalize_number(value):
+    try:
+        return round(float(value), 6)
+    except (TypeError, ValueError):
+        return value
+
+def normalize_chart_spec(chart_data, index=0):
+    """
+    Canonical form of a chart spec: only the fields that affect the rendered image,
+    with numbers normalized so that 12 and 12.0 hash the same
+    """
+    data = chart_data.get("data", {})
+    return {
+        "chart_type": chart_data.get("chart_type", "bar").lower(),
+        "chart_title": chart_data.get("chart_title", f"图表 {index+1}"),
+        "x_label": chart_data.get("x_label", ""),
+        "y_label": chart_data.get("y_label", ""),
+        "labels": [str(label) for label in data.get("labels", [])],
+        "values": [_normalize_number(v) for v in data.get("values", [])],
+        "additional_series": [
+            {"name": series.get("name", ""), "values": [_normalize_number(v) for v in series.get("values", [])]}
+            for series in data.get("additional_series") or []
+        ],
+        "sizes": [_normalize_number(v) for v in data.get("sizes") or []],
+    }
+
+def chart_cache_key(chart_data, font_name, profile_settings=None, index=0, backend="matplotlib"):
+    """
+    Content hash of a chart: normalized spec, renderer version and backend, style and output profile
+    """
+    payload = {
+        "spec": normalize_chart_spec(chart_data, index),
+        "renderer_version": RENDERER_VERSION,
+        "backend": backend,
+        "style": CHART_STYLE,
+        "font": font_name,
+        "profile": profile_settings or CHART_PROFILES[DEFAULT_CHART_PROFILE],
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def _link_or_copy(source, destination):
+    """Hard-link a cached image into place, copying when linking is not possible"""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def _quantize_png(path):
+    """Reduce a PNG to a 256-color palette (requires Pillow, which matplotlib depends on)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        print("Pillow not available, skipping PNG quantization")
+        return
+    with Image.open(path) as image:
+        quantized = image.convert("RGB").quantize(colors=256)
+    quantized.save(path, format="PNG", optimize=True)
+
+def _svg_rasterizer():
+    """cairosvg.svg2png when the optional cairosvg package (and the cairo library) is installed, else None"""
+    try:
+        import cairosvg
+    except (ImportError, OSError):
+        return None
+    return cairosvg.svg2png
+
+def render_chart(chart_data, index, output_dir, base_filename, font_name=None, profile=None,
+                 chart_fonts=None, font_path=None):
+    """
+    Render a single chart spec to <output_dir>/charts and return its chart info,
+    or None if the spec is incomplete or rendering fails.
+    Identical charts are rendered once into the chart cache and linked into place.
+    Without an explicit font_name the system fonts are only scanned (resolve_chinese_font with
+    chart_fonts/font_path) when the chart falls back to matplotlib; SVG charts list the
+    configured fonts ahead of svg_charts.SVG_FONT_FAMILIES and let the viewer pick one.
+    """
+    try:
+        chart_type = chart_data.get("chart_type", "bar").lower()
+        chart_title = chart_data.get("chart_title", f"图表 {index+1}")
+        profile_name, settings = get_chart_profile(profile)
+        output_format = settings["format"]
+        font_families = [*([font_name] if font_name else chart_fonts or []), *svg_charts.SVG_FONT_FAMILIES]
+        # Simple chart types are drawn by svg_charts under every profile: written as SVG directly
+        # (without the render cache), or rasterized to PNG when cairosvg is available
+        rasterize = None
+        if svg_charts.supports(chart_type):
+            if output_format == "svg":
+                return svg_charts.render_chart(chart_data, index, output_dir, base_filename,
+                                               settings["figure_size"], font_families)
+            rasterize = _svg_rasterizer()
+        backend = "svg" if rasterize else "matplotlib"
+        if backend == "matplotlib" and not font_name:
+            font_name = resolve_chinese_font(chart_fonts, font_path)
+        chart_filename = f"{base_filename}_chart_{index+1}.{output_format}"
+        chart_path = os.path.join(output_dir, "charts", chart_filename)
+        os.makedirs(os.path.dirname(chart_path), exist_ok=True)
+        chart_info = {
+            "index": index,
+            "title": chart_title,
+            "type": chart_type,
+            "path": chart_path,
+            "markdown_ref": f"![{chart_title}](charts/{chart_filename})"
+        }
+        
+        cache_dir = get_chart_cache_dir()
+        cached_path = None
+        if cache_dir:
+            cache_key = chart_cache_key(chart_data, font_name if backend == "matplotlib" else font_families,
+                                        settings, index=index, backend=backend)
+            cached_path = os.path.join(cache_dir, f"{cache_key}.{output_format}")
+            if os.path.exists(cached_path):
+                _link_or_copy(cached_path, chart_path)
+                print(f"Reused cached chart: {chart_title} -> {chart_path}")
+                chart_info["cached"] = True
+                return chart_info
+        
+        if rasterize:
+            built = svg_charts.build_svg(chart_data, index, settings["figure_size"], font_families)
+        else:
+            built = build_figure(chart_data, font_name, index, settings["figure_size"])
+        if built is None:
+            return None
+        
+        # Save chart using the profile's format and DPI; render into the cache first when enabled
+        target_path = cached_path or chart_path
+        if cached_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            target_path = f"{cached_path}.{os.getpid()}.tmp"
+        if rasterize:
+            # The SVG is laid out at PIXELS_PER_INCH; scale it to the profile's DPI
+            rasterize(bytestring=built[0].encode("utf-8"), write_to=target_path,
+                      scale=settings["dpi"] / svg_charts.PIXELS_PER_INCH)
+        else:
+            import matplotlib
+            with matplotlib.rc_context({**CHART_STYLE, "font.family": font_name}):
+                built[0].savefig(target_path, dpi=settings["dpi"], bbox_inches='tight', format=output_format)
+        if settings.get("quantize") and output_format == "png":
+            _quantize_png(target_path)
+        if cached_path:
+            # Atomic publish so concurrent workers never see a partial image
+            os.replace(target_path, cached_path)
+            _link_or_copy(cached_path, chart_path)
+        
+        print(f"Generated chart ({profile_name}, {backend}): {chart_title} -> {chart_path}")
+        chart_info["cached"] = False
+        return chart_info
+    except Exception as e:
+        print(f"Error generating chart '{chart_data.get('chart_title', f'Chart {index+1}')}': {str(e)}")
+        return None
+
+def render_charts(visualization_data, output_dir, base_filename, font_name=None, profile=None,
+                  chart_fonts=None, font_path=None):
+    """
+    Render all chart specs of a section in the current process
+    """
+    charts_info = []
+    for i, chart_data in enumerate(visualization_data):
+        chart_info = render_chart(chart_data, i, output_dir, base_filename, font_name, profile,
+                                  chart_fonts, font_path)
+        if chart_info:
+            charts_info.append(chart_info)
+    return charts_info
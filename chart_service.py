@@ -0,0 +1,79 @@
+# Chart rendering service backed by a pool of warm worker processes.
+# Matplotlib's pyplot state is global and not thread-safe, so charts are rendered in
+# separate processes. Simple chart types go through svg_charts; a worker only imports
+# matplotlib and resolves the chart font (once) when it meets a chart that falls back to it.
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Chart font settings of this worker process: (preferred fonts, font file path)
+_worker_font_config = (None, None)
+
+
+def _init_worker(chart_fonts, chart_font_path):
+    """Record the chart font settings; the font itself is resolved lazily by chart_renderer"""
+    global _worker_font_config
+    _worker_font_config = (chart_fonts, chart_font_path)
+
+
+def _render_job(chart_data, index, output_dir, base_filename, profile, output_format, figure_size):
+    if output_format == "svg":
+        import svg_charts
+        if svg_charts.supports(chart_data.get("chart_type", "bar")):
+            chart_fonts = _worker_font_config[0] or []
+            return svg_charts.render_chart(chart_data, index, output_dir, base_filename, figure_size,
+                                           [*chart_fonts, *svg_charts.SVG_FONT_FAMILIES])
+    import chart_renderer
+    return chart_renderer.render_chart(chart_data, index, output_dir, base_filename, None, profile, *_worker_font_config)
+
+
+class ChartRenderService:
+    """
+    Render chart specs in parallel across CPU cores.
+    
+    Usage:
+        with ChartRenderService() as service:
+            charts_info = service.render(visualization_data, output_dir, base_filename)
+    """
+    def __init__(self, max_workers=None, chart_fonts=None, chart_font_path=None, profile=None):
+        import chart_renderer
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Output profile (see chart_renderer.CHART_PROFILES); None uses the environment/default
+        self.profile, self.profile_settings = chart_renderer.get_chart_profile(profile)
+        # spawn avoids forking a parent that is already running API threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(chart_fonts, chart_font_path)
+        )
+
+    def submit(self, visualization_data, output_dir, base_filename):
+        """Queue every chart of a section and return the futures in chart order"""
+        return [
+            self._executor.submit(_render_job, chart_data, i, output_dir, base_filename, self.profile,
+                                  self.profile_settings["format"], self.profile_settings["figure_size"])
+            for i, chart_data in enumerate(visualization_data)
+        ]
+
+    def render(self, visualization_data, output_dir, base_filename):
+        """Render all charts of a section and return chart info for the successful ones"""
+        charts_info = []
+        for future in self.submit(visualization_data, output_dir, base_filename):
+            try:
+                chart_info = future.result()
+            except Exception as e:
+                print(f"Chart rendering worker failed: {str(e)}")
+                continue
+            if chart_info:
+                charts_info.append(chart_info)
+        return charts_info
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,93 @@
+# Localized edits for optimize_content's patch mode.
+# The model returns a JSON list of edits anchored on verbatim excerpts of the summary;
+# anchors are located exactly when possible, otherwise by fuzzy matching over sentence windows.
+import re
+from difflib import SequenceMatcher
+
+EDIT_OPERATIONS = {"replace", "insert_after", "insert_before", "delete"}
+
+# Minimum similarity for a fuzzy anchor match
+ANCHOR_MATCH_RATIO = 0.85
+# Longest run of consecutive sentences compared against one anchor
+MAX_WINDOW_SENTENCES = 4
+
+_SENTENCE_END = re.compile(r"[。！？；!?;]|\n")
+
+
+def _sentence_spans(content):
+    """(start, end) of each sentence, including its terminator"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(content):
+        if match.end() - start > 1:
+            spans.append((start, match.end()))
+        start = match.end()
+    if start < len(content):
+        spans.append((start, len(content)))
+    return spans
+
+def find_anchor(content, anchor):
+    """
+    Locate an anchor in content; returns (start, end) or None.
+    Exact match first, then the most similar window of whole sentences.
+    """
+    anchor = anchor.strip()
+    if not anchor:
+        return None
+    position = content.find(anchor)
+    if position >= 0:
+        return position, position + len(anchor)
+
+    best, best_ratio = None, ANCHOR_MATCH_RATIO
+    spans = _sentence_spans(content)
+    for i in range(len(spans)):
+        for j in range(i, min(i + MAX_WINDOW_SENTENCES, len(spans))):
+            start, end = spans[i][0], spans[j][1]
+            window = content[start:end].strip()
+            if len(window) > 2 * len(anchor):
+                break
+            matcher = SequenceMatcher(None, anchor, window, autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                # Trim the surrounding whitespace of the window from the span
+                offset = content[start:end].find(window)
+                best, best_ratio = (start + offset, start + offset + len(window)), ratio
+    return best
+
+def apply_edits(content, edits):
+    """
+    Apply edits to content. Returns (patched_content, failed_edits).
+    Each edit is {"op": replace|insert_after|insert_before|delete, "anchor": ..., "text": ...}.
+    """
+    located = []
+    failed = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            failed.append(edit)
+            continue
+        op = str(edit.get("op", "replace")).lower()
+        span = find_anchor(content, str(edit.get("anchor", ""))) if op in EDIT_OPERATIONS else None
+        if span is None:
+            failed.append(edit)
+            continue
+        located.append((span, op, str(edit.get("text", ""))))
+
+    # Apply from the end so earlier offsets stay valid; skip edits overlapping one already applied
+    patched = content
+    applied_start = len(content) + 1
+    for (start, end), op, text in sorted(located, key=lambda item: item[0][0], reverse=True):
+        if end > applied_start:
+            failed.append({"op": op, "anchor": content[start:end], "text": text})
+            continue
+        if op == "replace":
+            patched = patched[:start] + text + patched[end:]
+        elif op == "delete":
+            patched = patched[:start] + patched[end:]
+        elif op == "insert_after":
+            patched = patched[:end] + text + patched[end:]
+        else:
+            patched = patched[:start] + text + patched[start:]
+        applied_start = start
+    return patched, failed
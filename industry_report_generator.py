@@ -4,7 +4,7 @@ import json
 import time
 import logging
 import builtins
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -24,6 +24,32 @@ class ReportConfig:
     output_dir: str = "reports"  # 输出目录
     template_path: Optional[str] = None  # 可选的模板文件路径
     current_industry: str = ""  # 模板中的当前行业（如果使用模板）
+    enable_thinkcite: bool = False  # 是否启用Think&Cite内容增强阶段（step1_5）
+    thinkcite_max_workers: int = 3  # Think&Cite阶段单份报告的章节并发上限
+    thinkcite_prefilter_threshold: float = 0.35  # Think&Cite本地预筛阈值，低于该分数的分支不再调用LLM评估
+    chart_fonts: Optional[List[str]] = None  # 图表优先使用的中文字体列表（按顺序尝试）
+    chart_font_path: Optional[str] = None  # 图表字体文件路径，设置后优先于字体列表
+    step2_max_workers: int = 3  # step2中并发处理的章节数
+    chart_workers: Optional[int] = None  # 图表渲染进程数，默认为CPU核数
+    chart_cache_dir: Optional[str] = None  # 图表渲染缓存目录，设为"off"可禁用缓存
+    chart_profile: str = "print"  # 图表输出档位：screen / screen_quantized / print / svg
+    fused_chart_extraction: bool = False  # 在摘要调用中同时生成图表数据，省去单独的图表提取调用
+    optimize_mode: str = "patch"  # 内容优化方式：patch（局部修改，失败时整体重写）/ rewrite（整体重写）
+    refine_threshold: float = 8.0  # 反思评分（0-10）达到该值时跳过内容优化
+    refine_max_calls: int = 4  # 每个章节反思与优化调用的总次数上限
+    map_reduce_threshold: int = 24000  # 章节原始内容超过该token数时，先分块并行浓缩再汇总
+    max_continuations: int = 2  # 长回复因max_tokens截断时，最多续写的轮数
+    compress_source: bool = True  # 总结前在本地去除原始资料中的模板文字与重复句子
+    model_profile: str = "quality"  # 各调用类型的模型分配：quality / balanced / fast
+    reasoner_p95_seconds: float = 120.0  # deepseek-reasoner 近期p95延迟超过该值时降级为 deepseek-chat
+    router_window: int = 20  # 计算p95延迟与错误率的最近调用数
+    router_probe_seconds: float = 60.0  # 降级期间每隔该秒数放行一次 deepseek-reasoner 调用探测是否恢复
+    llm_providers: Optional[List[Dict[str, Any]]] = None  # 多个OpenAI兼容端点的配置（格式见 llm_providers.providers_from_env）
+    hedge_requests: bool = False  # 请求超过近期p90延迟未返回时，向另一供应商发送相同请求
+    token_budget: Optional[int] = None  # 整份报告的token预算，按章节原始资料规模与权重分配
+    usd_budget: Optional[float] = None  # 整份报告的费用预算（美元），可与token预算同时设置
+    section_weights: Optional[Dict[str, float]] = None  # {章节标题关键词: 权重}，默认权重为1
+    mcts_budget_share: float = 0.3  # 启用Think&Cite时，预算中分给该阶段的比例
 
 class IndustryReportGenerator:
     """行业报告生成器主类"""
@@ -47,11 +73,13 @@ class IndustryReportGenerator:
         try:
             import step0
             import step1_enhance as step1
+            import step1_5_enhance as step1_5
             import step2 as step2
             import step3
             
             self.step0 = step0
             self.step1 = step1
+            self.step1_5 = step1_5
             self.step2 = step2
             self.step3 = step3
         except ImportError as e:
@@ -66,6 +94,7 @@ class IndustryReportGenerator:
         # 创建各步骤的子目录
         self.step0_dir = os.path.join(self.config.output_dir, "step0")
         self.step1_dir = os.path.join(self.config.output_dir, "step1")
+        self.step1_5_dir = os.path.join(self.config.output_dir, "step1_5")
         self.step2_dir = os.path.join(self.config.output_dir, "step2")
         self.final_dir = os.path.join(self.config.output_dir, "final")
         
@@ -146,6 +175,49 @@ class IndustryReportGenerator:
             os.environ["REPORT_STEP1_DIR"] = self.step1_dir
             self.step1.main()
             
+            # 报告级token/费用预算，由step1_5与step2按章节分配
+            for env_name, value in (("REPORT_TOKEN_BUDGET", self.config.token_budget),
+                                    ("REPORT_USD_BUDGET", self.config.usd_budget)):
+                if value is not None:
+                    os.environ[env_name] = str(value)
+                else:
+                    os.environ.pop(env_name, None)
+            if self.config.section_weights:
+                os.environ["REPORT_SECTION_WEIGHTS"] = json.dumps(self.config.section_weights, ensure_ascii=False)
+            else:
+                os.environ.pop("REPORT_SECTION_WEIGHTS", None)
+            os.environ["REPORT_MCTS_BUDGET_SHARE"] = str(self.config.mcts_budget_share)
+            # LLM供应商与对冲请求，step1_5与step2各自按此创建客户端
+            if self.config.llm_providers:
+                os.environ["REPORT_LLM_PROVIDERS"] = json.dumps(self.config.llm_providers)
+            else:
+                os.environ.pop("REPORT_LLM_PROVIDERS", None)
+            os.environ["REPORT_HEDGE_REQUESTS"] = "1" if self.config.hedge_requests else "0"
+            
+            # 步骤1.5：Think&Cite内容增强（可选）
+            if self.config.enable_thinkcite:
+                if callback:
+                    callback("正在使用Think&Cite增强内容...", 35)
+                
+                logger.info("开始执行步骤1.5：Think&Cite内容增强")
+                os.makedirs(self.step1_5_dir, exist_ok=True)
+                enhance_report = self.step1_5.enhance_sections(
+                    self.config.industry,
+                    self.step1_dir,
+                    self.step1_5_dir,
+                    max_workers=self.config.thinkcite_max_workers,
+                    prefilter_threshold=self.config.thinkcite_prefilter_threshold
+                )
+                result["output_files"]["thinkcite_report"] = os.path.join(self.step1_5_dir, "processing_report.json")
+                logger.info(f"Think&Cite增强完成，共处理 {len(enhance_report['processed_files'])}/{enhance_report['total_files']} 个章节")
+                savings = enhance_report.get("prompt_savings", {}).get("total")
+                if savings:
+                    logger.info(f"引用压缩共 {savings['calls']} 次调用，节省 {savings['saved_chars']} 字符（{savings['saved_ratio']:.0%}）")
+                # 让step2在原始资料之外合并增强后的内容
+                os.environ["REPORT_STEP1_5_DIR"] = self.step1_5_dir
+            else:
+                os.environ.pop("REPORT_STEP1_5_DIR", None)
+            
             # 步骤2：内容优化
             if callback:
                 callback("正在优化内容...", 50)
@@ -155,7 +227,57 @@ class IndustryReportGenerator:
             os.environ["REPORT_STEP0_DIR"] = self.step0_dir
             os.environ["REPORT_STEP1_DIR"] = self.step1_dir
             os.environ["REPORT_STEP2_DIR"] = self.step2_dir
-            self.step2.main()
+            # 章节并发数与图表渲染进程数
+            os.environ["REPORT_STEP2_WORKERS"] = str(self.config.step2_max_workers)
+            os.environ["REPORT_CHART_WORKERS"] = str(self.config.chart_workers or 0)
+            if self.config.chart_cache_dir:
+                os.environ["REPORT_CHART_CACHE_DIR"] = self.config.chart_cache_dir
+            else:
+                os.environ.pop("REPORT_CHART_CACHE_DIR", None)
+            os.environ["REPORT_CHART_PROFILE"] = self.config.chart_profile
+            os.environ["REPORT_FUSED_CHARTS"] = "1" if self.config.fused_chart_extraction else "0"
+            os.environ["REPORT_OPTIMIZE_MODE"] = self.config.optimize_mode
+            os.environ["REPORT_REFINE_THRESHOLD"] = str(self.config.refine_threshold)
+            os.environ["REPORT_REFINE_MAX_CALLS"] = str(self.config.refine_max_calls)
+            os.environ["REPORT_MAP_REDUCE_TOKENS"] = str(self.config.map_reduce_threshold)
+            os.environ["REPORT_MAX_CONTINUATIONS"] = str(self.config.max_continuations)
+            os.environ["REPORT_COMPRESS_SOURCE"] = "1" if self.config.compress_source else "0"
+            os.environ["REPORT_MODEL_PROFILE"] = self.config.model_profile
+            os.environ["REPORT_REASONER_P95_SECONDS"] = str(self.config.reasoner_p95_seconds)
+            os.environ["REPORT_ROUTER_WINDOW"] = str(self.config.router_window)
+            os.environ["REPORT_ROUTER_PROBE_SECONDS"] = str(self.config.router_probe_seconds)
+            # 图表字体配置
+            if self.config.chart_fonts:
+                os.environ["REPORT_CHART_FONTS"] = ",".join(self.config.chart_fonts)
+            else:
+                os.environ.pop("REPORT_CHART_FONTS", None)
+            if self.config.chart_font_path:
+                os.environ["REPORT_CHART_FONT_PATH"] = self.config.chart_font_path
+            else:
+                os.environ.pop("REPORT_CHART_FONT_PATH", None)
+            chart_stats = self.step2.main()
+            if chart_stats:
+                logger.info(f"图表输出档位 {chart_stats['profile']}：共 {chart_stats['chart_count']} 张，"
+                            f"总大小 {chart_stats['total_bytes'] / 1024:.1f} KB")
+            if chart_stats and chart_stats.get("budget"):
+                result["output_files"]["token_budget"] = os.path.join(self.step2_dir, "token_budget.json")
+                budget = chart_stats["budget"]
+                logger.info(f"预算使用：{budget['spent_tokens']} tokens，约 ${budget['spent_usd']:.4f}，"
+                            f"{budget['degraded_sections']} 个章节因预算不足降级")
+            if chart_stats and chart_stats.get("routing"):
+                result["output_files"]["model_routing"] = os.path.join(self.step2_dir, "model_routing.json")
+                routing = chart_stats["routing"]
+                logger.info(f"模型路由（{routing['profile']}）：共 {routing['calls']} 次调用，降级 {routing['degraded_calls']} 次")
+                for model, cache in routing["cache"].items():
+                    logger.info(f"{model} 上下文缓存命中 {cache['cache_hit_tokens']}/{cache['prompt_tokens']} 输入tokens（{cache['hit_ratio']:.0%}）")
+            if chart_stats and chart_stats.get("compression"):
+                result["output_files"]["source_compression"] = os.path.join(self.step2_dir, "source_compression.json")
+                logger.info(f"原始资料压缩至 {chart_stats['compression']['ratio']:.0%}")
+            if chart_stats and chart_stats.get("fused_charts"):
+                result["output_files"]["fused_chart_stats"] = os.path.join(self.step2_dir, "fused_chart_stats.json")
+                fused = chart_stats["fused_charts"]
+                logger.info(f"摘要与图表合并调用：减少 {fused['avoided_calls']} 次调用，"
+                            f"约节省 {fused['saved_tokens']} tokens，约节省 {fused['saved_seconds_estimate']} 秒")
             
             # 步骤3：生成最终报告
             if callback:
@@ -245,7 +367,10 @@ def generate_report(
     template_path: Optional[str] = None,
     current_industry: str = "",
     callback: Optional[callable] = None,
-    output_format: str = "markdown"  # 添加输出格式参数
+    output_format: str = "markdown",  # 添加输出格式参数
+    enable_thinkcite: bool = False,
+    thinkcite_max_workers: int = 3,
+    thinkcite_prefilter_threshold: float = 0.35
 ) -> Dict[str, Any]:
     """
     生成行业报告的便捷函数
@@ -259,6 +384,9 @@ def generate_report(
         current_industry: 模板中的当前行业（如果使用模板）
         callback: 可选的进度回调函数
         output_format: 输出格式，可选值为"markdown"或"pdf"
+        enable_thinkcite: 是否启用Think&Cite内容增强阶段
+        thinkcite_max_workers: Think&Cite阶段的章节并发上限
+        thinkcite_prefilter_threshold: Think&Cite本地预筛阈值
     
     Returns:
         Dict包含生成报告的相关信息
@@ -269,7 +397,10 @@ def generate_report(
         zhipu_api_key=zhipu_api_key,  # 添加智谱API密钥
         output_dir=output_dir,
         template_path=template_path,
-        current_industry=current_industry
+        current_industry=current_industry,
+        enable_thinkcite=enable_thinkcite,
+        thinkcite_max_workers=thinkcite_max_workers,
+        thinkcite_prefilter_threshold=thinkcite_prefilter_threshold
     )
     
     generator = IndustryReportGenerator(config)
@@ -285,6 +416,9 @@ def main():
     parser.add_argument("--output-dir", default="reports", help="输出目录")
     parser.add_argument("--template", help="模板文件路径")
     parser.add_argument("--current-industry", help="模板中的当前行业")
+    parser.add_argument("--thinkcite", action="store_true", help="启用Think&Cite内容增强阶段")
+    parser.add_argument("--thinkcite-workers", type=int, default=3, help="Think&Cite阶段的章节并发数")
+    parser.add_argument("--thinkcite-prefilter", type=float, default=0.35, help="Think&Cite本地预筛阈值")
     
     args = parser.parse_args()
     
@@ -297,7 +431,10 @@ def main():
         output_dir=args.output_dir,
         template_path=args.template,
         current_industry=args.current_industry,
-        callback=progress_callback
+        callback=progress_callback,
+        enable_thinkcite=args.thinkcite,
+        thinkcite_max_workers=args.thinkcite_workers,
+        thinkcite_prefilter_threshold=args.thinkcite_prefilter
     )
     
     if result["success"]:
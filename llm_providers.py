@@ -0,0 +1,267 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from openai import OpenAI
+
+# 默认的 DeepSeek 端点
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+# 连续失败达到该次数后，供应商暂停接收请求 UNHEALTHY_COOLDOWN 秒，之后放行一次请求试探
+MAX_CONSECUTIVE_FAILURES = 3
+UNHEALTHY_COOLDOWN = 60.0
+
+# 对冲延迟：取主请求所在供应商近期延迟的 p90；样本不足时使用默认值
+HEDGE_PERCENTILE = 0.9
+DEFAULT_HEDGE_DELAY = 30.0
+MIN_HEDGE_DELAY = 2.0
+LATENCY_WINDOW = 50
+MIN_LATENCY_SAMPLES = 5
+
+# 对冲请求中落败的那次调用完成后的回调（参数为其响应）。调用方在发出请求前设置，
+# 用于为这次被丢弃但同样计费的调用记账（见 token_budget._MeteredClient）
+discarded_attempt_handler = contextvars.ContextVar("discarded_attempt_handler", default=None)
+
+
+class Provider:
+    """
+    一个 OpenAI 兼容的端点（DeepSeek、智谱 GLM 或本地替代服务）
+
+    models 将流水线中使用的模型名映射为该端点的模型名，例如 {"deepseek-chat": "glm-4-plus"}；
+    为 None 时按原名转发所有模型，否则只接收映射中列出的模型
+    """
+    def __init__(self, name, base_url, api_key, weight=1.0, models=None, client=None):
+        self.name = name
+        self.base_url = base_url
+        self.weight = weight
+        self.models = models
+        self.client = client or OpenAI(api_key=api_key, base_url=base_url)
+        # 模型名 -> 最近的成功调用耗时
+        self.latencies = {}
+        self.consecutive_failures = 0
+        self.unhealthy_since = None
+        self.calls = 0
+        self.failures = 0
+        self.hedge_wins = 0
+
+    def supports(self, model):
+        return self.models is None or model in self.models
+
+    def model_name(self, model):
+        return model if self.models is None else self.models[model]
+
+    def available(self, now):
+        """健康，或已过冷却期（半开状态，放行请求试探）"""
+        return self.unhealthy_since is None or now - self.unhealthy_since >= UNHEALTHY_COOLDOWN
+
+    def latency_percentile(self, model, percentile):
+        samples = sorted(self.latencies.get(model, []))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(percentile * (len(samples) - 1)))]
+
+
+class ProviderPool:
+    """
+    多供应商负载均衡，接口与 OpenAI 客户端一致（chat.completions.create），可直接替换客户端
+
+    按权重随机选择支持该模型且健康的供应商；请求失败时改发下一个供应商。
+    hedge=True 时，主请求超过其供应商近期 p90 延迟仍未返回，就向另一个供应商（只有一个时为同一供应商）
+    发送相同请求，采用先返回的结果。用完后调用 close()（或使用 with 语句）释放对冲线程池
+    """
+    def __init__(self, providers, hedge=False, max_workers=16):
+        if not providers:
+            raise ValueError("ProviderPool needs at least one provider")
+        self.providers = providers
+        self.hedge = hedge
+        self.hedged_requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if hedge else None
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def _candidates(self, model):
+        """按权重随机排序的可用供应商；支持该模型的供应商都在冷却期时仍全部尝试，不会全部停用"""
+        now = time.time()
+        with self._lock:
+            supported = [p for p in self.providers if p.supports(model)]
+            candidates = [p for p in supported if p.available(now)] or supported
+        if not candidates:
+            raise RuntimeError(f"No available provider for model {model}")
+        ordered = []
+        while candidates:
+            choice = random.choices(candidates, weights=[max(p.weight, 1e-6) for p in candidates])[0]
+            ordered.append(choice)
+            candidates.remove(choice)
+        return ordered
+
+    def _call(self, provider, model, kwargs):
+        start_time = time.time()
+        try:
+            response = provider.client.chat.completions.create(**dict(kwargs, model=provider.model_name(model)))
+        except Exception:
+            with self._lock:
+                provider.calls += 1
+                provider.failures += 1
+                provider.consecutive_failures += 1
+                if provider.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                    if provider.unhealthy_since is None:
+                        print(f"[providers] {provider.name} marked unhealthy after {provider.consecutive_failures} failures")
+                    provider.unhealthy_since = time.time()
+            raise
+        with self._lock:
+            provider.calls += 1
+            provider.consecutive_failures = 0
+            if provider.unhealthy_since is not None:
+                print(f"[providers] {provider.name} is healthy again")
+            provider.unhealthy_since = None
+            samples = provider.latencies.setdefault(model, [])
+            samples.append(time.time() - start_time)
+            del samples[:-LATENCY_WINDOW]
+        return response
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        candidates = self._candidates(model)
+        if self.hedge:
+            return self._create_hedged(model, candidates, kwargs)
+
+        last_error = None
+        for provider in candidates:
+            try:
+                return self._call(provider, model, kwargs)
+            except Exception as e:
+                print(f"[providers] {provider.name} failed: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def close(self):
+        """等待仍在进行的对冲请求结束（以便其费用记账），然后关闭线程池与各供应商客户端"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for provider in self.providers:
+            close = getattr(provider.client, "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _hedge_delay(self, provider, model):
+        p90 = provider.latency_percentile(model, HEDGE_PERCENTILE)
+        return DEFAULT_HEDGE_DELAY if p90 is None else max(p90, MIN_HEDGE_DELAY)
+
+    def _create_hedged(self, model, candidates, kwargs):
+        """主请求超过 p90 延迟后发出对冲请求；任一成功即返回，都失败时按顺序尝试其余供应商"""
+        handler = discarded_attempt_handler.get()
+        primary = candidates[0]
+        backup = candidates[1] if len(candidates) > 1 else primary
+        primary_future = self._executor.submit(self._call, primary, model, kwargs)
+        futures = {primary_future: primary}
+        done, _ = wait([primary_future], timeout=self._hedge_delay(primary, model))
+        if not done:
+            with self._lock:
+                self.hedged_requests += 1
+            futures[self._executor.submit(self._call, backup, model, kwargs)] = backup
+
+        last_error = None
+        waiting = set(futures)
+        while waiting:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    print(f"[providers] {futures[future].name} failed: {str(e)}")
+                    last_error = e
+                    continue
+                # 较慢的请求无法中途取消，其结果丢弃，但完成后仍交给回调记账
+                if future is not primary_future:
+                    with self._lock:
+                        futures[future].hedge_wins += 1
+                if handler is not None:
+                    for other in futures:
+                        if other is not future:
+                            other.add_done_callback(lambda f: f.exception() is None and handler(f.result()))
+                return response
+
+        for provider in [p for p in candidates if p not in futures.values()]:
+            try:
+                return self._call(provider, model, kwargs)
+            except Exception as e:
+                print(f"[providers] {provider.name} failed: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def check_health(self):
+        """
+        逐个请求供应商的模型列表，返回 {名称: 是否可达}。只报告结果，不改变供应商的健康状态：
+        部分端点没有 /models 接口，一次偶发错误也不应让供应商退出轮转，健康状态只由实际调用决定
+        """
+        results = {}
+        for provider in self.providers:
+            try:
+                provider.client.models.list()
+                results[provider.name] = True
+            except Exception as e:
+                print(f"[providers] Health check of {provider.name} failed: {str(e)}")
+                results[provider.name] = False
+        return results
+
+    def report(self):
+        """各供应商的调用次数、失败次数、对冲胜出次数与近期 p90 延迟"""
+        with self._lock:
+            return {
+                "hedged_requests": self.hedged_requests,
+                "providers": {
+                    p.name: {
+                        "calls": p.calls,
+                        "failures": p.failures,
+                        "hedge_wins": p.hedge_wins,
+                        "healthy": p.unhealthy_since is None,
+                        "p90": {model: p.latency_percentile(model, HEDGE_PERCENTILE) for model in p.latencies},
+                    }
+                    for p in self.providers
+                },
+            }
+
+
+def providers_from_env(default_api_key):
+    """
+    从 REPORT_LLM_PROVIDERS（JSON 列表）读取供应商配置，例如：
+    [{"name": "deepseek", "base_url": "https://api.deepseek.com", "api_key_env": "DS_API_KEY", "weight": 3},
+     {"name": "zhipu", "base_url": "https://open.bigmodel.cn/api/paas/v4/", "api_key_env": "ZHIPU_API_KEY",
+      "weight": 1, "models": {"deepseek-chat": "glm-4-plus"}}]
+    未配置时只有 DeepSeek 一个供应商
+    """
+    config = os.environ.get("REPORT_LLM_PROVIDERS")
+    if not config:
+        return [Provider("deepseek", DEEPSEEK_BASE_URL, default_api_key)]
+    providers = []
+    for item in json.loads(config):
+        api_key = os.environ.get(item.get("api_key_env", ""), "") or item.get("api_key") or default_api_key
+        providers.append(Provider(
+            item["name"], item["base_url"], api_key,
+            weight=float(item.get("weight", 1.0)), models=item.get("models")
+        ))
+    return providers
+
+
+def client_from_env(default_api_key):
+    """
+    流水线使用的客户端：只有一个供应商且未开启对冲（REPORT_HEDGE_REQUESTS=1）时为普通 OpenAI 客户端，
+    否则为 ProviderPool
+    """
+    providers = providers_from_env(default_api_key)
+    hedge = os.environ.get("REPORT_HEDGE_REQUESTS", "0") == "1"
+    if len(providers) == 1 and not hedge:
+        return providers[0].client
+    return ProviderPool(providers, hedge=hedge)
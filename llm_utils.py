@@ -0,0 +1,469 @@
+import re
+import threading
+import time
+
+# 粗略的token估算系数（参考DeepSeek官方说明：1个中文字符约0.6 token，1个英文字符约0.3 token）
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """
+    本地快速估算中英文混合文本的token数，不依赖分词器
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return int(cjk_count * CJK_TOKEN_RATIO + other_count * OTHER_TOKEN_RATIO) + 1
+
+
+def truncate_to_tokens(text, max_tokens, suffix="..."):
+    """
+    将文本截断到大约 max_tokens 个token以内
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    
+    # 按字符逐步累加估算，找到截断位置
+    budget = max_tokens - estimate_tokens(suffix)
+    used = 0.0
+    for index, char in enumerate(text):
+        used += CJK_TOKEN_RATIO if _CJK_PATTERN.match(char) else OTHER_TOKEN_RATIO
+        if used > budget:
+            return text[:index] + suffix
+    return text
+
+
+_BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?；;])")
+# 片段结尾：位于行尾的一个或多个引用标记
+_SNIPPET_END = re.compile(r"\[(?:ref)?\d+\](?:[ \t]*\[(?:ref)?\d+\])*[ \t]*(?=\n|$)")
+_TRAILING_MARKERS = re.compile(r"(?:\s*\[(?:ref)?\d+\])+\s*$")
+
+
+def _snippets(text):
+    """检索片段：到行尾的 [x]/[refN] 引用标记（含）为止的文本；最后一个标记之后的文本按空行分段"""
+    units, start = [], 0
+    for match in _SNIPPET_END.finditer(text):
+        units.append(text[start:match.end()])
+        start = match.end()
+    units.extend(_BLOCK_SEPARATOR.split(text[start:]))
+    return [unit.strip() for unit in units if unit.strip()]
+
+
+def split_into_chunks(text, max_tokens):
+    """
+    将长文本切分为不超过 max_tokens 的若干块
+    
+    以检索片段（到行尾的 [x]/[refN] 引用标记为止，片段内部可以有空行）为最小单位，保证引用标记与其
+    内容不被拆开；单个片段超长时再按句子切分，每一部分都带上该片段的引用标记
+    """
+    units = []
+    for snippet in _snippets(text):
+        if estimate_tokens(snippet) <= max_tokens:
+            units.append(snippet)
+            continue
+        trailing = _TRAILING_MARKERS.search(snippet)
+        marker = trailing.group(0).strip() if trailing else ""
+        body = snippet[:trailing.start()] if trailing else snippet
+        piece_tokens = max(max_tokens - estimate_tokens(marker) - 1, 1)
+        pieces, sentence_group = [], ""
+        for sentence in _SENTENCE_SPLIT.split(body):
+            if sentence_group and estimate_tokens(sentence_group + sentence) > piece_tokens:
+                pieces.append(sentence_group)
+                sentence_group = ""
+            sentence_group += sentence
+        if sentence_group.strip():
+            pieces.append(sentence_group)
+        units.extend(f"{truncate_to_tokens(piece.strip(), piece_tokens)} {marker}".strip() for piece in pieces)
+    
+    chunks = []
+    current, current_tokens = [], 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+# 各模型的上下文窗口与单次输出上限（token）
+MODEL_LIMITS = {
+    "deepseek-chat": {"context": 65536, "max_output": 8192},
+    "deepseek-reasoner": {"context": 65536, "max_output": 32768},
+}
+DEFAULT_MODEL_LIMITS = {"context": 32768, "max_output": 4096}
+
+# 本地估算存在误差，为上下文预留的余量
+CONTEXT_SAFETY_MARGIN = 512
+
+
+class PromptSlot:
+    """
+    提示词模板中的可变内容（原文、反馈等）
+    
+    priority 越小越先被裁剪；min_tokens 为裁剪下限，None 表示不可裁剪；
+    max_tokens 为该内容本身的长度上限；scales_output 表示输出长度随该内容规模变化
+    """
+    def __init__(self, text, priority=0, min_tokens=200, max_tokens=None, scales_output=True):
+        self.text = text or ""
+        self.priority = priority
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.scales_output = scales_output
+        self.name = None
+
+
+class PromptBuilder:
+    """
+    按模型预算组装一次LLM调用的消息
+    
+    固定指令原样保留，超出上下文预算时按优先级从低到高裁剪可变内容；
+    max_tokens 按可变内容规模动态计算：output_ratio × 内容token数，限制在 [min_output, max_output] 内，
+    且不超过模型输出上限与剩余上下文
+    
+    用法：
+        builder = PromptBuilder("deepseek-chat", min_output=500, max_output=2000, output_ratio=0.3)
+        builder.system("You are a helpful assistant.")
+        builder.user("请总结以下内容：\n{content}", content=PromptSlot(text))
+        response = client.chat.completions.create(**builder.build(), temperature=0.5)
+    """
+    def __init__(self, model, min_output=256, max_output=None, output_ratio=0.0):
+        self.model = model
+        self.limits = MODEL_LIMITS.get(model, DEFAULT_MODEL_LIMITS)
+        self.min_output = min_output
+        self.max_output = min(max_output or self.limits["max_output"], self.limits["max_output"])
+        self.output_ratio = output_ratio
+        # [(role, [fixed text or PromptSlot, ...])]
+        self._messages = []
+        self.input_tokens = 0
+        self.max_tokens = 0
+        self.trimmed = {}
+    
+    def system(self, text):
+        self._messages.append(("system", [text]))
+        return self
+    
+    def user(self, template, **slots):
+        """
+        添加用户消息；模板中的 {name} 由同名 slot 替换（按字面替换，模板中的其他花括号不受影响）
+        slot 可以是 PromptSlot 或字符串（按默认设置视为可裁剪内容）
+        """
+        parts = []
+        if slots:
+            pattern = re.compile(r"\{(" + "|".join(re.escape(name) for name in slots) + r")\}")
+            position = 0
+            for match in pattern.finditer(template):
+                parts.append(template[position:match.start()])
+                slot = slots[match.group(1)]
+                slot = slot if isinstance(slot, PromptSlot) else PromptSlot(slot)
+                slot.name = match.group(1)
+                parts.append(slot)
+                position = match.end()
+            parts.append(template[position:])
+        else:
+            parts.append(template)
+        self._messages.append(("user", parts))
+        return self
+    
+    def _slots(self):
+        return [part for _, parts in self._messages for part in parts if isinstance(part, PromptSlot)]
+    
+    def _desired_output(self, slots, slot_tokens):
+        scaled = sum(slot_tokens[id(slot)] for slot in slots if slot.scales_output)
+        return max(self.min_output, min(int(scaled * self.output_ratio), self.max_output))
+    
+    def build(self):
+        """返回可直接传给 chat.completions.create 的 model / messages / max_tokens"""
+        slots = self._slots()
+        texts = {}
+        slot_tokens = {}
+        for slot in slots:
+            text = slot.text
+            if slot.max_tokens is not None:
+                text = truncate_to_tokens(text, slot.max_tokens)
+            texts[id(slot)] = text
+            slot_tokens[id(slot)] = estimate_tokens(text)
+        fixed_tokens = sum(
+            estimate_tokens(part) for _, parts in self._messages for part in parts if not isinstance(part, PromptSlot)
+        )
+        
+        # 先按未裁剪的内容预留输出空间，再把输入压缩到剩余预算内
+        budget = self.limits["context"] - self._desired_output(slots, slot_tokens) - CONTEXT_SAFETY_MARGIN
+        excess = fixed_tokens + sum(slot_tokens.values()) - budget
+        for slot in sorted(slots, key=lambda s: s.priority):
+            if excess <= 0:
+                break
+            if slot.min_tokens is None:
+                continue
+            current = slot_tokens[id(slot)]
+            target = max(slot.min_tokens, current - excess)
+            if target >= current:
+                continue
+            texts[id(slot)] = truncate_to_tokens(texts[id(slot)], target)
+            slot_tokens[id(slot)] = estimate_tokens(texts[id(slot)])
+            excess -= current - slot_tokens[id(slot)]
+            self.trimmed[slot.name] = (current, slot_tokens[id(slot)])
+        if self.trimmed:
+            print(f"[{self.model}] Prompt trimmed to fit the context window: {self.trimmed}")
+        if excess > 0:
+            print(f"[{self.model}] Warning: prompt exceeds the context budget by ~{excess} tokens")
+        
+        messages = []
+        for role, parts in self._messages:
+            content = "".join(texts[id(part)] if isinstance(part, PromptSlot) else part for part in parts)
+            messages.append({"role": role, "content": content})
+        
+        self.input_tokens = fixed_tokens + sum(slot_tokens.values())
+        remaining = self.limits["context"] - self.input_tokens - CONTEXT_SAFETY_MARGIN
+        self.max_tokens = max(1, min(self._desired_output(slots, slot_tokens), remaining))
+        return {"model": self.model, "messages": messages, "max_tokens": self.max_tokens}
+
+
+def tail_to_tokens(text, max_tokens):
+    """
+    保留文本末尾大约 max_tokens 个token的内容
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0.0
+    for index in range(len(text) - 1, -1, -1):
+        used += CJK_TOKEN_RATIO if _CJK_PATTERN.match(text[index]) else OTHER_TOKEN_RATIO
+        if used > max_tokens:
+            return text[index + 1:]
+    return text
+
+
+# 续写请求：只回传被截断回复的末尾（作为assistant消息，保持user/assistant交替），
+# 避免重复支付整段回复的输入token
+CONTINUATION_PROMPT = "你的上一条回复因长度限制被截断，上面是它的结尾。请从截断处直接接着写完剩余内容，不要重复已输出的文字，不要添加任何说明。"
+
+# 续写时回传的末尾长度
+CONTINUATION_TAIL_TOKENS = 300
+# 续写开头与已有结尾重叠的最短判定长度（字符）
+_MIN_OVERLAP_CHARS = 8
+
+
+def merge_continuation(text, continuation):
+    """拼接续写内容，去掉续写开头重复的已有结尾"""
+    longest = min(len(text), len(continuation), 400)
+    for size in range(longest, _MIN_OVERLAP_CHARS - 1, -1):
+        if text.endswith(continuation[:size]):
+            return text + continuation[size:]
+    return text + continuation
+
+
+def complete_with_continuation(client, request, max_rounds=2, **params):
+    """
+    调用 chat.completions.create；回复因 max_tokens 截断（finish_reason == "length"）时，
+    回传原始消息与回复末尾请求续写，最多 max_rounds 轮。
+    request 为 PromptBuilder.build() 的结果，params 为 temperature 等其余参数。
+    返回 (完整回复, 续写轮数)
+    """
+    response = client.chat.completions.create(**request, **params)
+    choice = response.choices[0]
+    text = choice.message.content or ""
+    rounds = 0
+    while getattr(choice, "finish_reason", None) == "length" and text and rounds < max_rounds:
+        rounds += 1
+        print(f"[{request['model']}] Reply truncated at max_tokens, requesting continuation {rounds}/{max_rounds}")
+        messages = request["messages"] + [
+            {"role": "assistant", "content": tail_to_tokens(text, CONTINUATION_TAIL_TOKENS)},
+            {"role": "user", "content": CONTINUATION_PROMPT},
+        ]
+        response = client.chat.completions.create(**dict(request, messages=messages), **params)
+        choice = response.choices[0]
+        text = merge_continuation(text, choice.message.content or "")
+    if getattr(choice, "finish_reason", None) == "length":
+        print(f"[{request['model']}] Reply still truncated after {rounds} continuation rounds")
+    return text, rounds
+
+
+# 各调用类型使用的模型；quality 即原有的固定分配
+ROUTING_PROFILES = {
+    "quality": {
+        "summarize": "deepseek-reasoner",
+        "visualize": "deepseek-reasoner",
+        "optimize": "deepseek-reasoner",
+        "reflect": "deepseek-chat",
+        "repair": "deepseek-chat",
+        "condense": "deepseek-chat",
+    },
+    "balanced": {
+        "summarize": "deepseek-reasoner",
+        "visualize": "deepseek-chat",
+        "optimize": "deepseek-reasoner",
+        "reflect": "deepseek-chat",
+        "repair": "deepseek-chat",
+        "condense": "deepseek-chat",
+    },
+    "fast": {
+        "summarize": "deepseek-chat",
+        "visualize": "deepseek-chat",
+        "optimize": "deepseek-chat",
+        "reflect": "deepseek-chat",
+        "repair": "deepseek-chat",
+        "condense": "deepseek-chat",
+    },
+}
+DEFAULT_ROUTING_PROFILE = "quality"
+# 降级目标：慢模型 -> 快模型
+MODEL_FALLBACKS = {"deepseek-reasoner": "deepseek-chat"}
+
+
+class ModelRouter:
+    """
+    按调用类型选择模型：先查配置档位，再根据近期延迟与错误率决定是否降级
+    
+    某模型最近 window 次调用的 p95 延迟超过 p95_threshold 秒，或错误率超过 error_threshold 时，
+    原本分配给它的调用改用 MODEL_FALLBACKS 中的模型；降级后每隔 probe_interval 秒放行一次原模型的调用，
+    探测调用成功且耗时不超过 p95_threshold 时清空该模型的统计窗口，流量立即回到原模型，
+    不必等窗口被新样本填满。所有决策都会记录下来
+    """
+    def __init__(self, profile=None, p95_threshold=120.0, error_threshold=0.3, window=20, min_samples=5, probe_interval=60.0):
+        self.profile = profile if profile in ROUTING_PROFILES else DEFAULT_ROUTING_PROFILE
+        self.routes = ROUTING_PROFILES[self.profile]
+        self.p95_threshold = p95_threshold
+        self.error_threshold = error_threshold
+        self.window = window
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        # model -> [(latency, ok), ...]，只保留最近 window 次
+        self._samples = {}
+        # 处于降级状态的模型 -> 上次放行探测调用的时间
+        self._degraded = {}
+        # 已放行探测调用、尚未返回结果的模型
+        self._probing = set()
+        self.decisions = []
+        # 每次调用的token用量，含服务端上下文缓存命中的输入token数
+        self.usage = []
+        self._lock = threading.Lock()
+    
+    def record(self, model, latency, ok=True, usage=None):
+        """记录一次调用的耗时与结果；usage 为 API 返回的 usage 对象"""
+        with self._lock:
+            samples = self._samples.setdefault(model, [])
+            if model in self._probing:
+                self._probing.discard(model)
+                if ok and latency <= self.p95_threshold:
+                    # 探测成功：丢弃降级前的慢样本，下次选择时即恢复
+                    print(f"[router] Probe of {model} succeeded in {latency:.1f}s, clearing its latency window")
+                    samples.clear()
+            samples.append((latency, ok))
+            del samples[:-self.window]
+            if usage is not None:
+                self.usage.append({
+                    "model": model,
+                    "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                    "cache_hit_tokens": getattr(usage, "prompt_cache_hit_tokens", 0) or 0,
+                    "cache_miss_tokens": getattr(usage, "prompt_cache_miss_tokens", 0) or 0,
+                    "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+                })
+    
+    def stats(self, model):
+        """最近调用的 p95 延迟与错误率；样本不足时返回 None"""
+        with self._lock:
+            samples = list(self._samples.get(model, []))
+        if len(samples) < self.min_samples:
+            return None
+        latencies = sorted(latency for latency, _ in samples)
+        p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+        error_rate = sum(1 for _, ok in samples if not ok) / len(samples)
+        return {"p95": p95, "error_rate": error_rate, "samples": len(samples)}
+    
+    def mean_latency(self, model):
+        """最近成功调用的平均耗时（秒）；没有样本时返回 None"""
+        with self._lock:
+            latencies = [latency for latency, ok in self._samples.get(model, []) if ok]
+        return sum(latencies) / len(latencies) if latencies else None
+    
+    def choose(self, call_type):
+        """返回本次调用使用的模型"""
+        preferred = self.routes.get(call_type, "deepseek-chat")
+        fallback = MODEL_FALLBACKS.get(preferred)
+        stats = self.stats(preferred) if fallback else None
+        unhealthy = stats is not None and (stats["p95"] > self.p95_threshold or stats["error_rate"] > self.error_threshold)
+        now = time.time()
+        model, reason = preferred, "profile"
+        with self._lock:
+            if fallback and unhealthy:
+                if preferred not in self._degraded:
+                    print(f"[router] {preferred} degraded to {fallback}: p95 {stats['p95']:.1f}s, errors {stats['error_rate']:.0%}")
+                    self._degraded[preferred] = now
+                    model, reason = fallback, "degraded"
+                elif now - self._degraded[preferred] >= self.probe_interval:
+                    # 放行一次原模型调用，刷新其统计
+                    self._degraded[preferred] = now
+                    self._probing.add(preferred)
+                    reason = "probe"
+                else:
+                    model, reason = fallback, "degraded"
+            elif preferred in self._degraded:
+                del self._degraded[preferred]
+                print(f"[router] {preferred} recovered")
+            self.decisions.append({"time": round(now, 3), "call_type": call_type, "model": model, "reason": reason})
+        return model
+    
+    def instrument(self, client):
+        """包装客户端：经由它发出的每次调用都计入对应模型的延迟与错误统计"""
+        return _InstrumentedClient(client, self)
+    
+    def report(self):
+        """路由汇总：各调用类型的模型分布、降级次数与各模型的近期统计"""
+        with self._lock:
+            decisions = list(self.decisions)
+            models = list(self._samples)
+            usage = list(self.usage)
+        by_type = {}
+        for decision in decisions:
+            counts = by_type.setdefault(decision["call_type"], {})
+            counts[decision["model"]] = counts.get(decision["model"], 0) + 1
+        return {
+            "profile": self.profile,
+            "calls": len(decisions),
+            "degraded_calls": sum(1 for d in decisions if d["reason"] == "degraded"),
+            "by_call_type": by_type,
+            "models": {model: self.stats(model) for model in models},
+            "cache": cache_summary(usage),
+            "decisions": decisions,
+            "usage": usage,
+        }
+
+
+class _InstrumentedClient:
+    """与 OpenAI 客户端接口一致（chat.completions.create），在调用前后记录耗时"""
+    def __init__(self, client, router):
+        self._client = client
+        self._router = router
+        self.chat = self
+        self.completions = self
+    
+    def create(self, **kwargs):
+        start_time = time.time()
+        try:
+            response = self._client.chat.completions.create(**kwargs)
+        except Exception:
+            self._router.record(kwargs.get("model"), time.time() - start_time, ok=False)
+            raise
+        self._router.record(kwargs.get("model"), time.time() - start_time, ok=True, usage=getattr(response, "usage", None))
+        return response
+
+
+def cache_summary(usage):
+    """按模型汇总输入token中命中服务端上下文缓存的比例"""
+    summary = {}
+    for call in usage:
+        totals = summary.setdefault(call["model"], {"calls": 0, "prompt_tokens": 0, "cache_hit_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += call["prompt_tokens"]
+        totals["cache_hit_tokens"] += call["cache_hit_tokens"]
+    for totals in summary.values():
+        totals["hit_ratio"] = round(totals["cache_hit_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0
+    return summary
@@ -3,6 +3,7 @@ import time
 import json
 import re
 from openai import OpenAI
+from llm_utils import PromptBuilder, PromptSlot
 
 # 请确保环境变量 API_KEY 已设置，否则请直接在下面替换为你的 API Key
 API_KEY = os.environ.get("DS_API_KEY", "deepseek-api-key")
@@ -99,18 +100,16 @@ class TemplateGeneralizer:
 
 报告模板内容：
 
-"""
+{{content}}"""
         
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that analyzes document structure and extracts outlines."},
-            {"role": "user", "content": prompt + content}
-        ]
+        # 大纲只保留标题与主题，输出规模约为模板的一半
+        builder = PromptBuilder("deepseek-chat", min_output=2000, max_output=6000, output_ratio=0.5)
+        builder.system("You are a helpful assistant that analyzes document structure and extracts outlines.")
+        builder.user(prompt, content=PromptSlot(content))
         
         try:
             response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                max_tokens=4000,
+                **builder.build(),
                 temperature=0.2,
                 response_format={"type": "json_object"}
             )
@@ -213,21 +212,19 @@ class TemplateGeneralizer:
 当前行业关键词：{self.current_industry if self.current_industry else "未指定"}
 
 原始报告大纲：
-{json.dumps(self.specific_outline, ensure_ascii=False, indent=2)}
+{{outline}}
 
 请返回完整的通用模板JSON。
 """
         
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that generalizes document templates."},
-            {"role": "user", "content": prompt}
-        ]
+        # 通用模板与原大纲结构相同，输出规模与输入相当；大纲不可裁剪，否则章节会丢失
+        builder = PromptBuilder("deepseek-chat", min_output=2000, max_output=8000, output_ratio=1.2)
+        builder.system("You are a helpful assistant that generalizes document templates.")
+        builder.user(prompt, outline=PromptSlot(json.dumps(self.specific_outline, ensure_ascii=False, indent=2), min_tokens=None))
         
         try:
             response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                max_tokens=4000,
+                **builder.build(),
                 temperature=0.2,
                 response_format={"type": "json_object"}
             )
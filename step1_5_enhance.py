@@ -3,9 +3,14 @@ import time
 import json
 import re
 import uuid
+import threading
 import requests
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from math import log  # Moved this import to the top
+from llm_utils import estimate_tokens, truncate_to_tokens, PromptBuilder, PromptSlot
+import llm_providers
+import token_budget
 
 # 获取API Key（请确保环境变量已设置）
 ZHIPU_API_KEY = os.environ.get("ZHIPU_API_KEY", "zhipu-api-key")
@@ -18,27 +23,129 @@ zhipu_headers = {
 }
 zhipu_api_url = "https://open.bigmodel.cn/api/paas/v4/tools"
 
-# 初始化deepseek客户端
-ds_client = OpenAI(api_key=DS_API_KEY, base_url="https://api.deepseek.com")
+# 本地启发式预筛的默认阈值，低于该分数的分支不再调用LLM评估（REPORT_THINKCITE_PREFILTER）
+DEFAULT_PREFILTER_THRESHOLD = 0.35
+
+def create_ds_client():
+    """
+    按当前环境变量创建deepseek客户端（配置了 REPORT_LLM_PROVIDERS 时为多供应商负载均衡），
+    每份报告创建一次，用完后调用 close()
+    """
+    return llm_providers.client_from_env(os.environ.get("DS_API_KEY", DS_API_KEY))
+
+class CitationPool:
+    """
+    报告级引用缓存池：对搜索查询做归一化后缓存 search_references 的结果，
+    供同一棵MCTS树的各节点以及同一行业的各章节复用，避免重复的网络请求
+    """
+    def __init__(self):
+        self._results = {}  # 归一化查询 -> 引用列表
+        self._by_url = {}  # url -> 引用字典，相同来源只保留一份
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(search_query):
+        """归一化查询：统一大小写和标点，去重并排序词项，使词序不同的相同查询命中同一缓存"""
+        text = re.sub(r"[，,、;；:：\"'“”‘’()（）\[\]]+", " ", search_query.lower())
+        terms = sorted(set(text.split()))
+        return " ".join(terms)
+
+    def get(self, search_query):
+        key = self.normalize_query(search_query)
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return list(self._results[key])
+            self.misses += 1
+            return None
+
+    def put(self, search_query, references):
+        """写入缓存；空结果不缓存，以便后续仍可重试"""
+        if not references:
+            return references
+        key = self.normalize_query(search_query)
+        with self._lock:
+            pooled = []
+            for ref in references:
+                url = ref.get("url", "")
+                if url:
+                    ref = self._by_url.setdefault(url, ref)
+                pooled.append(ref)
+            self._results[key] = pooled
+        return list(pooled)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queries": len(self._results),
+                "unique_citations": len(self._by_url),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+def summarize_prompt_savings(prompt_stats):
+    """
+    按调用名汇总 record_prompt_saving 记录的引用压缩效果（调用次数、压缩前后字符数、节省比例），
+    并附带所有调用的合计
+    """
+    summary = {}
+    for entry in prompt_stats:
+        for name in (entry["call"], "total"):
+            item = summary.setdefault(name, {"calls": 0, "original_chars": 0, "compact_chars": 0})
+            item["calls"] += 1
+            item["original_chars"] += entry["original_chars"]
+            item["compact_chars"] += entry["compact_chars"]
+    for item in summary.values():
+        item["saved_chars"] = item["original_chars"] - item["compact_chars"]
+        item["saved_ratio"] = round(item["saved_chars"] / item["original_chars"], 3) if item["original_chars"] else 0.0
+    return summary
+
 
 class ThinkCiteProcessor:
     """
     实现Think&Cite框架的处理器，使用自引导蒙特卡洛树搜索（SG-MCTS）增强内容生成
     """
-    def __init__(self):
+    def __init__(self, citation_pool=None, prefilter_threshold=DEFAULT_PREFILTER_THRESHOLD, budget=None, client=None):
         self.zhipu_api_url = zhipu_api_url
         self.zhipu_headers = zhipu_headers
-        self.ds_client = ds_client
+        # 章节的token预算（token_budget.SectionBudget），用尽后提前结束MCTS迭代
+        self.budget = budget
+        # deepseek客户端，通常由调用方创建并负责关闭；未传入时按当前环境变量创建
+        if client is None:
+            client = create_ds_client()
+        self.ds_client = budget.meter(client, "mcts") if budget is not None else client
         self.mcts_depth = 3
         self.mcts_iterations = 5
         self.ucb_c = 1.41  # UCB算法的探索参数
+        # 引用缓存池，未传入时仅在当前处理器内共享
+        self.citation_pool = citation_pool if citation_pool is not None else CitationPool()
+        # 本地启发式预筛阈值，低于该分数的分支不再调用LLM评估
+        self.prefilter_threshold = prefilter_threshold
+        # 每条引用片段写入提示词时的token上限
+        self.citation_token_cap = 120
+        # 每次调用的提示词压缩统计
+        self.prompt_stats = []
 
     def search_references(self, query, keyword, retry_count=3):
         """
-        搜索相关参考资料作为引用来源
+        搜索相关参考资料作为引用来源，优先从引用缓存池中读取
         """
-        all_content = []
         search_query = f"{keyword} {query}"
+        cached = self.citation_pool.get(search_query)
+        if cached is not None:
+            print(f"命中引用缓存: {search_query}")
+            return cached
+        
+        references = self._fetch_references(search_query, retry_count)
+        return self.citation_pool.put(search_query, references)
+
+    def _fetch_references(self, search_query, retry_count=3):
+        """
+        调用搜索API获取引用资料
+        """
         print(f"正在搜索引用资料: {search_query}")
         
         messages = [{"role": "user", "content": search_query}]
@@ -93,18 +200,54 @@ class ThinkCiteProcessor:
         
         return []
 
+    def compact_citations(self, citations):
+        """
+        将引用压缩为仅含编号、标题、域名和截断片段的精简结构，
+        不再把完整的 content 字段写入提示词
+        """
+        compact = []
+        for i, cite in enumerate(citations):
+            compact.append({
+                "id": i + 1,
+                "title": cite.get("title", ""),
+                "domain": urlparse(cite.get("url", "")).netloc,
+                "snippet": truncate_to_tokens(cite.get("snippet") or cite.get("content", ""), self.citation_token_cap)
+            })
+        return compact
+
+    def record_prompt_saving(self, call_name, original_size, compact_size):
+        """
+        记录并打印单次调用中引用压缩节省的提示词字符数
+        """
+        saved = original_size - compact_size
+        ratio = saved / original_size if original_size else 0.0
+        self.prompt_stats.append({
+            "call": call_name,
+            "original_chars": original_size,
+            "compact_chars": compact_size,
+            "saved_ratio": round(ratio, 3)
+        })
+        print(f"[{call_name}] 引用压缩: {original_size} -> {compact_size} 字符，节省 {ratio:.0%}")
+
     def evaluate_citation_quality(self, text, citations):
         """
         评估引用质量，包括引用召回率和精确率
         """
+        citations_payload = json.dumps(self.compact_citations(citations), ensure_ascii=False, separators=(",", ":"))
+        self.record_prompt_saving(
+            "evaluate_citation_quality",
+            len(json.dumps(citations, ensure_ascii=False, indent=2)),
+            len(citations_payload)
+        )
+        
         prompt = f"""
 请评估以下文本中引用的质量。文本内容如下：
 
-{text}
+{{text}}
 
 引用的资料如下：
 
-{json.dumps(citations, ensure_ascii=False, indent=2)}
+{{citations}}
 
 请从以下几个方面对引用质量评分（0-10分）：
 1. 引用精确率：引用的资料是否准确支持文本中的论点？
@@ -114,18 +257,17 @@ class ThinkCiteProcessor:
 
 请给出分数并解释原因。
 """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant specialized in evaluating citation quality."},
-            {"role": "user", "content": prompt}
-        ]
+        builder = PromptBuilder("deepseek-chat", min_output=1000)
+        builder.system("You are a helpful assistant specialized in evaluating citation quality.")
+        builder.user(prompt, text=PromptSlot(text, priority=1, scales_output=False),
+                     citations=PromptSlot(citations_payload, scales_output=False))
+        request = builder.build()
         
         try:
             for retry in range(3):  # 添加重试机制
                 try:
                     response = self.ds_client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=messages,
-                        max_tokens=1000,
+                        **request,
                         temperature=0.2,
                         stream=False
                     )
@@ -161,7 +303,7 @@ class ThinkCiteProcessor:
         prompt = f"""
 请评估以下行业报告内容的质量。内容如下：
 
-{text[:3000] + "..." if len(text) > 3000 else text}
+{{text}}
 
 请从以下几个方面对内容质量评分（0-10分）：
 1. 内容专业性：内容是否体现行业专业知识和深度？
@@ -171,18 +313,17 @@ class ThinkCiteProcessor:
 
 请给出分数并解释原因。
 """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant specialized in evaluating content quality."},
-            {"role": "user", "content": prompt}
-        ]
+        # 评分只需要内容的前段，按token而非字符数截断
+        builder = PromptBuilder("deepseek-chat", min_output=1000)
+        builder.system("You are a helpful assistant specialized in evaluating content quality.")
+        builder.user(prompt, text=PromptSlot(text, max_tokens=1800, scales_output=False))
+        request = builder.build()
         
         try:
             for retry in range(3):  # 添加重试机制
                 try:
                     response = self.ds_client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=messages,
-                        max_tokens=1000,
+                        **request,
                         temperature=0.2,
                         stream=False
                     )
@@ -211,6 +352,62 @@ class ThinkCiteProcessor:
             print(f"评估内容质量时出错: {str(e)}")
             return 0.4, "评估内容质量失败。"
 
+    def local_reward(self, text, citations):
+        """
+        本地启发式评分（0-1），在LLM评估之前快速筛除明显较差的分支
+        
+        综合考虑引用标记密度、带引用标记的句子占比、数字与引用片段的重合度、
+        文本长度以及重复度，不发起任何API调用
+        """
+        details = {}
+        body = text.strip()
+        if not body:
+            return 0.0, details
+        
+        sentences = [s for s in re.split(r"(?<=[。！？!?；;])|\n+", body) if len(s.strip()) > 5]
+        markers = re.findall(r"\[(\d+)\]", body)
+        
+        # 1. 引用标记密度：约每200字一个标记视为满分
+        density = len(markers) / max(len(body) / 200.0, 1.0)
+        details["marker_density"] = min(density, 1.0)
+        
+        # 2. 带引用标记的句子占比
+        cited_sentences = [s for s in sentences if re.search(r"\[\d+\]", s)]
+        details["cited_sentence_ratio"] = len(cited_sentences) / len(sentences) if sentences else 0.0
+        
+        # 3. 引用编号是否有效（不超出引用列表范围）
+        if markers:
+            valid = [m for m in markers if 1 <= int(m) <= len(citations)]
+            details["valid_marker_ratio"] = len(valid) / len(markers)
+        else:
+            details["valid_marker_ratio"] = 0.0
+        
+        # 4. 文本中的数字能否在引用片段中找到
+        numbers = set(re.findall(r"\d+(?:\.\d+)?", re.sub(r"\[\d+\]", "", body)))
+        numbers = {n for n in numbers if len(n) > 1}  # 忽略个位数序号
+        if numbers:
+            source_text = " ".join(c.get("content") or c.get("snippet", "") for c in citations)
+            details["number_overlap"] = sum(1 for n in numbers if n in source_text) / len(numbers)
+        else:
+            details["number_overlap"] = 1.0
+        
+        # 5. 长度检查：内容过短视为不完整
+        details["length"] = min(len(body) / 300.0, 1.0)
+        
+        # 6. 重复度检查：重复句子越多得分越低
+        normalized = [re.sub(r"\s+|\[\d+\]", "", s) for s in sentences]
+        details["uniqueness"] = len(set(normalized)) / len(normalized) if normalized else 0.0
+        
+        score = (
+            0.2 * details["marker_density"]
+            + 0.2 * details["cited_sentence_ratio"]
+            + 0.15 * details["valid_marker_ratio"]
+            + 0.2 * details["number_overlap"]
+            + 0.1 * details["length"]
+            + 0.15 * details["uniqueness"]
+        )
+        return score, details
+
     def generate_with_citations(self, content, section_title, keyword):
         """
         使用Think&Cite框架生成带引用的内容
@@ -229,9 +426,8 @@ class ThinkCiteProcessor:
         
         best_node = self.mcts_search(root_node, content, section_title, keyword)
         
-        # 构建最终带引用的文本
-        final_text = best_node["text"]
-        citations = best_node["citations"]
+        # 构建最终带引用的文本：最优路径上的全部段落
+        final_text, citations = self.assemble_path(best_node)
         
         # 添加引用列表
         if citations:
@@ -248,13 +444,27 @@ class ThinkCiteProcessor:
         print(f"开始MCTS搜索，共{self.mcts_iterations}轮迭代...")
         
         for iteration in range(self.mcts_iterations):
+            # 预算不足以再支付一轮（按已完成迭代的平均消耗估算）时提前结束，使用当前最优分支
+            if self.budget is not None and iteration > 0:
+                per_iteration = self.budget.spent_tokens / iteration
+                if not self.budget.can_afford("deepseek-reasoner", 0, int(per_iteration)):
+                    self.budget.skip(f"mcts iterations {iteration + 1}-{self.mcts_iterations}")
+                    break
             print(f"第{iteration+1}轮MCTS迭代...")
             
             # 选择
             selected_node = self.selection(root_node)
+            if selected_node.get("exhausted"):
+                # 该节点的子分支已全部剪枝，跳过，避免对已评估过的节点重复调用LLM评估
+                if selected_node is root_node:
+                    print("所有分支均已被剪枝或穷尽，提前结束MCTS搜索")
+                    break
+                continue
             
             # 扩展
             if selected_node["depth"] < self.mcts_depth and (not selected_node["children"]):
+                # 节点被选中扩展时才生成反思记忆，供其子节点继承
+                self.apply_pending_reflexion(selected_node)
                 expanded_nodes = self.expansion(selected_node, original_content, section_title, keyword)
                 
                 # 评估每个新节点
@@ -266,12 +476,47 @@ class ThinkCiteProcessor:
                 reward = self.evaluation(selected_node)
                 self.backpropagation(selected_node, reward)
         
-        # 返回访问次数最多的子节点作为最终结果
-        if not root_node["children"]:
-            return root_node
+        # 从根节点起逐层选择访问次数最多的子节点，返回这条最优路径上最深的节点
+        best_node = root_node
+        while best_node["children"]:
+            # 优先在未被剪枝的分支中选择；根节点的子节点全部被剪枝时仍取其一
+            candidates = [child for child in best_node["children"] if not child.get("pruned")]
+            if not candidates and best_node is root_node:
+                candidates = root_node["children"]
+            if not candidates:
+                break
+            best_node = max(candidates, key=lambda child: child["visits"])
+        return best_node
+
+    def assemble_path(self, node):
+        """
+        拼接从根节点到 node 的各段内容，并把各段的引用编号改为合并后的引用列表中的编号
+        
+        每个节点的引用编号只对应该节点自己的 citations，同一URL的引用合并为一条。
+        返回 (文本, 引用列表)
+        """
+        path = []
+        while node is not None and node["parent"] is not None:
+            path.append(node)
+            node = node["parent"]
+        path.reverse()
         
-        best_child = max(root_node["children"], key=lambda child: child["visits"])
-        return best_child
+        segments, citations, index_by_key = [], [], {}
+        for step in path:
+            numbering = {}
+            for k, citation in enumerate(step["citations"], 1):
+                key = citation.get("url") or citation.get("title")
+                if key not in index_by_key:
+                    citations.append(citation)
+                    index_by_key[key] = len(citations)
+                numbering[k] = index_by_key[key]
+            segment = step.get("segment", step["text"])
+            segments.append(re.sub(
+                r"\[(\d+)\]",
+                lambda m: f"[{numbering[int(m.group(1))]}]" if int(m.group(1)) in numbering else m.group(0),
+                segment
+            ))
+        return "\n\n".join(segments), citations
 
     def selection(self, node):
         """
@@ -288,6 +533,10 @@ class ThinkCiteProcessor:
         best_child = None
         
         for child in current_node["children"]:
+            # 跳过已被本地预筛剪枝、或子分支已全部剪枝的分支
+            if child.get("pruned") or child.get("exhausted"):
+                continue
+            
             # 避免除零错误
             if child["visits"] == 0:
                 return child
@@ -302,6 +551,8 @@ class ThinkCiteProcessor:
                 best_child = child
         
         if best_child is None:
+            # 所有子节点都不可选：标记该节点已穷尽，由 mcts_search 跳过，上层选择时也不再进入
+            current_node["exhausted"] = True
             return current_node
         
         # 递归选择
@@ -318,11 +569,11 @@ class ThinkCiteProcessor:
         think_prompt = f"""
 我正在为"{keyword}行业 - {section_title}"撰写内容。目前已有的内容是：
 
-{current_text if current_text else "尚未开始撰写。"}
+{{current_text}}
 
 原始参考资料：
 
-{original_content[:2000] + "..." if len(original_content) > 2000 else original_content}
+{{original_content}}
 
 请思考并提出3个不同的关键观点或论点，用于扩展当前内容。每个观点需要具体、明确，并且可以通过引用外部资料来支持。
 
@@ -350,15 +601,16 @@ class ThinkCiteProcessor:
             think_prompt += memory_content
         
         try:
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant specialized in industry research."},
-                {"role": "user", "content": think_prompt}
-            ]
+            builder = PromptBuilder("deepseek-reasoner", min_output=1000)
+            builder.system("You are a helpful assistant specialized in industry research.")
+            builder.user(
+                think_prompt,
+                current_text=PromptSlot(current_text or "尚未开始撰写。", priority=1),
+                original_content=PromptSlot(original_content, max_tokens=1200)
+            )
             
             think_response = self.ds_client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                max_tokens=1000,
+                **builder.build(),
                 temperature=0.7,
                 stream=False
             )
@@ -432,15 +684,20 @@ class ThinkCiteProcessor:
 
 已经搜索到的相关引用资料：
 """
-                for i, cite in enumerate(citations):
-                    verbalize_prompt += f"""
-引用[{i+1}] {cite['title']}:
+                original_size = sum(len(cite.get("title", "")) + len(cite.get("snippet", "")) for cite in citations)
+                compact_size = 0
+                for cite in self.compact_citations(citations):
+                    cite_text = f"""
+引用[{cite['id']}] {cite['title']} ({cite['domain']}):
 {cite['snippet']}
 """
+                    verbalize_prompt += cite_text
+                    compact_size += len(cite["title"]) + len(cite["snippet"])
+                self.record_prompt_saving("verbalize", original_size, compact_size)
                 
                 verbalize_prompt += f"""
 已有的文本内容：
-{current_text}
+{{current_text}}
 
 请基于以上引用资料，撰写一段详细阐述该观点的内容（约300-500字）。要求：
 1. 必须严格基于引用资料的事实撰写，不要添加未在引用中提及的具体数据
@@ -454,15 +711,12 @@ class ThinkCiteProcessor:
                     verbalize_prompt += f"\n\n请注意改进以下方面（基于过去的反思）：\n" + "\n".join(node["memory"])
                 
                 try:
-                    messages = [
-                        {"role": "system", "content": "You are a helpful assistant specialized in industry research report writing."},
-                        {"role": "user", "content": verbalize_prompt}
-                    ]
+                    builder = PromptBuilder("deepseek-reasoner", min_output=2000)
+                    builder.system("You are a helpful assistant specialized in industry research report writing.")
+                    builder.user(verbalize_prompt, current_text=PromptSlot(current_text, scales_output=False))
                     
                     verbalize_response = self.ds_client.chat.completions.create(
-                        model="deepseek-reasoner",
-                        messages=messages,
-                        max_tokens=2000,
+                        **builder.build(),
                         temperature=0.7,
                         stream=False
                     )
@@ -473,6 +727,8 @@ class ThinkCiteProcessor:
                     new_text = current_text + ("\n\n" if current_text else "") + new_content
                     new_node = {
                         "text": new_text,
+                        # 本节点新增的段落，其引用编号对应本节点的 citations
+                        "segment": new_content,
                         "citations": citations,
                         "children": [],
                         "visits": 1,
@@ -502,6 +758,15 @@ class ThinkCiteProcessor:
         if not node["text"]:
             return 0
         
+        # 0. 本地启发式预筛，明显较差的分支直接剪枝，不再调用LLM评估；
+        # 只评估本节点新增的段落，父节点段落中的数字与引用编号对应的是父节点的引用
+        local_score, local_details = self.local_reward(node.get("segment", node["text"]), node["citations"])
+        node["local_score"] = local_score
+        if local_score < self.prefilter_threshold:
+            node["pruned"] = True
+            print(f"本地预筛得分 {local_score:.2f} 低于阈值 {self.prefilter_threshold}，剪枝该分支: {local_details}")
+            return local_score
+        
         # 1. 评估生成内容质量
         content_score, content_eval = self.evaluate_content_quality(node["text"])
         
@@ -511,11 +776,22 @@ class ThinkCiteProcessor:
         # 综合得分，内容质量和引用质量各占50%
         total_score = 0.6 * content_score + 0.4 * citation_score
         
-        # Reflexion: 生成反思并更新记忆
-        self.reflexion(node, content_eval, citation_eval, total_score)
+        # Reflexion: 仅保存评估文本，等到该节点被选中扩展时再生成反思记忆，
+        # 避免为从未被扩展的叶节点额外调用一次模型
+        node["pending_reflexion"] = (content_eval, citation_eval, total_score)
         
         return total_score
 
+    def apply_pending_reflexion(self, node):
+        """
+        为即将扩展的节点生成延迟的反思记忆
+        """
+        pending = node.pop("pending_reflexion", None)
+        if pending is None:
+            return []
+        content_eval, citation_eval, total_score = pending
+        return self.reflexion(node, content_eval, citation_eval, total_score)
+
     def reflexion(self, node, content_eval, citation_eval, total_score):
         """
         实现Reflexion框架中的反思机制
@@ -524,10 +800,10 @@ class ThinkCiteProcessor:
 请基于以下评估，对内容进行深度反思和改进建议：
 
 内容质量评估：
-{content_eval}
+{{content_eval}}
 
 引用质量评估：
-{citation_eval}
+{{citation_eval}}
 
 总体评分：{total_score:.2f}/1.0
 
@@ -535,15 +811,16 @@ class ThinkCiteProcessor:
 """
         
         try:
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant specialized in critical analysis and reflection."},
-                {"role": "user", "content": reflexion_prompt}
-            ]
+            builder = PromptBuilder("deepseek-chat", min_output=1000)
+            builder.system("You are a helpful assistant specialized in critical analysis and reflection.")
+            builder.user(
+                reflexion_prompt,
+                content_eval=PromptSlot(content_eval, scales_output=False),
+                citation_eval=PromptSlot(citation_eval, scales_output=False)
+            )
             
             reflexion_response = self.ds_client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                max_tokens=1000,
+                **builder.build(),
                 temperature=0.5,
                 stream=False
             )
@@ -587,14 +864,27 @@ class ThinkCiteProcessor:
             current = current["parent"]
 
 
-def process_content_with_thinkcite(section_file, keyword):
+def process_content_with_thinkcite(section_file, keyword, citation_pool=None, input_dir=None, output_dir=None, budget=None,
+                                   client=None, prefilter_threshold=DEFAULT_PREFILTER_THRESHOLD, prompt_stats=None):
     """
     处理单个章节文件，使用Think&Cite框架进行内容增强
+    
+    citation_pool: 可选的报告级引用缓存池，多个章节共享时可复用已检索的引用
+    input_dir/output_dir: step1 输入目录与 step1_5 输出目录，未指定时从环境变量读取
+    budget: 可选的章节token预算（token_budget.SectionBudget）
+    client: 报告级共享的deepseek客户端，未传入时为本章节单独创建并在结束后关闭
+    prefilter_threshold: 本地启发式预筛阈值
+    prompt_stats: 可选的报告级列表，本章节各次调用的引用压缩记录会追加到其中
     """
     print(f"\n正在使用Think&Cite框架处理文件: {section_file}")
     
+    # 从环境变量中获取目录路径，如果没有则使用默认路径
+    if input_dir is None:
+        input_dir = os.environ.get("REPORT_STEP1_DIR", os.path.join("reports", "step1"))
+    if output_dir is None:
+        output_dir = os.environ.get("REPORT_STEP1_5_DIR", os.path.join("reports", "step1_5"))
+    
     # 加载原始内容
-    input_dir = os.path.join("reports", "step1")
     input_path = os.path.join(input_dir, section_file)
     
     with open(input_path, "r", encoding="utf-8") as f:
@@ -612,13 +902,22 @@ def process_content_with_thinkcite(section_file, keyword):
             section_title = "_".join(parts[2:])
     
     # 初始化处理器
-    processor = ThinkCiteProcessor()
+    own_client = client is None
+    if own_client:
+        client = create_ds_client()
+    processor = ThinkCiteProcessor(citation_pool=citation_pool, prefilter_threshold=prefilter_threshold,
+                                   budget=budget, client=client)
     
     # 使用Think&Cite框架增强内容
-    enhanced_content = processor.generate_with_citations(original_content, section_title, keyword)
+    try:
+        enhanced_content = processor.generate_with_citations(original_content, section_title, keyword)
+    finally:
+        if own_client:
+            client.close()
+        if prompt_stats is not None:
+            prompt_stats.extend(processor.prompt_stats)
     
     # 保存增强后的内容
-    output_dir = os.path.join("reports", "step1_5")
     os.makedirs(output_dir, exist_ok=True)
     
     output_filename = f"{os.path.splitext(section_file)[0]}_enhanced.md"
@@ -630,45 +929,96 @@ def process_content_with_thinkcite(section_file, keyword):
     print(f"已保存增强内容至: {output_path}")
     return output_path
 
-def main():
-    print("====== Think&Cite 框架内容增强工具 ======")
-    
-    # 获取行业关键词
-    keyword = input("请输入行业关键词（与 step1 保持一致）：").strip()
+def enhance_sections(keyword, input_dir, output_dir, max_workers=3, prefilter_threshold=None):
+    """
+    并行增强 step1 中的所有章节文件
     
-    # 创建输出目录
-    output_dir = os.path.join("reports", "step1_5")
+    各章节在线程池中并发处理，max_workers 为单份报告的并发上限；
+    所有章节共享同一个引用缓存池。prefilter_threshold 未指定时从 REPORT_THINKCITE_PREFILTER 读取。
+    返回处理报告字典。
+    """
+    if prefilter_threshold is None:
+        prefilter_threshold = float(os.environ.get("REPORT_THINKCITE_PREFILTER", DEFAULT_PREFILTER_THRESHOLD))
     os.makedirs(output_dir, exist_ok=True)
     
-    # 获取 step1 中生成的所有 Markdown 文件
-    input_dir = os.path.join("reports", "step1")
-    md_files = [f for f in os.listdir(input_dir) if f.endswith(".md")]
+    # 只处理 step1 生成的章节文件（形如 1_1_章节名.md），跳过参考文献等汇总文件
+    md_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".md") and re.match(r"^\d+_\d+_", f))
+    print(f"找到 {len(md_files)} 个章节文件需要处理，并发数: {max_workers}")
     
-    print(f"找到 {len(md_files)} 个章节文件需要处理")
+    # 同一份报告的所有章节共享一个引用缓存池
+    citation_pool = CitationPool()
+    
+    # 报告预算中分给Think&Cite阶段的部分（REPORT_MCTS_BUDGET_SHARE），按章节原始资料规模与权重分配
+    budget = token_budget.ReportBudget.from_env(share=float(os.environ.get("REPORT_MCTS_BUDGET_SHARE", "0.3")))
+    if budget.enabled:
+        source_tokens = {}
+        for md_file in md_files:
+            with open(os.path.join(input_dir, md_file), "r", encoding="utf-8") as f:
+                source_tokens[md_file] = estimate_tokens(f.read())
+        budget.allocate(source_tokens)
+    
+    # 所有章节共享一个客户端，按本次运行的供应商配置创建
+    ds_client = create_ds_client()
     
-    # 处理每个文件
     processed_files = []
-    for i, md_file in enumerate(md_files):
-        print(f"\n[{i+1}/{len(md_files)}] 处理文件: {md_file}")
-        output_file = process_content_with_thinkcite(md_file, keyword)
-        processed_files.append(output_file)
-        time.sleep(5)  # 避免API请求过于频繁
+    failed_files = []
+    # 各章节的引用压缩记录，汇总后写入处理报告
+    prompt_stats = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {
+                executor.submit(process_content_with_thinkcite, md_file, keyword, citation_pool, input_dir, output_dir,
+                                budget.section(md_file) if budget.enabled else None, ds_client,
+                                prefilter_threshold, prompt_stats): md_file
+                for md_file in md_files
+            }
+            for future in as_completed(futures):
+                md_file = futures[future]
+                try:
+                    processed_files.append(future.result())
+                except Exception as e:
+                    print(f"处理文件 {md_file} 时出错: {str(e)}")
+                    failed_files.append(md_file)
+    finally:
+        # 对冲请求的线程池随客户端一起释放（落败调用完成并记账后）
+        ds_client.close()
     
     # 生成处理报告
     report = {
         "keyword": keyword,
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "processed_files": processed_files,
-        "total_files": len(md_files)
+        "processed_files": sorted(processed_files),
+        "failed_files": failed_files,
+        "total_files": len(md_files),
+        "prefilter_threshold": prefilter_threshold,
+        "citation_cache": citation_pool.stats(),
+        "prompt_savings": summarize_prompt_savings(prompt_stats)
     }
+    if budget.enabled:
+        report["token_budget"] = budget.report()
     
     report_path = os.path.join(output_dir, "processing_report.json")
     with open(report_path, "w", encoding="utf-8") as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
     
+    return report
+
+def main():
+    print("====== Think&Cite 框架内容增强工具 ======")
+    
+    # 获取行业关键词
+    keyword = input("请输入行业关键词（与 step1 保持一致）：").strip()
+    
+    # 从环境变量中读取目录路径，如果没有则使用默认路径
+    input_dir = os.environ.get("REPORT_STEP1_DIR", os.path.join("reports", "step1"))
+    output_dir = os.environ.get("REPORT_STEP1_5_DIR", os.path.join("reports", "step1_5"))
+    max_workers = int(os.environ.get("REPORT_THINKCITE_WORKERS", "3"))
+    
+    enhance_sections(keyword, input_dir, output_dir, max_workers)
+    
     print("\n====== Think&Cite 内容增强完成 ======")
     print(f"所有增强内容已保存至: {output_dir}")
     print("请运行 step2.py 继续进行内容归纳总结。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,18 +2,148 @@ import os
 import time
 import re
 import json
-# 在导入matplotlib之前设置后端为非交互式
-import matplotlib
-matplotlib.use('Agg')  # 使用非交互式后端，避免tkinter相关错误
-import matplotlib.pyplot as plt
-import numpy as np
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import chart_renderer
+import viz_data
+import chart_placement
+import content_patch
+import text_compress
+import llm_providers
+import token_budget
+from llm_utils import estimate_tokens, truncate_to_tokens, split_into_chunks, PromptBuilder, PromptSlot, complete_with_continuation, ModelRouter
+from chart_service import ChartRenderService
 
 # Make sure the environment variable DS_API_KEY is set, otherwise replace it with your API Key
 API_KEY = os.environ.get("DS_API_KEY", "")
 
-# Initialize deepseek client
-client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
+# Minimum score gain per refinement round; below it the loop stops
+REFINE_MIN_GAIN = 0.5
+
+# Prompt layout: the fixed instructions of each call form its system message, so every section
+# sends a byte-identical prefix that DeepSeek's context cache can serve; the section title,
+# keyword and content follow in the user message.
+
+SUMMARY_INSTRUCTIONS = """You are a helpful assistant. Summarize the content about an industry report section provided by the user, ensuring:
+
+1. Professional and fluid language with clear logic
+2. Maintain industry professionalism with accurate terminology
+3. Use cohesive paragraphs of about 500-600 words each, with each paragraph focused on a core concept, and ensure clear logical relationships and transitions between paragraphs
+4. Retain important data, facts, and cases as arguments, and use tables to present key data where appropriate
+5. Retain original citation markers [x] to ensure academic rigor
+6. Organize content by chronological order or logical relationship with clear structure
+7. Ensure the final content has both depth of analysis and practical value
+8. Add a concluding paragraph analyzing the overall situation and key points of this section"""
+
+# Appended to the summarize instructions in fused mode
+FUSED_CHART_INSTRUCTIONS = """
+
+After the summary, append exactly one fenced ```json block containing {"charts": [...]} with the key data of your summary that is suitable for visualization. Each chart is an object with "chart_title", "chart_type" (bar, horizontal_bar, stacked_bar, line, area, pie, donut, scatter, bubble or radar), "x_label", "y_label" and "data": {"labels": [...], "values": [...], "additional_series": [{"name": ..., "values": [...]}]}. Titles and labels in Chinese, values as numbers, labels and values of equal length, only data present in the summary. Use {"charts": []} if there is nothing to chart. Write nothing after the block.
+"""
+
+VISUALIZATION_INSTRUCTIONS = """You are a helpful assistant specialized in data extraction and visualization, with expertise in Chinese language data visualization. Analyze the content provided by the user and extract data suitable for visualization:
+
+1. Identify ALL numerical data in the content that could be visualized, including data in tables, statistics mentioned in the text, trends, comparisons, and distributions
+2. For each data set, choose the most appropriate chart type from the following options:
+   - bar: For comparing individual data points
+   - horizontal_bar: For comparing categories with long names
+   - stacked_bar: For showing composition of categories
+   - line: For showing trends over time or continuous data
+   - area: For emphasizing magnitude of trends
+   - pie: For showing composition of a whole (use only when 3-7 categories)
+   - donut: Similar to pie but with better visual appeal
+   - scatter: For showing correlation between variables
+   - bubble: For showing three dimensions of data
+   - radar: For comparing multiple variables at once
+
+3. Extract the data and return a JSON object in this enhanced format:
+
+```json
+{
+  "charts": [
+  {
+    "chart_title": "详细的图表标题（中文）",
+    "chart_type": "chart_type",
+    "x_label": "X轴标签（中文）",
+    "y_label": "Y轴标签（中文）",
+    "data": {
+      "labels": ["标签1", "标签2", ...],
+      "values": [value1, value2, ...],
+      "additional_series": [
+        {
+          "name": "系列名称1",
+          "values": [value1, value2, ...]
+        },
+        {
+          "name": "系列名称2",
+          "values": [value1, value2, ...]
+        }
+      ],
+      "sizes": [size1, size2, ...]
+    }
+  }
+  ]
+}
+```
+"sizes" is optional and only used by bubble or scatter charts. There can be multiple charts.
+
+IMPORTANT GUIDELINES:
+1. Ensure ALL chart titles, labels, and series names are in Chinese
+2. Extract ONLY data that actually exists in the text, do not fabricate data
+3. Choose the most suitable chart type for each data set
+4. If there's time-series data or comparisons across categories, they are excellent candidates for visualization
+5. If there is no suitable data for visualization, return {"charts": []}
+6. Include additional data series when multiple related sets of data are present
+7. Make sure all numeric values are properly extracted as numbers, not strings, and that "labels" and "values" have the same length"""
+
+REFLECTION_INSTRUCTIONS = """You are a helpful assistant specialized in critical analysis. Evaluate the content provided by the user, checking for:
+
+1. Are there any factual errors or inaccurate information?
+2. Are there any logical inconsistencies or contradictions?
+3. Are there any overly vague or ambiguous statements?
+4. Are there any claims lacking clear references or supporting evidence?
+5. Are there any knowledge gaps or important information missing?
+6. Are there any data points that would be better presented as charts rather than text descriptions?
+
+For each issue found, please indicate the specific location and suggest how it could be improved. If the content quality is good, please also highlight its strengths.
+
+Finish with a final line of the form "QUALITY_SCORE: <number>", scoring the content from 0 to 10 by the severity of the issues found (10 means publishable as is, below 5 means serious factual or logical problems)."""
+
+PATCH_INSTRUCTIONS = """You are a helpful assistant specialized in content optimization. 请根据用户提供的反馈，以局部修改的方式优化其中的行业内容。
+
+只修改反馈中指出的问题（事实错误、逻辑不连贯、模糊表述、缺失的重要信息、缺少来源支持等），不要重写未涉及的部分。
+以JSON对象返回修改列表，格式如下：
+{"edits": [
+  {"op": "replace", "anchor": "原文中需要替换的句子", "text": "替换后的句子"},
+  {"op": "insert_after", "anchor": "原文中的句子", "text": "在该句之后插入的内容"},
+  {"op": "insert_before", "anchor": "原文中的句子", "text": "在该句之前插入的内容"},
+  {"op": "delete", "anchor": "原文中需要删除的句子"}
+]}
+
+要求:
+- anchor 必须逐字摘自原始内容，通常为一到两句完整的句子，不超过100字
+- 各条修改的 anchor 互不重叠
+- 保留原有的引用标记[x]
+- 如果不需要修改，返回 {"edits": []}"""
+
+REWRITE_INSTRUCTIONS = """You are a helpful assistant specialized in content optimization, with expertise in integrating data visualizations into reports. 请根据用户提供的反馈优化其中的行业内容。
+
+请全面改进内容，重点解决反馈中指出的问题，确保:
+1. 修正所有事实错误和不准确信息
+2. 确保逻辑连贯性和论证一致性
+3. 用具体、清晰的内容替换模糊的陈述
+4. 添加数据来源和支持证据以增强可信度
+5. 填补知识空白，添加重要的缺失信息
+6. 保持专业性和可读性
+
+请提供完整的优化内容，而不仅仅是修改列表。不要在开头列出修改项或总结，也不要包含"以下是优化后的内容"等过渡语句。直接从正文内容开始。"""
+
+CONDENSE_INSTRUCTIONS = """请将用户提供的行业原始资料浓缩为要点笔记：
+
+1. 保留所有具体数据、事实、案例、时间和机构名称
+2. 原样保留引用标记（如[1]、[ref3]），并紧跟在对应内容之后
+3. 删除重复、广告和与主题无关的内容
+4. 不要添加资料中没有的信息，不要写引言或总结"""
+
 
 class ContentProcessor:
     """
@@ -21,8 +151,95 @@ class ContentProcessor:
     with reflection process to reduce hallucinations.
     Includes data visualization functionality to extract and visualize data from text.
     """
-    def __init__(self):
-        self.client = client
+    def __init__(self, chart_fonts=None, chart_font_path=None, chart_service=None):
+        # Model per call type from the routing profile, downgraded to deepseek-chat while the
+        # reasoner's p95 latency or error rate over its last REPORT_ROUTER_WINDOW calls is over
+        # its threshold; a reasoner call is let through every REPORT_ROUTER_PROBE_SECONDS to recover
+        self.router = ModelRouter(
+            profile=os.environ.get("REPORT_MODEL_PROFILE"),
+            p95_threshold=float(os.environ.get("REPORT_REASONER_P95_SECONDS", "120")),
+            error_threshold=float(os.environ.get("REPORT_ROUTER_ERROR_RATE", "0.3")),
+            window=int(os.environ.get("REPORT_ROUTER_WINDOW", "20")),
+            probe_interval=float(os.environ.get("REPORT_ROUTER_PROBE_SECONDS", "60")),
+        )
+        # DeepSeek client, or a ProviderPool over several OpenAI-compatible endpoints
+        # (REPORT_LLM_PROVIDERS) with optional hedged requests (REPORT_HEDGE_REQUESTS=1)
+        self.llm_client = llm_providers.client_from_env(API_KEY)
+        self.client = self.router.instrument(self.llm_client)
+        # Optional ChartRenderService shared by all sections
+        self.chart_service = chart_service
+        # Chart font settings; fall back to the environment so the pipeline can configure them
+        if chart_fonts is None and os.environ.get("REPORT_CHART_FONTS"):
+            chart_fonts = [f.strip() for f in os.environ["REPORT_CHART_FONTS"].split(",") if f.strip()]
+        self.chart_fonts = chart_fonts
+        self.chart_font_path = chart_font_path or os.environ.get("REPORT_CHART_FONT_PATH") or None
+        # Chart output profile (screen / screen_quantized / print / svg)
+        self.chart_profile = os.environ.get("REPORT_CHART_PROFILE") or chart_renderer.DEFAULT_CHART_PROFILE
+        # Adaptive refinement: skip optimization at or above the threshold score (0-10),
+        # and cap reflect + optimize calls per section
+        self.refine_threshold = float(os.environ.get("REPORT_REFINE_THRESHOLD", "8"))
+        self.refine_max_calls = int(os.environ.get("REPORT_REFINE_MAX_CALLS", "4"))
+        self.refine_stats = []
+        # Map-reduce summarization above this many source tokens, with chunks of map_chunk_tokens
+        self.map_reduce_threshold = int(os.environ.get("REPORT_MAP_REDUCE_TOKENS", "24000"))
+        self.map_chunk_tokens = int(os.environ.get("REPORT_MAP_CHUNK_TOKENS", "8000"))
+        self.map_workers = int(os.environ.get("REPORT_MAP_WORKERS", "4"))
+        # Optimization mode: "patch" (localized edits, rewrite as fallback) or "rewrite"
+        self.optimize_mode = os.environ.get("REPORT_OPTIMIZE_MODE", "patch")
+        # Fused mode: the summarize call also emits the chart specs (REPORT_FUSED_CHARTS=1)
+        self.fused_charts = os.environ.get("REPORT_FUSED_CHARTS", "0") == "1"
+        self.fusion_stats = []
+        self.extraction_latencies = []
+        # Continuation rounds allowed when a long reply stops at max_tokens
+        self.max_continuations = int(os.environ.get("REPORT_MAX_CONTINUATIONS", "2"))
+        self.continuation_stats = []
+        # Local boilerplate / duplicate removal on the source before summarization
+        self.compress_sources = os.environ.get("REPORT_COMPRESS_SOURCE", "1") == "1"
+        self.compression_stats = []
+        # Report-level token / USD budget split over the sections (REPORT_TOKEN_BUDGET, REPORT_USD_BUDGET);
+        # when Think&Cite ran, its share (REPORT_MCTS_BUDGET_SHARE) is not available to step2
+        budget_share = 1.0
+        if os.environ.get("REPORT_STEP1_5_DIR"):
+            budget_share -= float(os.environ.get("REPORT_MCTS_BUDGET_SHARE", "0.3"))
+        self.budget = token_budget.ReportBudget.from_env(share=budget_share)
+
+    def close(self):
+        """
+        Release the LLM client; a ProviderPool first waits for losing hedged attempts
+        so that their spend reaches the budget
+        """
+        self.llm_client.close()
+
+    def allocate_budget(self, input_dir, filenames):
+        """
+        Split the report budget over the sections by source size and section weight
+        """
+        if not self.budget.enabled:
+            return
+        source_tokens = {}
+        for filename in filenames:
+            with open(os.path.join(input_dir, filename), "r", encoding="utf-8") as f:
+                content = f.read()
+            source_tokens[self.extract_sub_title(content, filename)] = estimate_tokens(content)
+        for name, budget in self.budget.allocate(source_tokens).items():
+            print(f"[{name}] Budget: {budget.tokens} tokens" if budget.tokens is not None
+                  else f"[{name}] Budget: ${budget.usd:.4f}")
+
+    def section_client(self, sub_title, stage):
+        """Client whose calls are charged to the section's budget under the given stage"""
+        return self.budget.section(sub_title).meter(self.client, stage)
+
+    def budget_request(self, builder, sub_title, stage):
+        """
+        Build an optional call; returns None when the section's remaining budget cannot
+        cover its prompt plus the full output allowance, so the stage can be skipped
+        """
+        request = builder.build()
+        budget = self.budget.section(sub_title)
+        if not budget.can_afford(request["model"], builder.input_tokens, builder.max_tokens):
+            budget.skip(stage)
+            return None
+        return request
 
     def extract_sub_title(self, content, filename):
         """
@@ -65,498 +282,480 @@ class ContentProcessor:
     def extract_data_for_visualization(self, content, sub_title, keyword):
         """
         Extract data suitable for visualization from the content with enhanced support
-        for multiple chart types and additional data series
+        for multiple chart types and additional data series.
+        Tables and numeric series are parsed locally first; the LLM is asked only when none are found.
         """
-        prompt = f"""Please analyze the following content about the "{sub_title}" of the {keyword} industry, and extract data suitable for visualization:
+        local_charts = viz_data.extract_charts(content, sub_title)
+        if local_charts:
+            print(f"[{sub_title}] Extracted {len(local_charts)} charts locally, skipping LLM extraction")
+            return local_charts
+        
+        builder = PromptBuilder(self.router.choose("visualize"), min_output=1000, max_output=3000, output_ratio=0.5)
+        builder.system(VISUALIZATION_INSTRUCTIONS)
+        builder.user(self.build_visualization_prompt(sub_title, keyword), content=PromptSlot(content))
+        request = self.budget_request(builder, sub_title, "viz")
+        if request is None:
+            return []
 
-1. Identify ALL numerical data in the content that could be visualized, including data in tables, statistics mentioned in the text, trends, comparisons, and distributions
-2. For each data set, choose the most appropriate chart type from the following options:
-   - bar: For comparing individual data points
-   - horizontal_bar: For comparing categories with long names
-   - stacked_bar: For showing composition of categories
-   - line: For showing trends over time or continuous data
-   - area: For emphasizing magnitude of trends
-   - pie: For showing composition of a whole (use only when 3-7 categories)
-   - donut: Similar to pie but with better visual appeal
-   - scatter: For showing correlation between variables
-   - bubble: For showing three dimensions of data
-   - radar: For comparing multiple variables at once
+        try:
+            start_time = time.time()
+            response = self.section_client(sub_title, "viz").chat.completions.create(
+                **request,
+                temperature=0.3,
+                response_format={"type": "json_object"},
+                stream=False
+            )
+            visualization_data = response.choices[0].message.content
+            self.extraction_latencies.append(time.time() - start_time)
+        except Exception as e:
+            print(f"Error extracting visualization data: {str(e)}")
+            return []
+        
+        charts = viz_data.parse_chart_json(visualization_data)
+        if charts is None:
+            print(f"Unable to parse JSON data: {visualization_data}")
+            return []
+        return self.validate_charts(charts, content, sub_title)
 
-3. Extract the data and return in this enhanced JSON format:
+    def build_visualization_prompt(self, sub_title, keyword):
+        """
+        User message template of the standalone chart extraction call (the instructions are
+        VISUALIZATION_INSTRUCTIONS); {content} is filled by PromptBuilder
+        """
+        return f"""Content about the "{sub_title}" of the {keyword} industry:
+{{content}}
+"""
 
-```json
-[
-  {{
-    "chart_title": "详细的图表标题（中文）",
-    "chart_type": "chart_type",
-    "x_label": "X轴标签（中文）",
-    "y_label": "Y轴标签（中文）",
-    "data": {{
-      "labels": ["标签1", "标签2", ...],
-      "values": [value1, value2, ...],
-      "additional_series": [
-        {{
-          "name": "系列名称1",
-          "values": [value1, value2, ...]
-        }},
-        {{
-          "name": "系列名称2",
-          "values": [value1, value2, ...]
-        }}
-      ],
-      "sizes": [size1, size2, ...] // Optional, for bubble or scatter charts
-    }}
-  }},
-  // There can be multiple charts
-]
-```
+    def validate_charts(self, charts, content, sub_title=None):
+        """
+        Repair chart specs locally; only charts that are still invalid get a targeted re-ask
+        """
+        valid_charts = []
+        for chart in charts:
+            chart, problems = viz_data.repair_chart(chart)
+            if problems:
+                chart, problems = self.reask_invalid_chart(chart, problems, content, sub_title)
+            if problems:
+                print(f"Dropping chart '{chart.get('chart_title', '')}': {'; '.join(problems)}")
+                continue
+            valid_charts.append(chart)
+        return valid_charts
+
+    def reask_invalid_chart(self, chart, problems, content, sub_title=None):
+        """
+        Ask deepseek-chat to fix a single invalid chart spec against the source content.
+        Returns (chart, problems) after local repair of the answer.
+        """
+        prompt = f"""The following chart specification is invalid: {'; '.join(problems)}.
+Fix it using only data that exists in the content below. "labels" and "values" must have the same length and all values must be numbers.
+Return the corrected chart as a JSON object with the same fields, or {{"charts": []}} if the content has no data for it.
 
-IMPORTANT GUIDELINES:
-1. Ensure ALL chart titles, labels, and series names are in Chinese
-2. Extract ONLY data that actually exists in the text, do not fabricate data
-3. Choose the most suitable chart type for each data set
-4. If there's time-series data or comparisons across categories, they are excellent candidates for visualization
-5. If there is no suitable data for visualization, return an empty array []
-6. Include additional data series when multiple related sets of data are present
-7. Make sure all numeric values are properly extracted as numbers, not strings
+Chart:
+{json.dumps(chart, ensure_ascii=False)}
 
 Content:
-{content}
+{{content}}
 """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant specialized in data extraction and visualization, with expertise in Chinese language data visualization."},
-            {"role": "user", "content": prompt}
-        ]
-
+        builder = PromptBuilder(self.router.choose("repair"), min_output=300, max_output=1000, output_ratio=0.0)
+        builder.user(prompt, content=PromptSlot(content, max_tokens=2000))
+        request = self.budget_request(builder, sub_title, "viz")
+        if request is None:
+            return chart, problems
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                max_tokens=3000,
-                temperature=0.3,
+            response = self.section_client(sub_title, "viz").chat.completions.create(
+                **request,
+                temperature=0.1,
+                response_format={"type": "json_object"},
                 stream=False
             )
-            visualization_data = response.choices[0].message.content
-            
-            # Extract JSON portion
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', visualization_data)
-            if json_match:
-                json_str = json_match.group(1)
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    print(f"Unable to parse JSON data: {json_str}")
-                    return []
-            else:
-                # If no code block markers, try parsing the entire response
-                try:
-                    return json.loads(visualization_data)
-                except json.JSONDecodeError:
-                    print(f"Unable to parse JSON data: {visualization_data}")
-                    return []
+            fixed = viz_data.parse_chart_json(response.choices[0].message.content)
         except Exception as e:
-            print(f"Error extracting visualization data: {str(e)}")
-            return []
+            print(f"Error re-asking for chart '{chart.get('chart_title', '')}': {str(e)}")
+            return chart, problems
+        if not fixed:
+            return chart, problems
+        return viz_data.repair_chart(fixed[0])
 
     def generate_charts(self, visualization_data, output_dir, base_filename):
         """
         Generate charts based on extracted data with improved Chinese font support
-        and variety of chart types
+        and variety of chart types. Rendering goes through the warm process pool
+        when a chart service is attached, otherwise it runs in the current process.
         """
-        charts_info = []
-        
-        # Setup Chinese font support
-        import matplotlib.font_manager as fm
-        # Try to find a Chinese font in the system
-        chinese_fonts = [
-            'SimHei', 'Microsoft YaHei', 'STSong', 'STFangsong', 'FangSong', 'KaiTi', 
-            'SimSun', 'NSimSun', 'STXihei', 'STZhongsong', 'STKaiti', 'STLiti', 
-            'STHupo', 'STCaiyun', 'STXingkai', 'STXinwei'
-        ]
-        
-        chinese_font = None
-        for font in chinese_fonts:
-            if any(font.lower() in f.lower() for f in fm.findSystemFonts()):
-                chinese_font = font
-                break
-        
-        if not chinese_font:
-            # If no Chinese font found, use a default available font
-            chinese_font = 'DejaVu Sans'
-            print("Warning: No specific Chinese font found. Using default font.")
-        
-        # Set global font
-        plt.rcParams['font.family'] = chinese_font
-        plt.rcParams['axes.unicode_minus'] = False
-        
-        # Create color schemes for different chart types
-        color_schemes = {
-            "bar": plt.cm.Blues,
-            "line": plt.cm.Oranges,
-            "pie": plt.cm.Greens,
-            "scatter": plt.cm.Purples,
-            "horizontal_bar": plt.cm.Reds,
-            "stacked_bar": plt.cm.YlOrBr,
-            "area": plt.cm.PuBu,
-            "bubble": plt.cm.RdYlBu,
-            "radar": plt.cm.tab10,
-            "donut": plt.cm.Pastel1
-        }
-        
-        for i, chart_data in enumerate(visualization_data):
-            try:
-                chart_type = chart_data.get("chart_type", "bar").lower()
-                chart_title = chart_data.get("chart_title", f"图表 {i+1}")
-                x_label = chart_data.get("x_label", "")
-                y_label = chart_data.get("y_label", "")
-                
-                labels = chart_data.get("data", {}).get("labels", [])
-                values = chart_data.get("data", {}).get("values", [])
-                
-                # Handle additional data series if available
-                additional_series = chart_data.get("data", {}).get("additional_series", [])
-                
-                if not labels or not values or len(labels) != len(values):
-                    print(f"Chart '{chart_title}' data incomplete or mismatched, skipping generation")
-                    continue
-                
-                # Create figure with appropriate font
-                plt.figure(figsize=(12, 8))
-                fig = plt.gcf()
-                ax = plt.gca()
-                
-                # Get color map based on chart type
-                cmap = color_schemes.get(chart_type, plt.cm.Blues)
-                
-                if chart_type == "bar":
-                    bars = plt.bar(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
-                    # Add value labels on top of bars
-                    for bar in bars:
-                        height = bar.get_height()
-                        plt.text(bar.get_x() + bar.get_width()/2., height + max(values)*0.01,
-                                 f'{height:.1f}', ha='center', va='bottom', fontsize=9)
-                
-                elif chart_type == "horizontal_bar":
-                    bars = plt.barh(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
-                    # Add value labels at end of bars
-                    for bar in bars:
-                        width = bar.get_width()
-                        plt.text(width + max(values)*0.01, bar.get_y() + bar.get_height()/2.,
-                                 f'{width:.1f}', ha='left', va='center', fontsize=9)
-                
-                elif chart_type == "stacked_bar":
-                    if additional_series:
-                        bottom = np.zeros(len(labels))
-                        for j, series in enumerate(additional_series):
-                            series_values = series.get("values", [])
-                            series_name = series.get("name", f"系列 {j+1}")
-                            if len(series_values) == len(labels):
-                                plt.bar(labels, series_values, bottom=bottom, 
-                                       label=series_name, color=cmap(0.3 + 0.5*j/len(additional_series)))
-                                bottom += np.array(series_values)
-                        plt.legend(loc='best', fontsize=10)
-                    else:
-                        plt.bar(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
-                
-                elif chart_type == "line":
-                    # Use markers and line style
-                    plt.plot(labels, values, marker='o', linestyle='-', linewidth=2.5, 
-                            color=cmap(0.6), markersize=8, markerfacecolor=cmap(0.8))
-                    # Add value labels above points
-                    for i, (x, y) in enumerate(zip(labels, values)):
-                        plt.text(i, y + max(values)*0.02, f'{y:.1f}', ha='center', fontsize=9)
-                    
-                    # Handle multiple lines if additional series exist
-                    if additional_series:
-                        for j, series in enumerate(additional_series):
-                            series_values = series.get("values", [])
-                            series_name = series.get("name", f"系列 {j+1}")
-                            if len(series_values) == len(labels):
-                                plt.plot(labels, series_values, marker='s', linestyle='--', 
-                                       label=series_name, color=cmap(0.3 + 0.5*j/len(additional_series)))
-                        plt.legend(loc='best', fontsize=10)
-                
-                elif chart_type == "area":
-                    plt.fill_between(range(len(labels)), values, alpha=0.5, color=cmap(0.6))
-                    plt.plot(range(len(labels)), values, 'o-', color=cmap(0.8))
-                    plt.xticks(range(len(labels)), labels)
-                
-                elif chart_type == "pie":
-                    # Enhanced pie chart with percentage and value display
-                    wedges, texts, autotexts = plt.pie(
-                        values, 
-                        labels=None,  # We'll add custom legend
-                        autopct='%1.1f%%',
-                        startangle=90,
-                        colors=[cmap(0.2 + 0.6*i/len(values)) for i in range(len(values))],
-                        textprops={'fontsize': 10}
-                    )
-                    # Enhance text visibility
-                    for autotext in autotexts:
-                        autotext.set_color('white')
-                        autotext.set_fontsize(9)
-                    
-                    # Add legend with labels
-                    plt.legend(wedges, labels, title="分类", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-                    plt.axis('equal')
-                
-                elif chart_type == "donut":
-                    # Create a donut chart (pie with a hole)
-                    wedges, texts, autotexts = plt.pie(
-                        values, 
-                        labels=None,
-                        autopct='%1.1f%%',
-                        startangle=90,
-                        colors=[cmap(0.2 + 0.6*i/len(values)) for i in range(len(values))],
-                        textprops={'fontsize': 10}
-                    )
-                    # Make a hole in the center
-                    centre_circle = plt.Circle((0,0), 0.70, fc='white')
-                    fig.gca().add_artist(centre_circle)
-                    
-                    # Add legend with labels
-                    plt.legend(wedges, labels, title="分类", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-                    plt.axis('equal')
-                
-                elif chart_type == "scatter":
-                    # Create scatter plot with varying point sizes if available
-                    sizes = chart_data.get("data", {}).get("sizes", [50] * len(values))
-                    if len(sizes) != len(values):
-                        sizes = [50] * len(values)
-                    
-                    scatter = plt.scatter(
-                        range(len(labels)), 
-                        values, 
-                        s=sizes,
-                        c=np.arange(len(labels)), 
-                        cmap=cmap, 
-                        alpha=0.7
-                    )
-                    plt.xticks(range(len(labels)), labels)
-                    
-                    # Add a colorbar if there are enough data points
-                    if len(values) > 3:
-                        plt.colorbar(scatter)
-                
-                elif chart_type == "bubble":
-                    # Bubble chart with varying sizes
-                    sizes = chart_data.get("data", {}).get("sizes", [v*10 for v in values])
-                    if len(sizes) != len(values):
-                        sizes = [v*10 for v in values]
-                    
-                    x_pos = np.arange(len(labels))
-                    plt.scatter(x_pos, values, s=sizes, alpha=0.6, 
-                               c=x_pos, cmap=cmap, edgecolors='black')
-                    plt.xticks(x_pos, labels)
-                
-                elif chart_type == "radar":
-                    # Implement radar chart (polar plot)
-                    from matplotlib.path import Path
-                    from matplotlib.spines import Spine
-                    from matplotlib.projections.polar import PolarAxes
-                    from matplotlib.projections import register_projection
-                    
-                    # Convert to radar coordinates
-                    angles = np.linspace(0, 2*np.pi, len(labels), endpoint=False).tolist()
-                    values += values[:1]  # Close the loop
-                    angles += angles[:1]  # Close the loop
-                    
-                    # Create radar plot
-                    ax = plt.subplot(111, polar=True)
-                    plt.xticks(angles[:-1], labels, fontsize=10)
-                    ax.plot(angles, values, 'o-', linewidth=2)
-                    ax.fill(angles, values, alpha=0.25)
-                    ax.set_rlabel_position(0)
-                    
-                    # Add value labels
-                    for i, (angle, value) in enumerate(zip(angles[:-1], values[:-1])):
-                        plt.text(angle, value*1.1, f'{value:.1f}', ha='center', va='center')
-                
-                else:
-                    # Default to bar chart
-                    plt.bar(labels, values, color=cmap(np.linspace(0.3, 0.8, len(values))))
-                
-                # Set title and labels with enhanced styling
-                plt.title(chart_title, fontsize=16, fontweight='bold', pad=20)
-                
-                if chart_type not in ["pie", "donut", "radar"]:
-                    plt.xlabel(x_label, fontsize=12, labelpad=10)
-                    plt.ylabel(y_label, fontsize=12, labelpad=10)
-                    
-                    # Rotate x-axis labels for better readability
-                    if chart_type != "horizontal_bar":
-                        plt.xticks(rotation=45, ha='right', fontsize=10)
-                
-                # Grid for better readability (except for pie and donut)
-                if chart_type not in ["pie", "donut"]:
-                    plt.grid(True, linestyle='--', alpha=0.7)
-                
-                # Add a subtle border
-                for spine in plt.gca().spines.values():
-                    spine.set_visible(True)
-                    spine.set_color('gray')
-                    spine.set_linewidth(0.5)
-                
-                # Adjust layout
-                plt.tight_layout()
-                
-                # Save chart with higher DPI
-                chart_filename = f"{base_filename}_chart_{i+1}.png"
-                chart_path = os.path.join(output_dir, "charts", chart_filename)
-                os.makedirs(os.path.dirname(chart_path), exist_ok=True)
-                plt.savefig(chart_path, dpi=300, bbox_inches='tight')
-                plt.close()
-                
-                charts_info.append({
-                    "title": chart_title,
-                    "type": chart_type,
-                    "path": chart_path,
-                    "markdown_ref": f"![{chart_title}](charts/{chart_filename})"
-                })
-                
-                print(f"Generated chart: {chart_title} -> {chart_path}")
-            except Exception as e:
-                print(f"Error generating chart '{chart_data.get('chart_title', f'Chart {i+1}')}': {str(e)}")
+        if self.chart_service:
+            return self.chart_service.render(visualization_data, output_dir, base_filename)
         
-        return charts_info
+        # The Chinese font is resolved (once per process, cached on disk) only if a chart falls back to matplotlib
+        return chart_renderer.render_charts(visualization_data, output_dir, base_filename, profile=self.chart_profile,
+                                            chart_fonts=self.chart_fonts, font_path=self.chart_font_path)
 
     def generate_reflection(self, content, sub_title, keyword):
         """
         Reflect on the generated content, checking factual accuracy, logical coherence, etc.
+        Returns (reflection, score) where score is the 0-10 quality score reported by the model,
+        or None if it could not be parsed; (None, None) when the section budget is used up or
+        the call fails, so no optimization is attempted without feedback.
         """
-        prompt = f"""Please evaluate the following content about the "{sub_title}" of the {keyword} industry, checking for:
-
-1. Are there any factual errors or inaccurate information?
-2. Are there any logical inconsistencies or contradictions?
-3. Are there any overly vague or ambiguous statements?
-4. Are there any claims lacking clear references or supporting evidence?
-5. Are there any knowledge gaps or important information missing?
-6. Are there any data points that would be better presented as charts rather than text descriptions?
-
-For each issue found, please indicate the specific location and suggest how it could be improved. If the content quality is good, please also highlight its strengths.
-
-Content:
-{content}
+        prompt = f"""Content about the "{sub_title}" of the {keyword} industry:
+{{content}}
 """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant specialized in critical analysis."},
-            {"role": "user", "content": prompt}
-        ]
+        builder = PromptBuilder(self.router.choose("reflect"), min_output=800, max_output=2000, output_ratio=0.4)
+        builder.system(REFLECTION_INSTRUCTIONS)
+        builder.user(prompt, content=PromptSlot(content))
+        request = self.budget_request(builder, sub_title, "reflect")
+        if request is None:
+            return None, None
 
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                max_tokens=2000,
+            response = self.section_client(sub_title, "reflect").chat.completions.create(
+                **request,
                 temperature=0.5,
                 stream=False
             )
             reflection = response.choices[0].message.content
-            return reflection
         except Exception as e:
             print(f"Error generating reflection: {str(e)}")
-            return "Reflection generation failed."
-
-    def optimize_content(self, content, reflection, sub_title, keyword, charts_info=None):
+            return None, None
+        
+        # The score line is removed from the reflection passed on to optimization
+        score_matches = list(re.finditer(r"^.*QUALITY_SCORE\W*(\d+(?:\.\d+)?).*$", reflection, re.MULTILINE))
+        if not score_matches:
+            return reflection, None
+        score_match = score_matches[-1]
+        reflection = (reflection[:score_match.start()] + reflection[score_match.end():]).strip()
+        return reflection, min(float(score_match.group(1)), 10.0)
+
+    def refine_content(self, content, sub_title, keyword):
         """
-        Optimize content based on reflection results, and insert chart references at appropriate locations
-        with improved guidance for chart placement
+        Adaptive reflect -> optimize loop. Content scoring at or above the quality threshold is
+        not optimized at all; weaker content is optimized and re-evaluated until the score stops
+        improving over the best version so far or the per-section call budget is used up.
+        A pass that lowers the score is discarded in favor of the best scored version.
+        Returns (content, rounds) where rounds lists each reflection with its score.
         """
-        charts_prompt = ""
-        if charts_info and len(charts_info) > 0:
-            charts_prompt = "\n\n我们已经根据内容生成了以下图表。请在优化后的内容中的最恰当位置插入这些图表引用：\n\n"
-            for chart in charts_info:
-                charts_prompt += f"- {chart['title']} ({chart['type']} 类型图表): 插入 `{chart['markdown_ref']}` 在相关数据或描述附近\n"
+        reflection, score = self.generate_reflection(content, sub_title, keyword)
+        if reflection is None:
+            # No reflection (section budget used up or the call failed): the summary is kept as is
+            self.refine_stats.append({"section": sub_title, "scores": [], "calls": 0})
+            return content, []
+        calls = 1
+        rounds = [{"reflection": reflection, "score": score}]
+        # Best scored version so far; an optimization pass that lowers the score is discarded
+        best_content, best_score = content, score
+        
+        while (score is None or score < self.refine_threshold) and calls < self.refine_max_calls:
+            content = self.optimize_content(content, reflection, sub_title, keyword)
+            calls += 1
+            if calls >= self.refine_max_calls:
+                break
+            reflection, score = self.generate_reflection(content, sub_title, keyword)
+            if reflection is None:
+                break
+            calls += 1
+            rounds.append({"reflection": reflection, "score": score})
+            if score is None:
+                continue
+            if best_score is not None and score - best_score < REFINE_MIN_GAIN:
+                # Converged: another optimization is unlikely to pay off
+                if score < best_score:
+                    print(f"[{sub_title}] Score dropped from {best_score:g} to {score:g}, keeping the better version")
+                    content = best_content
+                break
+            best_content, best_score = content, score
         
-        prompt = f"""请根据以下反馈优化关于"{sub_title}"的{keyword}行业内容：
+        scores = " -> ".join("?" if r["score"] is None else f"{r['score']:g}" for r in rounds)
+        print(f"[{sub_title}] Refinement: scores {scores}, {calls} calls")
+        self.refine_stats.append({"section": sub_title, "scores": [r["score"] for r in rounds], "calls": calls})
+        return content, rounds
+
+    def optimize_content(self, content, reflection, sub_title, keyword):
+        """
+        Optimize content based on reflection results. In patch mode the model returns localized
+        edits that are applied here; a full rewrite is the fallback when the patch does not apply.
+        Chart references are placed afterwards by chart_placement.
+        """
+        if self.optimize_mode == "patch":
+            patched = self.patch_content(content, reflection, sub_title, keyword)
+            if patched is not None:
+                return patched
+            print(f"[{sub_title}] Patch could not be applied, falling back to full rewrite")
+        return self.rewrite_content(content, reflection, sub_title, keyword)
+
+    def patch_content(self, content, reflection, sub_title, keyword):
+        """
+        Ask for a JSON list of localized edits and apply them with fuzzy anchor matching.
+        Returns the patched content, or None if the reply is unusable or too many edits fail.
+        """
+        prompt = f"""需要优化的是关于"{sub_title}"的{keyword}行业内容。
 
 原始内容:
-{content}
+{{content}}
 
 反馈:
-{reflection}{charts_prompt}
-
-请全面改进内容，重点解决反馈中指出的问题，确保:
-1. 修正所有事实错误和不准确信息
-2. 确保逻辑连贯性和论证一致性
-3. 用具体、清晰的内容替换模糊的陈述
-4. 添加数据来源和支持证据以增强可信度
-5. 填补知识空白，添加重要的缺失信息
-6. 保持专业性和可读性
-7. 在最合适的位置插入图表引用（如果有）
-
-注意事项:
-- 图表应该放在相关数据讨论的附近，不要集中放在一起
-- 每个图表前后应有相关说明或分析，帮助读者理解图表展示的要点
-- 图表引用后应该有1-2句对图表内容的简短总结或补充说明
-- 图表不应打断文章的逻辑流程，应该作为对文本内容的补充
-- 如果文章中提到了某个数据趋势或比较，相关图表应该放在该段落之后
-
-请提供完整的优化内容，而不仅仅是修改列表。不要在开头列出修改项或总结，也不要包含"以下是优化后的内容"等过渡语句。直接从正文内容开始。
+{{reflection}}
 """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant specialized in content optimization, with expertise in integrating data visualizations into reports."},
-            {"role": "user", "content": prompt}
-        ]
+        # Anchors must be verbatim, so the content itself is never trimmed
+        builder = PromptBuilder(self.router.choose("optimize"), min_output=800, max_output=2000, output_ratio=0.3)
+        builder.system(PATCH_INSTRUCTIONS)
+        builder.user(prompt, content=PromptSlot(content, priority=1, min_tokens=None),
+                     reflection=PromptSlot(reflection, scales_output=False))
+        request = self.budget_request(builder, sub_title, "optimize")
+        if request is None:
+            return None
 
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                max_tokens=5000,
+            response = self.section_client(sub_title, "optimize").chat.completions.create(
+                **request,
                 temperature=0.7,
+                response_format={"type": "json_object"},
                 stream=False
             )
-            optimized = response.choices[0].message.content
-            return optimized
+            edits = json.loads(response.choices[0].message.content).get("edits")
         except Exception as e:
-            print(f"Error optimizing content: {str(e)}")
-            return content  # If optimization fails, return original content
+            print(f"Error requesting content edits: {str(e)}")
+            return None
+        if not isinstance(edits, list):
+            return None
+        if not edits:
+            return content
+        
+        patched, failed = content_patch.apply_edits(content, edits)
+        print(f"[{sub_title}] Applied {len(edits) - len(failed)}/{len(edits)} edits")
+        if len(failed) * 2 > len(edits):
+            return None
+        return patched
 
-    def summarize_content(self, content, sub_title, keyword, custom_prompt=None):
+    def rewrite_content(self, content, reflection, sub_title, keyword):
         """
-        Generate a summary based on the original content,
-        ensuring clear structure, professionalism, and appropriate use of tables for data.
+        Full rewrite of the content based on reflection results
         """
-        # Use custom prompt or default prompt
-        if custom_prompt:
-            prompt = custom_prompt.replace("{keyword}", keyword).replace("{content}", content)
-        else:
-            prompt = f"""Please summarize the following content about the "{sub_title}" of the {keyword} industry, ensuring:
+        prompt = f"""需要优化的是关于"{sub_title}"的{keyword}行业内容。
 
-1. Professional and fluid language with clear logic
-2. Maintain industry professionalism with accurate terminology
-3. Use cohesive paragraphs of about 500-600 words each, with each paragraph focused on a core concept, and ensure clear logical relationships and transitions between paragraphs
-4. Retain important data, facts, and cases as arguments, and use tables to present key data where appropriate
-5. Retain original citation markers [x] to ensure academic rigor
-6. Organize content by chronological order or logical relationship with clear structure
-7. Ensure the final content has both depth of analysis and practical value
-8. Add a concluding paragraph analyzing the overall situation and key points of this section
-
-Original content:
+原始内容:
+{{content}}
 
-{content}
+反馈:
+{{reflection}}
 """
+        # The rewrite reproduces the whole content, so the output budget follows its size
+        builder = PromptBuilder(self.router.choose("optimize"), min_output=2000, max_output=8000, output_ratio=1.3)
+        builder.system(REWRITE_INSTRUCTIONS)
+        builder.user(prompt, content=PromptSlot(content, priority=1, min_tokens=None),
+                     reflection=PromptSlot(reflection, scales_output=False))
+        request = self.budget_request(builder, sub_title, "optimize")
+        if request is None:
+            return content
 
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
+        try:
+            return self.complete_long_reply(request, "optimize", sub_title, temperature=0.7, stream=False)
+        except Exception as e:
+            print(f"Error optimizing content: {str(e)}")
+            return content  # If optimization fails, return original content
 
+    def complete_long_reply(self, request, stage, sub_title, **params):
+        """
+        Run a long-form call built by PromptBuilder; a reply cut off at max_tokens is
+        continued from its tail instead of being returned truncated
+        """
+        text, rounds = complete_with_continuation(
+            self.section_client(sub_title, stage), request, max_rounds=self.max_continuations, **params
+        )
+        if rounds:
+            self.continuation_stats.append({"section": sub_title, "stage": stage, "rounds": rounds})
+        return text
+
+    def compress_source(self, content, sub_title):
+        """
+        Strip page boilerplate and repeated sentences from the source body locally;
+        the reference list is kept as is
+        """
+        if not self.compress_sources:
+            return content
+        body, references = split_reference_section(content)
+        compressed, stats = text_compress.compress_text(body)
+        stats["section"] = sub_title
+        self.compression_stats.append(stats)
+        print(f"[{sub_title}] Source compressed to {stats['ratio']:.0%} of {stats['original_chars']} chars "
+              f"(dropped {stats['dropped']})")
+        if references:
+            compressed += "\n\n" + references
+        return compressed
+
+    def condense_source(self, content, sub_title, keyword):
+        """
+        Map phase for oversized sections: split the source at snippet boundaries, condense the
+        chunks in parallel, and return the joined notes (plus the reference list) for the final
+        summarization call. Content under the token threshold is returned unchanged.
+        """
+        if estimate_tokens(content) <= self.map_reduce_threshold:
+            return content
+        
+        body, references = split_reference_section(content)
+        chunks = split_into_chunks(body, self.map_chunk_tokens)
+        print(f"[{sub_title}] Source has ~{estimate_tokens(content)} tokens, condensing {len(chunks)} chunks in parallel")
+        
+        with ThreadPoolExecutor(max_workers=min(self.map_workers, len(chunks))) as executor:
+            notes = list(executor.map(
+                lambda chunk: self.condense_chunk(chunk, sub_title, keyword), chunks
+            ))
+        condensed = "\n\n".join(notes)
+        if references:
+            condensed += "\n\n" + references
+        print(f"[{sub_title}] Condensed source to ~{estimate_tokens(condensed)} tokens")
+        return condensed
+
+    def condense_chunk(self, chunk, sub_title, keyword):
+        """
+        Condense one chunk of source material into dense notes, keeping citation markers
+        """
+        prompt = f"""以下是关于{keyword}行业"{sub_title}"的一部分原始资料:
+{{chunk}}
+"""
+        builder = PromptBuilder(self.router.choose("condense"), min_output=500, max_output=2000, output_ratio=0.5)
+        builder.system(CONDENSE_INSTRUCTIONS)
+        builder.user(prompt, chunk=PromptSlot(chunk))
+        self.budget.section(sub_title).cap_output(builder)
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                max_tokens=5000,
-                temperature=0.7,
+            response = self.section_client(sub_title, "summarize").chat.completions.create(
+                **builder.build(),
+                temperature=0.3,
                 stream=False
             )
-            summary = response.choices[0].message.content
-            return summary
+            return response.choices[0].message.content
+        except Exception as e:
+            print(f"Error condensing chunk: {str(e)}")
+            # Keep the chunk (capped) rather than losing its facts
+            return truncate_to_tokens(chunk, 2000)
+
+    def summarize_content(self, content, sub_title, keyword, custom_prompt=None):
+        """
+        Generate a summary based on the original content,
+        ensuring clear structure, professionalism, and appropriate use of tables for data.
+        Oversized content is condensed chunk by chunk first (map-reduce).
+        """
+        content = self.condense_source(content, sub_title, keyword)
+        builder = PromptBuilder(self.router.choose("summarize"), min_output=2000, max_output=6000, output_ratio=0.6)
+        system, template = self.build_summary_prompt(sub_title, keyword, custom_prompt)
+        builder.system(system)
+        builder.user(template, content=PromptSlot(content))
+        # The summary is always produced; a tight budget only shortens it
+        self.budget.section(sub_title).cap_output(builder)
+
+        try:
+            return self.complete_long_reply(builder.build(), "summarize", sub_title, temperature=0.7, stream=False)
         except Exception as e:
             print(f"Error calling DeepSeek API: {str(e)}")
             return content
 
+    def summarize_content_with_charts(self, content, sub_title, keyword, custom_prompt=None):
+        """
+        Fused mode: one reasoner call returns the summary followed by a fenced JSON block of
+        chart specs, which is split off locally. Returns (summary, charts); charts is None
+        when the reply carries no usable block, so the caller can fall back to extraction.
+        """
+        content = self.condense_source(content, sub_title, keyword)
+        system, template = self.build_summary_prompt(sub_title, keyword, custom_prompt)
+        builder = PromptBuilder(self.router.choose("summarize"), min_output=3000, max_output=8000, output_ratio=0.6)
+        builder.system(system + FUSED_CHART_INSTRUCTIONS)
+        builder.user(template, content=PromptSlot(content))
+        self.budget.section(sub_title).cap_output(builder)
+
+        try:
+            start_time = time.time()
+            reply = self.complete_long_reply(builder.build(), "summarize", sub_title, temperature=0.7, stream=False)
+            elapsed = time.time() - start_time
+        except Exception as e:
+            print(f"Error calling DeepSeek API: {str(e)}")
+            return content, None
+
+        summary, chart_block = viz_data.split_fused_charts(reply)
+        charts = viz_data.parse_chart_json(chart_block) if chart_block else None
+        if charts is None:
+            print(f"[{sub_title}] No chart block in fused summary, falling back to chart extraction")
+            return summary, None
+        charts = self.validate_charts(charts, summary, sub_title)
+
+        # The avoided call would have sent the extraction prompt and produced the chart block;
+        # the fused call pays for the extra instructions instead
+        saved_tokens = (estimate_tokens(VISUALIZATION_INSTRUCTIONS) + estimate_tokens(self.build_visualization_prompt(sub_title, keyword))
+                        + estimate_tokens(summary)
+                        + estimate_tokens(chart_block) - estimate_tokens(FUSED_CHART_INSTRUCTIONS))
+        self.fusion_stats.append({
+            "section": sub_title,
+            "charts": len(charts),
+            "saved_tokens": saved_tokens,
+            "summary_seconds": round(elapsed, 2),
+        })
+        print(f"[{sub_title}] Fused summary returned {len(charts)} charts, saved ~{saved_tokens} tokens")
+        return summary, charts
+
+    def build_summary_prompt(self, sub_title, keyword, custom_prompt=None):
+        """
+        (system message, user template) of the summarization call. The default instructions are
+        the fixed SUMMARY_INSTRUCTIONS; a section's custom prompt is section-specific and goes in
+        the user message. {content} is filled by PromptBuilder; custom prompts without the
+        placeholder get it appended.
+        """
+        if custom_prompt:
+            template = custom_prompt.replace("{keyword}", keyword)
+            if "{content}" not in template:
+                template += "\n\n{content}"
+            return "You are a helpful assistant.", template
+        return SUMMARY_INSTRUCTIONS, f"""Content about the "{sub_title}" of the {keyword} industry:
+
+{{content}}
+"""
+
+    def fusion_report(self):
+        """
+        Report-level totals of fused mode. The saved latency is one avoided extraction call per
+        fused section, timed by the standalone extraction calls of this run when sections fell
+        back to them, otherwise by the mean latency the router observed for the model the
+        extraction call would have used
+        """
+        saved_seconds, baseline = None, None
+        if self.extraction_latencies:
+            baseline = "extraction_calls"
+            per_call = sum(self.extraction_latencies) / len(self.extraction_latencies)
+        else:
+            baseline = "router_mean_latency"
+            per_call = self.router.mean_latency(self.router.routes.get("visualize", "deepseek-chat"))
+        if self.fusion_stats and per_call is not None:
+            saved_seconds = round(per_call * len(self.fusion_stats), 1)
+        return {
+            "avoided_calls": len(self.fusion_stats),
+            "saved_tokens": sum(item["saved_tokens"] for item in self.fusion_stats),
+            "saved_seconds_estimate": saved_seconds,
+            "saved_seconds_baseline": baseline if saved_seconds is not None else None,
+            "sections": self.fusion_stats,
+        }
+
+def split_reference_section(content):
+    """
+    Split a trailing reference list (e.g. the Think&Cite "## 参考资料" section) from the body
+    """
+    match = re.search(r"^#{1,6}\s*(参考资料|参考文献|References)\s*$", content, re.MULTILINE)
+    if not match:
+        return content, ""
+    return content[:match.start()].rstrip(), content[match.start():].strip()
+
+def merge_enhanced_content(content, enhanced):
+    """
+    Append the Think&Cite text to the step1 source: both bodies first, then both reference
+    lists, so the trailing reference section is still split off as one block. Think&Cite cites
+    with [n] and step1 with [refN], so the two numberings do not collide.
+    """
+    body, references = split_reference_section(content)
+    enhanced_body, enhanced_references = split_reference_section(enhanced)
+    if not enhanced_body.strip():
+        return content
+    merged = f"{body}\n\n## Think&Cite 补充内容\n\n{enhanced_body}"
+    if enhanced_references:
+        enhanced_references = re.sub(r"^(#{1,6}\s*)(参考资料|参考文献|References)\s*$", r"\1\2（Think&Cite）",
+                                     enhanced_references, count=1, flags=re.MULTILINE)
+    references = "\n\n".join(part for part in (references, enhanced_references) if part)
+    return f"{merged}\n\n{references}" if references else merged
+
 def load_section_prompts():
     """
     Load section prompts generated from step0
@@ -593,92 +792,210 @@ def find_prompt_for_section(section_prompts, filename):
     
     return None
 
+def process_section(processor, filename, keyword, input_dir, prompts_dir, output_dir, section_prompts, step1_5_dir=None):
+    """
+    Summarize, reflect on, visualize and optimize a single step1 section file
+    """
+    input_path = os.path.join(input_dir, filename)
+    with open(input_path, "r", encoding="utf-8") as f:
+        original_content = f.read()
+   
+    # Extract subsection title
+    sub_title = processor.extract_sub_title(original_content, filename)
+    
+    # Add the Think&Cite enhanced content for this section, if it exists, to the step1 material
+    if step1_5_dir:
+        enhanced_path = os.path.join(step1_5_dir, f"{os.path.splitext(filename)[0]}_enhanced.md")
+        if os.path.exists(enhanced_path):
+            with open(enhanced_path, "r", encoding="utf-8") as f:
+                original_content = merge_enhanced_content(original_content, f.read())
+            print(f"Added Think&Cite enhanced content: {enhanced_path}")
+    print(f"\nSummarizing: {sub_title}")
+    original_content = processor.compress_source(original_content, sub_title)
+    
+    # Find custom prompt
+    custom_prompt = processor.extract_prompt_from_file(filename, prompts_dir)
+    if not custom_prompt:
+        custom_prompt = find_prompt_for_section(section_prompts, filename)
+        
+    # Generate summary (and the chart specs, in fused mode)
+    fused_charts = None
+    if processor.fused_charts:
+        summary, fused_charts = processor.summarize_content_with_charts(original_content, sub_title, keyword, custom_prompt)
+    else:
+        summary = processor.summarize_content(original_content, sub_title, keyword, custom_prompt)
+    
+    print(f"[{sub_title}] Summary generation complete, performing reflection evaluation...")
+    
+    # Reflect and optimize adaptively while the charts are extracted and rendered
+    print(f"[{sub_title}] Refining content based on reflection, extracting data and generating charts...")
+    with ThreadPoolExecutor(max_workers=1) as optimizer:
+        refine_future = optimizer.submit(processor.refine_content, summary, sub_title, keyword)
+        
+        if fused_charts is not None:
+            visualization_data = fused_charts
+        else:
+            visualization_data = processor.extract_data_for_visualization(summary, sub_title, keyword)
+        base_filename = os.path.splitext(filename)[0]
+        charts_info = processor.generate_charts(visualization_data, output_dir, base_filename)
+        
+        optimized, reflection_rounds = refine_future.result()
+    
+    # Save reflection results, one entry per refinement round
+    reflection_filename = f"{os.path.splitext(filename)[0]}_reflection.md"
+    reflection_path = os.path.join(output_dir, reflection_filename)
+    with open(reflection_path, "w", encoding="utf-8") as f:
+        f.write(f"# {sub_title} - Reflection Evaluation\n")
+        for i, round_info in enumerate(reflection_rounds, 1):
+            score = "N/A" if round_info["score"] is None else f"{round_info['score']:g}/10"
+            f.write(f"\n## Round {i} (score: {score})\n\n{round_info['reflection']}\n")
+    print(f"Saved reflection evaluation to: {reflection_path}")
+    
+    # Insert chart references after the best matching paragraphs
+    optimized = chart_placement.place_charts(optimized, charts_info, visualization_data)
+    
+    # Save optimized content
+    optimized_filename = f"{os.path.splitext(filename)[0]}_optimized.md"
+    optimized_path = os.path.join(output_dir, optimized_filename)
+    with open(optimized_path, "w", encoding="utf-8") as f:
+        f.write(optimized)
+    print(f"Saved optimized content to: {optimized_path}")
+    
+    # Also save original summary (for comparison)
+    summary_filename = f"{os.path.splitext(filename)[0]}_summary.md"
+    summary_path = os.path.join(output_dir, summary_filename)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(summary)
+    print(f"Saved original summary to: {summary_path}")
+    
+    # Save visualization data
+    if visualization_data:
+        viz_data_filename = f"{os.path.splitext(filename)[0]}_visualization_data.json"
+        viz_data_path = os.path.join(output_dir, "charts", viz_data_filename)
+        with open(viz_data_path, "w", encoding="utf-8") as f:
+            json.dump(visualization_data, f, ensure_ascii=False, indent=2)
+        print(f"Saved visualization data to: {viz_data_path}")
+    
+    return charts_info
+
 def main():
     keyword = input("Please enter the industry keyword for the research report (consistent with step1): ").strip()
     
     # 从环境变量中读取目录路径，如果没有则使用默认路径
     step1_dir = os.environ.get("REPORT_STEP1_DIR", os.path.join("reports", "step1"))
     step2_dir = os.environ.get("REPORT_STEP2_DIR", os.path.join("reports", "step2"))
+    # Optional Think&Cite output; when set, enhanced sections are added to the step1 content
+    step1_5_dir = os.environ.get("REPORT_STEP1_5_DIR")
+    # Number of sections processed concurrently, and of chart rendering processes (default: CPU count)
+    section_workers = int(os.environ.get("REPORT_STEP2_WORKERS", "3"))
+    chart_workers = int(os.environ.get("REPORT_CHART_WORKERS", "0")) or None
     
     input_dir = step1_dir
     prompts_dir = os.path.join(input_dir, "prompts")
     output_dir = step2_dir
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(os.path.join(output_dir, "charts"), exist_ok=True)
-   
-    processor = ContentProcessor()
+    
     section_prompts = load_section_prompts()
-   
-    # Process Markdown files generated in step1
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".md"):
-            input_path = os.path.join(input_dir, filename)
-            with open(input_path, "r", encoding="utf-8") as f:
-                original_content = f.read()
-           
-            # Extract subsection title
-            sub_title = processor.extract_sub_title(original_content, filename)
-            print(f"\nSummarizing: {sub_title}")
-            
-            # Find custom prompt
-            custom_prompt = processor.extract_prompt_from_file(filename, prompts_dir)
-            if not custom_prompt:
-                custom_prompt = find_prompt_for_section(section_prompts, filename)
-                
-            # Generate summary
-            summary = processor.summarize_content(original_content, sub_title, keyword, custom_prompt)
-            
-            print("Summary generation complete, performing reflection evaluation...")
-            
-            # Perform reflection
-            reflection = processor.generate_reflection(summary, sub_title, keyword)
-            
-            # Save reflection results
-            reflection_filename = f"{os.path.splitext(filename)[0]}_reflection.md"
-            reflection_path = os.path.join(output_dir, reflection_filename)
-            with open(reflection_path, "w", encoding="utf-8") as f:
-                f.write(f"# {sub_title} - Reflection Evaluation\n\n{reflection}")
-            print(f"Saved reflection evaluation to: {reflection_path}")
-            
-            # Extract visualization data and generate charts
-            print("Extracting data and generating charts...")
-            visualization_data = processor.extract_data_for_visualization(summary, sub_title, keyword)
-            base_filename = os.path.splitext(filename)[0]
-            charts_info = processor.generate_charts(visualization_data, output_dir, base_filename)
-            
-            print("Optimizing content based on reflection...")
-            
-            # Optimize content based on reflection, and insert chart references
-            optimized = processor.optimize_content(summary, reflection, sub_title, keyword, charts_info)
-            
-            # Save optimized content
-            optimized_filename = f"{os.path.splitext(filename)[0]}_optimized.md"
-            optimized_path = os.path.join(output_dir, optimized_filename)
-            with open(optimized_path, "w", encoding="utf-8") as f:
-                f.write(optimized)
-            print(f"Saved optimized content to: {optimized_path}")
-            
-            # Also save original summary (for comparison)
-            summary_filename = f"{os.path.splitext(filename)[0]}_summary.md"
-            summary_path = os.path.join(output_dir, summary_filename)
-            with open(summary_path, "w", encoding="utf-8") as f:
-                f.write(summary)
-            print(f"Saved original summary to: {summary_path}")
-            
-            # Save visualization data
-            if visualization_data:
-                viz_data_filename = f"{os.path.splitext(filename)[0]}_visualization_data.json"
-                viz_data_path = os.path.join(output_dir, "charts", viz_data_filename)
-                with open(viz_data_path, "w", encoding="utf-8") as f:
-                    json.dump(visualization_data, f, ensure_ascii=False, indent=2)
-                print(f"Saved visualization data to: {viz_data_path}")
-            
-            time.sleep(1)
+    md_files = [filename for filename in os.listdir(input_dir) if filename.endswith(".md")]
+    
+    # Sections run in a thread pool (API-bound); charts of all sections render in a shared process pool
+    processor = ContentProcessor()
+    processor.allocate_budget(input_dir, md_files)
+    if isinstance(processor.llm_client, llm_providers.ProviderPool):
+        print(f"LLM provider health: {processor.llm_client.check_health()}")
+    all_charts = []
+    with ChartRenderService(chart_workers, processor.chart_fonts, processor.chart_font_path,
+                            processor.chart_profile) as chart_service:
+        processor.chart_service = chart_service
+        
+        with ThreadPoolExecutor(max_workers=max(1, section_workers)) as executor:
+            futures = {
+                executor.submit(process_section, processor, filename, keyword, input_dir,
+                                prompts_dir, output_dir, section_prompts, step1_5_dir): filename
+                for filename in md_files
+            }
+            for future in as_completed(futures):
+                try:
+                    all_charts.extend(future.result() or [])
+                except Exception as e:
+                    print(f"Error processing {futures[future]}: {str(e)}")
+    
+    processor.close()
     
     print("\n====== Content Summarization and Optimization Complete ======")
     print(f"All content saved to: {output_dir}")
     print(f"Generated charts saved to: {os.path.join(output_dir, 'charts')}")
+    
+    # Image payload of this report; the chart profile is the main lever on it
+    chart_stats = {
+        "profile": processor.chart_profile,
+        "chart_count": len(all_charts),
+        "total_bytes": sum(os.path.getsize(c["path"]) for c in all_charts if os.path.exists(c["path"])),
+    }
+    print(f"Chart images ({chart_stats['profile']}): {chart_stats['chart_count']} files, "
+          f"{chart_stats['total_bytes'] / 1024:.1f} KB")
+    
+    # Refinement effort: sections that skipped optimization and calls spent overall
+    if processor.refine_stats:
+        skipped = sum(1 for item in processor.refine_stats if item["calls"] == 1)
+        refine_calls = sum(item["calls"] for item in processor.refine_stats)
+        print(f"Refinement: {skipped}/{len(processor.refine_stats)} sections passed without optimization, "
+              f"{refine_calls} reflect/optimize calls in total")
+        chart_stats["refinement"] = {"sections": len(processor.refine_stats), "skipped": skipped, "calls": refine_calls}
+    
+    # Savings of fused summarize+charts mode for this report
+    if processor.fused_charts:
+        fusion = processor.fusion_report()
+        with open(os.path.join(output_dir, "fused_chart_stats.json"), "w", encoding="utf-8") as f:
+            json.dump(fusion, f, ensure_ascii=False, indent=2)
+        print(f"Fused chart extraction: {fusion['avoided_calls']} reasoner calls avoided, "
+              f"~{fusion['saved_tokens']} tokens saved, ~{fusion['saved_seconds_estimate']} s saved")
+        chart_stats["fused_charts"] = {k: v for k, v in fusion.items() if k != "sections"}
+    
+    # Model routing decisions, including downgrades under load
+    routing = processor.router.report()
+    if isinstance(processor.llm_client, llm_providers.ProviderPool):
+        routing["providers"] = processor.llm_client.report()
+        print(f"LLM providers: {routing['providers']['hedged_requests']} hedged requests, "
+              + ", ".join(f"{name} {item['calls']} calls / {item['failures']} failures / {item['hedge_wins']} hedge wins"
+                          for name, item in routing["providers"]["providers"].items()))
+    with open(os.path.join(output_dir, "model_routing.json"), "w", encoding="utf-8") as f:
+        json.dump(routing, f, ensure_ascii=False, indent=2)
+    print(f"Model routing ({routing['profile']}): {routing['calls']} calls, {routing['degraded_calls']} downgraded")
+    for model, cache in routing["cache"].items():
+        print(f"Context cache ({model}): {cache['cache_hit_tokens']}/{cache['prompt_tokens']} prompt tokens "
+              f"served from cache ({cache['hit_ratio']:.0%})")
+    chart_stats["routing"] = {k: v for k, v in routing.items() if k not in ("decisions", "usage")}
+    
+    # Spend against the report budget, per section and stage
+    if processor.budget.enabled:
+        budget_report = processor.budget.report()
+        with open(os.path.join(output_dir, "token_budget.json"), "w", encoding="utf-8") as f:
+            json.dump(budget_report, f, ensure_ascii=False, indent=2)
+        degraded = sum(1 for item in budget_report["sections"].values() if item["skipped"])
+        print(f"Budget: {budget_report['spent_tokens']} tokens / ${budget_report['spent_usd']:.4f} spent, "
+              f"{degraded} sections degraded")
+        chart_stats["budget"] = {k: v for k, v in budget_report.items() if k != "sections"}
+        chart_stats["budget"]["degraded_sections"] = degraded
+    
+    # Source compression per section
+    if processor.compression_stats:
+        with open(os.path.join(output_dir, "source_compression.json"), "w", encoding="utf-8") as f:
+            json.dump(processor.compression_stats, f, ensure_ascii=False, indent=2)
+        original_chars = sum(item["original_chars"] for item in processor.compression_stats)
+        compressed_chars = sum(item["compressed_chars"] for item in processor.compression_stats)
+        ratio = round(compressed_chars / original_chars, 3) if original_chars else 1.0
+        print(f"Source compression: {original_chars} -> {compressed_chars} chars ({ratio:.0%})")
+        chart_stats["compression"] = {"original_chars": original_chars, "compressed_chars": compressed_chars, "ratio": ratio}
+    
+    # Truncated replies recovered by continuation instead of regenerating the section
+    if processor.continuation_stats:
+        rounds = sum(item["rounds"] for item in processor.continuation_stats)
+        print(f"Continuations: {len(processor.continuation_stats)} truncated replies completed with {rounds} extra calls")
+        chart_stats["continuations"] = {"replies": len(processor.continuation_stats), "rounds": rounds}
     print("Please run step3.py to compile the final report.")
+    return chart_stats
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,423 @@
+# Lightweight SVG chart rendering for the simple chart types.
+# Pure Python: no matplotlib, numpy or font scanning, so rendering a chart takes well under
+# a millisecond. Text is emitted as SVG <text> with a CSS font stack and shaped by the viewer.
+# Scatter, bubble and radar charts still go through chart_renderer (matplotlib).
+import os
+import math
+from xml.sax.saxutils import escape, quoteattr
+
+# CSS font stack for chart text; the first installed font wins in the browser / PDF engine
+SVG_FONT_FAMILIES = [
+    'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB', 'Noto Sans CJK SC',
+    'Source Han Sans SC', 'WenQuanYi Micro Hei', 'SimHei', 'sans-serif'
+]
+
+# Pixels per figure-size inch, so profile figure sizes map to the same aspect ratio
+PIXELS_PER_INCH = 80
+
+# Sampled from the matplotlib colormaps used by chart_renderer.COLOR_SCHEMES (0.0 to 1.0 in steps of 0.1)
+_SEQUENTIAL_STOPS = {
+    "Blues": ['#f7fbff', '#e3eef9', '#d0e1f2', '#b7d4ea', '#94c4df', '#6aaed6',
+              '#4a98c9', '#2e7ebc', '#1764ab', '#084a91', '#08306b'],
+    "Reds": ['#fff5f0', '#fee5d8', '#fdcab5', '#fcab8f', '#fc8a6a', '#fb694a',
+             '#f14432', '#d92523', '#bc141a', '#980c13', '#67000d'],
+    "Oranges": ['#fff5eb', '#fee9d4', '#fdd9b4', '#fdc38d', '#fda762', '#fd8c3b',
+                '#f3701b', '#e25508', '#c54102', '#9e3303', '#7f2704'],
+    "PuBu": ['#fff7fb', '#f0eaf4', '#dbdaeb', '#c0c9e2', '#9cb9d9', '#73a9cf',
+             '#4295c3', '#187cb6', '#0567a2', '#045382', '#023858'],
+    "Greens": ['#f7fcf5', '#e9f7e5', '#d3eecd', '#b8e3b2', '#98d594', '#73c476',
+               '#4bb062', '#2f974e', '#157f3b', '#006428', '#00441b'],
+}
+_PASTEL1 = ['#fbb4ae', '#b3cde3', '#ccebc5', '#decbe4', '#fed9a6',
+            '#ffffcc', '#e5d8bd', '#fddaec', '#f2f2f2']
+
+
+class _Palette:
+    """Callable like a matplotlib colormap: palette(0.0 .. 1.0) -> '#rrggbb'"""
+    def __init__(self, stops, qualitative=False):
+        self.stops = stops
+        self.qualitative = qualitative
+
+    def __call__(self, x):
+        x = min(max(x, 0.0), 1.0)
+        if self.qualitative:
+            return self.stops[min(int(x * len(self.stops)), len(self.stops) - 1)]
+        position = x * (len(self.stops) - 1)
+        low = int(position)
+        high = min(low + 1, len(self.stops) - 1)
+        fraction = position - low
+        start, end = self.stops[low], self.stops[high]
+        channels = [
+            round(int(start[k:k+2], 16) + (int(end[k:k+2], 16) - int(start[k:k+2], 16)) * fraction)
+            for k in (1, 3, 5)
+        ]
+        return "#" + "".join(f"{c:02x}" for c in channels)
+
+
+COLOR_SCHEMES = {
+    "bar": _Palette(_SEQUENTIAL_STOPS["Blues"]),
+    "horizontal_bar": _Palette(_SEQUENTIAL_STOPS["Reds"]),
+    "line": _Palette(_SEQUENTIAL_STOPS["Oranges"]),
+    "area": _Palette(_SEQUENTIAL_STOPS["PuBu"]),
+    "pie": _Palette(_SEQUENTIAL_STOPS["Greens"]),
+    "donut": _Palette(_PASTEL1, qualitative=True),
+}
+
+SVG_RENDERERS = {}
+
+def register_renderer(chart_type):
+    def decorator(func):
+        SVG_RENDERERS[chart_type] = func
+        return func
+    return decorator
+
+def supports(chart_type):
+    """Whether a chart type can be rendered without matplotlib"""
+    return (chart_type or "bar").lower() in SVG_RENDERERS
+
+
+class _Canvas:
+    """Accumulates SVG elements for one chart"""
+    def __init__(self, width, height, font_families):
+        self.width = width
+        self.height = height
+        self.font_family = ", ".join(
+            name if name == "sans-serif" else f"'{name}'" for name in font_families
+        )
+        self.elements = []
+
+    def add(self, element):
+        self.elements.append(element)
+
+    def text(self, x, y, content, size=12, anchor="middle", weight="normal", fill="#333333",
+             rotate=None, baseline="auto"):
+        transform = f' transform="rotate({rotate:.0f} {x:.1f} {y:.1f})"' if rotate else ""
+        self.add(
+            f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}" '
+            f'font-weight="{weight}" fill="{fill}" dominant-baseline="{baseline}"{transform}>'
+            f'{escape(str(content))}</text>'
+        )
+
+    def line(self, x1, y1, x2, y2, stroke="#808080", width=0.5, dashed=False, opacity=1.0):
+        dash = ' stroke-dasharray="4 3"' if dashed else ""
+        self.add(
+            f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="{stroke}" '
+            f'stroke-width="{width}" stroke-opacity="{opacity}"{dash}/>'
+        )
+
+    def rect(self, x, y, w, h, fill, stroke="none"):
+        self.add(f'<rect x="{x:.1f}" y="{y:.1f}" width="{max(w, 0):.1f}" height="{max(h, 0):.1f}" '
+                 f'fill="{fill}" stroke="{stroke}"/>')
+
+    def to_string(self):
+        header = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+            f'viewBox="0 0 {self.width} {self.height}" font-family={quoteattr(self.font_family)}>'
+        )
+        background = f'<rect width="{self.width}" height="{self.height}" fill="white"/>'
+        return "\n".join([header, background, *self.elements, "</svg>"]) + "\n"
+
+
+def _text_width(text, size):
+    """Approximate rendered width: CJK glyphs are a full em, Latin glyphs about half"""
+    return sum(size if ord(ch) > 0x2e7f else size * 0.55 for ch in str(text))
+
+def _nice_ticks(low, high, count=5):
+    """Round tick values spanning [low, high], always including zero"""
+    low, high = min(low, 0.0), max(high, 0.0)
+    if high == low:
+        high = low + 1.0
+    raw_step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw_step)
+    start = math.floor(low / step) * step
+    ticks = []
+    value = start
+    while value < high + step * 0.999:
+        ticks.append(round(value, 10))
+        value += step
+    return ticks
+
+def _format_tick(value):
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:g}"
+
+
+class _Axes:
+    """Plot area with a linear value axis and a categorical axis"""
+    def __init__(self, canvas, spec, horizontal=False):
+        self.canvas = canvas
+        self.labels = spec["labels"]
+        self.horizontal = horizontal
+        all_values = list(spec["values"])
+        for series in spec["additional_series"]:
+            all_values.extend(series["values"])
+        self.ticks = _nice_ticks(min(all_values), max(all_values))
+        self.low, self.high = self.ticks[0], self.ticks[-1]
+
+        label_space = max(_text_width(label, 10) for label in self.labels)
+        tick_space = max(_text_width(_format_tick(t), 10) for t in self.ticks)
+        if horizontal:
+            self.left = 60 + label_space
+            self.bottom = canvas.height - 70
+        else:
+            self.left = 60 + tick_space
+            # Rotated category labels need vertical room
+            self.bottom = canvas.height - (60 + min(label_space * 0.71, 160))
+        self.top = 70
+        self.right = canvas.width - (170 if spec["legend"] else 40)
+
+    def value_to_pixel(self, value):
+        fraction = (value - self.low) / (self.high - self.low)
+        if self.horizontal:
+            return self.left + fraction * (self.right - self.left)
+        return self.bottom - fraction * (self.bottom - self.top)
+
+    def category_band(self, position):
+        """(start, width) of a category slot along the category axis"""
+        if self.horizontal:
+            band = (self.bottom - self.top) / len(self.labels)
+            return self.top + position * band, band
+        band = (self.right - self.left) / len(self.labels)
+        return self.left + position * band, band
+
+    def category_center(self, position):
+        start, band = self.category_band(position)
+        return start + band / 2
+
+    def draw(self, x_label="", y_label=""):
+        canvas = self.canvas
+        # Grid and value tick labels
+        for tick in self.ticks:
+            p = self.value_to_pixel(tick)
+            if self.horizontal:
+                canvas.line(p, self.top, p, self.bottom, stroke="#b0b0b0", dashed=True, opacity=0.7)
+                canvas.text(p, self.bottom + 18, _format_tick(tick), size=10)
+            else:
+                canvas.line(self.left, p, self.right, p, stroke="#b0b0b0", dashed=True, opacity=0.7)
+                canvas.text(self.left - 8, p + 4, _format_tick(tick), size=10, anchor="end")
+        # Category labels
+        for position, label in enumerate(self.labels):
+            c = self.category_center(position)
+            if self.horizontal:
+                canvas.text(self.left - 8, c + 4, label, size=10, anchor="end")
+            else:
+                canvas.text(c, self.bottom + 16, label, size=10, anchor="end", rotate=-45)
+        # Frame
+        canvas.add(
+            f'<rect x="{self.left:.1f}" y="{self.top:.1f}" width="{self.right - self.left:.1f}" '
+            f'height="{self.bottom - self.top:.1f}" fill="none" stroke="#808080" stroke-width="0.5"/>'
+        )
+        if x_label:
+            canvas.text((self.left + self.right) / 2, canvas.height - 18, x_label, size=12)
+        if y_label:
+            canvas.text(20, (self.top + self.bottom) / 2, y_label, size=12, rotate=-90)
+
+
+def _legend(canvas, entries, x, y, title=None):
+    """entries: [(name, color, marker)] where marker is 'rect' or 'line'"""
+    if title:
+        canvas.text(x, y, title, size=10, anchor="start", weight="bold")
+        y += 18
+    for name, color, marker in entries:
+        if marker == "line":
+            canvas.line(x, y - 4, x + 22, y - 4, stroke=color, width=2)
+        else:
+            canvas.rect(x, y - 10, 18, 12, fill=color)
+        canvas.text(x + 28, y, name, size=10, anchor="start")
+        y += 20
+
+@register_renderer("bar")
+def _render_bar(canvas, spec, chart_data):
+    axes = _Axes(canvas, spec)
+    axes.draw(chart_data.get("x_label", ""), chart_data.get("y_label", ""))
+    values, cmap = spec["values"], spec["cmap"]
+    zero = axes.value_to_pixel(0)
+    for position, value in enumerate(values):
+        start, band = axes.category_band(position)
+        top = axes.value_to_pixel(value)
+        color = cmap(0.3 + 0.5 * position / max(len(values) - 1, 1))
+        canvas.rect(start + band * 0.1, min(top, zero), band * 0.8, abs(zero - top), fill=color)
+        # Value label on top of the bar
+        canvas.text(start + band / 2, min(top, zero) - 4, f"{value:.1f}", size=9)
+
+@register_renderer("horizontal_bar")
+def _render_horizontal_bar(canvas, spec, chart_data):
+    axes = _Axes(canvas, spec, horizontal=True)
+    axes.draw(chart_data.get("x_label", ""), chart_data.get("y_label", ""))
+    values, cmap = spec["values"], spec["cmap"]
+    zero = axes.value_to_pixel(0)
+    for position, value in enumerate(values):
+        start, band = axes.category_band(position)
+        end = axes.value_to_pixel(value)
+        color = cmap(0.3 + 0.5 * position / max(len(values) - 1, 1))
+        canvas.rect(min(end, zero), start + band * 0.1, abs(end - zero), band * 0.8, fill=color)
+        # Value label at the end of the bar
+        canvas.text(max(end, zero) + 4, start + band / 2 + 4, f"{value:.1f}", size=9, anchor="start")
+
+def _polyline_points(axes, values):
+    return [(axes.category_center(position), axes.value_to_pixel(value))
+            for position, value in enumerate(values)]
+
+def _points_attribute(points):
+    return " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+
+@register_renderer("line")
+def _render_line(canvas, spec, chart_data):
+    axes = _Axes(canvas, spec)
+    axes.draw(chart_data.get("x_label", ""), chart_data.get("y_label", ""))
+    values, cmap = spec["values"], spec["cmap"]
+    points = _polyline_points(axes, values)
+    canvas.add(f'<polyline points="{_points_attribute(points)}" fill="none" '
+               f'stroke="{cmap(0.6)}" stroke-width="2.5"/>')
+    for (x, y), value in zip(points, values):
+        canvas.add(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="5" fill="{cmap(0.8)}" stroke="{cmap(0.6)}"/>')
+        canvas.text(x, y - 10, f"{value:.1f}", size=9)
+
+    # Handle multiple lines if additional series exist
+    series_list = spec["additional_series"]
+    legend_entries = []
+    for j, series in enumerate(series_list):
+        color = cmap(0.3 + 0.5 * j / len(series_list))
+        series_points = _polyline_points(axes, series["values"])
+        canvas.add(f'<polyline points="{_points_attribute(series_points)}" fill="none" '
+                   f'stroke="{color}" stroke-width="1.5" stroke-dasharray="6 4"/>')
+        for x, y in series_points:
+            canvas.rect(x - 3.5, y - 3.5, 7, 7, fill=color)
+        legend_entries.append((series["name"], color, "line"))
+    if legend_entries:
+        _legend(canvas, legend_entries, axes.right + 20, axes.top + 12)
+
+@register_renderer("area")
+def _render_area(canvas, spec, chart_data):
+    axes = _Axes(canvas, spec)
+    axes.draw(chart_data.get("x_label", ""), chart_data.get("y_label", ""))
+    values, cmap = spec["values"], spec["cmap"]
+    points = _polyline_points(axes, values)
+    zero = axes.value_to_pixel(0)
+    outline = [(points[0][0], zero), *points, (points[-1][0], zero)]
+    canvas.add(f'<polygon points="{_points_attribute(outline)}" fill="{cmap(0.6)}" fill-opacity="0.5"/>')
+    canvas.add(f'<polyline points="{_points_attribute(points)}" fill="none" stroke="{cmap(0.8)}" stroke-width="1.5"/>')
+    for x, y in points:
+        canvas.add(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="4" fill="{cmap(0.8)}"/>')
+
+def _render_pie_wedges(canvas, spec, label_color):
+    labels, values, cmap = spec["labels"], spec["values"], spec["cmap"]
+    total = sum(values)
+    plot_width = canvas.width - 220
+    cx, cy = plot_width / 2 + 20, (canvas.height + 50) / 2
+    radius = min(plot_width, canvas.height - 120) / 2
+    colors = [cmap(0.2 + 0.6 * i / len(values)) for i in range(len(values))]
+
+    # Start at 12 o'clock and go counter-clockwise, like matplotlib's startangle=90
+    angle = math.pi / 2
+    for value, color in zip(values, colors):
+        sweep = 2 * math.pi * value / total
+        if sweep >= 2 * math.pi - 1e-9:
+            canvas.add(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{radius:.1f}" fill="{color}"/>')
+        elif sweep > 0:
+            x1, y1 = cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+            x2, y2 = cx + radius * math.cos(angle + sweep), cy - radius * math.sin(angle + sweep)
+            large_arc = 1 if sweep > math.pi else 0
+            canvas.add(
+                f'<path d="M {cx:.1f} {cy:.1f} L {x1:.1f} {y1:.1f} '
+                f'A {radius:.1f} {radius:.1f} 0 {large_arc} 0 {x2:.1f} {y2:.1f} Z" fill="{color}"/>'
+            )
+        # Percentage label at 60% of the radius, like autopct
+        middle = angle + sweep / 2
+        canvas.text(cx + 0.6 * radius * math.cos(middle), cy - 0.6 * radius * math.sin(middle) + 4,
+                    f"{100 * value / total:.1f}%", size=9, fill=label_color)
+        angle += sweep
+
+    # Add legend with labels
+    _legend(canvas, [(label, color, "rect") for label, color in zip(labels, colors)],
+            cx + radius + 30, cy - radius + 10, title="分类")
+    return cx, cy, radius
+
+@register_renderer("pie")
+def _render_pie(canvas, spec, chart_data):
+    _render_pie_wedges(canvas, spec, label_color="white")
+
+@register_renderer("donut")
+def _render_donut(canvas, spec, chart_data):
+    cx, cy, radius = _render_pie_wedges(canvas, spec, label_color="#333333")
+    # Make a hole in the center
+    canvas.add(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{0.7 * radius:.1f}" fill="white"/>')
+
+
+def build_svg(chart_data, index=0, figure_size=(12, 8), font_families=None):
+    """
+    Build the SVG document for a chart spec; returns (svg_text, chart_type, chart_title),
+    or None if the spec is incomplete or the chart type is not supported
+    """
+    chart_type = chart_data.get("chart_type", "bar").lower()
+    chart_title = chart_data.get("chart_title", f"图表 {index+1}")
+    renderer = SVG_RENDERERS.get(chart_type)
+    if renderer is None:
+        return None
+    data = chart_data.get("data", {})
+
+    labels = [str(label) for label in data.get("labels", [])]
+    try:
+        values = [float(v) for v in data.get("values", [])]
+    except (TypeError, ValueError):
+        print(f"Chart '{chart_title}' has non-numeric values, skipping generation")
+        return None
+    if not labels or not values or len(labels) != len(values):
+        print(f"Chart '{chart_title}' data incomplete or mismatched, skipping generation")
+        return None
+    if chart_type in ("pie", "donut") and (min(values) < 0 or sum(values) <= 0):
+        print(f"Chart '{chart_title}' has no positive shares, skipping generation")
+        return None
+
+    # Additional series are drawn only when their length matches the labels
+    additional_series = []
+    for j, series in enumerate(data.get("additional_series") or []):
+        try:
+            series_values = [float(v) for v in series.get("values", [])]
+        except (TypeError, ValueError):
+            continue
+        if len(series_values) == len(labels):
+            additional_series.append({"name": str(series.get("name", f"系列 {j+1}")), "values": series_values})
+    if chart_type != "line":
+        additional_series = []
+
+    spec = {
+        "labels": labels,
+        "values": values,
+        "additional_series": additional_series,
+        "legend": bool(additional_series),
+        "cmap": COLOR_SCHEMES[chart_type],
+    }
+    canvas = _Canvas(round(figure_size[0] * PIXELS_PER_INCH), round(figure_size[1] * PIXELS_PER_INCH),
+                     font_families or SVG_FONT_FAMILIES)
+    renderer(canvas, spec, chart_data)
+    canvas.text(canvas.width / 2, 40, chart_title, size=16, weight="bold")
+    return canvas.to_string(), chart_type, chart_title
+
+def render_chart(chart_data, index, output_dir, base_filename, figure_size=(12, 8), font_families=None):
+    """
+    Render a chart spec to <output_dir>/charts/<base>_chart_<n>.svg and return its chart info,
+    or None if the spec is incomplete or the type is not supported.
+    """
+    try:
+        built = build_svg(chart_data, index, figure_size, font_families)
+        if built is None:
+            return None
+        svg_text, chart_type, chart_title = built
+        chart_filename = f"{base_filename}_chart_{index+1}.svg"
+        chart_path = os.path.join(output_dir, "charts", chart_filename)
+        os.makedirs(os.path.dirname(chart_path), exist_ok=True)
+        with open(chart_path, "w", encoding="utf-8") as f:
+            f.write(svg_text)
+        print(f"Generated chart (svg): {chart_title} -> {chart_path}")
+        return {
+            "index": index,
+            "title": chart_title,
+            "type": chart_type,
+            "path": chart_path,
+            "markdown_ref": f"![{chart_title}](charts/{chart_filename})",
+            "cached": False
+        }
+    except Exception as e:
+        print(f"Error generating chart '{chart_data.get('chart_title', f'Chart {index+1}')}': {str(e)}")
+        return None
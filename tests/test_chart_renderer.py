@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import chart_renderer
+
+SPEC = {"chart_type": "bar", "chart_title": "市场规模", "x_label": "年份", "y_label": "亿元",
+        "data": {"labels": ["2022年", "2023年"], "values": [120.5, 150.8]}}
+
+
+def _fail_matplotlib(*args):
+    raise AssertionError("matplotlib path used for a simple chart type")
+
+
+def test_import_does_not_load_matplotlib():
+    code = "import sys, chart_renderer; print('matplotlib' in sys.modules, 'numpy' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_simple_types_are_rasterized_from_svg_under_png_profiles(tmp_path, monkeypatch):
+    rasterized = []
+
+    def svg2png(bytestring, write_to, scale):
+        rasterized.append((bytestring, scale))
+        with open(write_to, "wb") as f:
+            f.write(b"\x89PNG")
+
+    monkeypatch.setenv("REPORT_CHART_CACHE_DIR", "off")
+    monkeypatch.setattr(chart_renderer, "_svg_rasterizer", lambda: svg2png)
+    monkeypatch.setattr(chart_renderer, "build_figure", _fail_matplotlib)
+
+    info = chart_renderer.render_chart(SPEC, 0, str(tmp_path), "section", "SimHei", profile="print")
+
+    assert info["path"].endswith("section_chart_1.png") and os.path.exists(info["path"])
+    assert rasterized[0][0].startswith(b"<svg")
+    assert rasterized[0][1] == chart_renderer.CHART_DPI / chart_renderer.svg_charts.PIXELS_PER_INCH
+
+
+def test_png_profiles_fall_back_to_matplotlib_without_rasterizer(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPORT_CHART_CACHE_DIR", "off")
+    monkeypatch.setattr(chart_renderer, "_svg_rasterizer", lambda: None)
+
+    info = chart_renderer.render_chart(SPEC, 0, str(tmp_path), "section", "DejaVu Sans", profile="screen")
+
+    with open(info["path"], "rb") as f:
+        assert f.read(4) == b"\x89PNG"
+
+
+def test_svg_charts_do_not_resolve_the_font(tmp_path):
+    code = (
+        "import sys, chart_renderer\n"
+        f"chart_renderer.render_charts([{SPEC!r}], {str(tmp_path)!r}, 'section', profile='svg', chart_fonts=['SimHei'])\n"
+        "print('matplotlib.font_manager' in sys.modules)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env={**os.environ, "REPORT_CHART_CACHE_DIR": "off"})
+    assert result.stdout.split()[-1] == "False"
+    with open(tmp_path / "charts" / "section_chart_1.svg", encoding="utf-8") as f:
+        assert "SimHei" in f.read()
+
+
+def test_matplotlib_fallback_resolves_the_configured_font(tmp_path, monkeypatch):
+    resolved = []
+
+    def resolve(preferred_fonts=None, font_path=None):
+        resolved.append((preferred_fonts, font_path))
+        return "DejaVu Sans"
+
+    monkeypatch.setenv("REPORT_CHART_CACHE_DIR", "off")
+    monkeypatch.setattr(chart_renderer, "_svg_rasterizer", lambda: None)
+    monkeypatch.setattr(chart_renderer, "resolve_chinese_font", resolve)
+
+    info = chart_renderer.render_chart(SPEC, 0, str(tmp_path), "section", profile="screen", chart_fonts=["SimHei"])
+
+    assert info and resolved == [(["SimHei"], None)]
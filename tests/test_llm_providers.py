@@ -0,0 +1,59 @@
+import time
+import types
+
+import llm_providers
+import token_budget
+
+
+class FakeClient:
+    def __init__(self, delay):
+        self.delay = delay
+        self.closed = False
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        time.sleep(self.delay)
+        usage = types.SimpleNamespace(prompt_tokens=100, completion_tokens=50, prompt_cache_hit_tokens=0)
+        return types.SimpleNamespace(usage=usage, choices=[])
+
+    def close(self):
+        self.closed = True
+
+
+def test_losing_hedged_attempt_is_charged_and_close_releases_clients(monkeypatch):
+    monkeypatch.setattr(llm_providers, "DEFAULT_HEDGE_DELAY", 0.05)
+    slow = llm_providers.Provider("slow", "http://slow", "key", weight=1e9, client=FakeClient(0.3))
+    fast = llm_providers.Provider("fast", "http://fast", "key", weight=1e-9, client=FakeClient(0.01))
+    budget = token_budget.SectionBudget("section")
+
+    with llm_providers.ProviderPool([slow, fast], hedge=True) as pool:
+        budget.meter(pool, "summarize").chat.completions.create(
+            model="deepseek-chat", messages=[{"role": "user", "content": "hi"}])
+        assert pool.report()["hedged_requests"] == 1
+
+    assert budget.report()["by_stage"]["summarize"]["calls"] == 2
+    assert budget.spent_tokens == 300
+    assert slow.client.closed and fast.client.closed
+
+
+class NoModelsEndpoint(FakeClient):
+    @property
+    def models(self):
+        raise RuntimeError("404 /models")
+
+
+def test_failed_health_probe_keeps_provider_in_rotation():
+    provider = llm_providers.Provider("only", "http://only", "key", client=NoModelsEndpoint(0))
+    pool = llm_providers.ProviderPool([provider])
+
+    assert pool.check_health() == {"only": False}
+    assert pool.chat.completions.create(model="deepseek-chat", messages=[]).usage.prompt_tokens == 100
+
+
+def test_last_provider_is_tried_even_while_cooling_down():
+    provider = llm_providers.Provider("only", "http://only", "key", client=FakeClient(0))
+    provider.unhealthy_since = time.time()
+    pool = llm_providers.ProviderPool([provider])
+
+    assert pool.chat.completions.create(model="deepseek-chat", messages=[]) is not None
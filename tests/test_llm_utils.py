@@ -0,0 +1,27 @@
+import re
+
+from llm_utils import estimate_tokens, split_into_chunks
+
+
+def test_snippets_with_blank_lines_stay_whole():
+    snippets = [
+        f"第{i}条资料的第一段，市场规模持续扩大。\n\n第{i}条资料的第二段，头部企业份额提升。 [ref{i}]"
+        for i in range(1, 7)
+    ]
+    text = "\n\n".join(snippets)
+    chunks = split_into_chunks(text, estimate_tokens(snippets[0]) * 2)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        for part in re.split(r"(?<=\])\n\n", chunk):
+            assert re.search(r"\[ref\d+\]$", part)
+    assert "\n\n".join(chunks) == text
+
+
+def test_oversized_snippet_pieces_keep_the_marker():
+    snippet = "".join(f"第{i}句描述了行业的一个重要变化。" for i in range(40)) + " [ref7]"
+    chunks = split_into_chunks(snippet, 60)
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith("[ref7]") for chunk in chunks)
+    assert all(estimate_tokens(chunk) <= 60 for chunk in chunks)
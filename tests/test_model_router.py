@@ -0,0 +1,29 @@
+from llm_utils import ModelRouter
+
+
+def test_downgrade_then_recover_after_successful_probe():
+    router = ModelRouter(profile="quality", p95_threshold=10.0, window=5, min_samples=3, probe_interval=0.0)
+    for _ in range(3):
+        router.record("deepseek-reasoner", 30.0)
+
+    assert router.choose("summarize") == "deepseek-chat"
+    # probe_interval=0: the next call is let through to the reasoner
+    assert router.choose("summarize") == "deepseek-reasoner"
+    router.record("deepseek-reasoner", 4.0)
+
+    assert router.choose("summarize") == "deepseek-reasoner"
+    assert [d["reason"] for d in router.decisions] == ["degraded", "probe", "profile"]
+
+
+def test_slow_probe_keeps_the_downgrade():
+    router = ModelRouter(profile="quality", p95_threshold=10.0, window=5, min_samples=3, probe_interval=3600.0)
+    for _ in range(3):
+        router.record("deepseek-reasoner", 30.0)
+    assert router.choose("summarize") == "deepseek-chat"
+    router._degraded["deepseek-reasoner"] -= 3600.0
+
+    assert router.choose("summarize") == "deepseek-reasoner"
+    router.record("deepseek-reasoner", 25.0)
+
+    assert router.choose("summarize") == "deepseek-chat"
+    assert router.stats("deepseek-reasoner")["samples"] == 4
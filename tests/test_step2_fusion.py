@@ -0,0 +1,35 @@
+import step2
+
+
+def make_processor(monkeypatch):
+    monkeypatch.delenv("REPORT_LLM_PROVIDERS", raising=False)
+    monkeypatch.delenv("REPORT_HEDGE_REQUESTS", raising=False)
+    monkeypatch.setenv("REPORT_MODEL_PROFILE", "quality")
+    monkeypatch.setattr(step2, "API_KEY", "test-key")
+    return step2.ContentProcessor()
+
+
+def test_saved_seconds_from_router_latency_in_fused_run(monkeypatch):
+    processor = make_processor(monkeypatch)
+    processor.fusion_stats = [
+        {"section": "市场规模", "charts": 2, "saved_tokens": 900, "summary_seconds": 40.0},
+        {"section": "竞争格局", "charts": 1, "saved_tokens": 700, "summary_seconds": 35.0},
+    ]
+    for latency in (20.0, 30.0):
+        processor.router.record("deepseek-reasoner", latency)
+    processor.router.record("deepseek-reasoner", 90.0, ok=False)
+
+    report = processor.fusion_report()
+    assert report["saved_seconds_estimate"] == 50.0
+    assert report["saved_seconds_baseline"] == "router_mean_latency"
+
+
+def test_saved_seconds_prefers_standalone_extraction_calls(monkeypatch):
+    processor = make_processor(monkeypatch)
+    processor.fusion_stats = [{"section": "市场规模", "charts": 2, "saved_tokens": 900, "summary_seconds": 40.0}]
+    processor.extraction_latencies = [12.0, 18.0]
+    processor.router.record("deepseek-reasoner", 30.0)
+
+    report = processor.fusion_report()
+    assert report["saved_seconds_estimate"] == 15.0
+    assert report["saved_seconds_baseline"] == "extraction_calls"
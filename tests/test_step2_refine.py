@@ -0,0 +1,32 @@
+import step2
+
+
+def make_processor(monkeypatch, scores):
+    monkeypatch.delenv("REPORT_LLM_PROVIDERS", raising=False)
+    monkeypatch.delenv("REPORT_HEDGE_REQUESTS", raising=False)
+    monkeypatch.setattr(step2, "API_KEY", "test-key")
+    processor = step2.ContentProcessor()
+    processor.refine_threshold = 8.0
+    processor.refine_max_calls = 6
+    scores = iter(scores)
+    monkeypatch.setattr(processor, "generate_reflection",
+                        lambda content, sub_title, keyword: (f"feedback on {content}", next(scores)))
+    monkeypatch.setattr(processor, "optimize_content",
+                        lambda content, reflection, sub_title, keyword: content + "+")
+    return processor
+
+
+def test_score_drop_returns_best_version(monkeypatch):
+    processor = make_processor(monkeypatch, [5.0, 7.0, 6.0])
+    content, rounds = processor.refine_content("v", "市场规模", "新能源")
+    assert content == "v+"
+    assert [r["score"] for r in rounds] == [5.0, 7.0, 6.0]
+
+
+def test_convergence_is_measured_against_best_score(monkeypatch):
+    processor = make_processor(monkeypatch, [5.0, 7.0, None, 7.2])
+    processor.refine_max_calls = 8
+    content, rounds = processor.refine_content("v", "市场规模", "新能源")
+    # 7.2 is only 0.2 above the best 7.0: converged, and the slightly better version is kept
+    assert content == "v+++"
+    assert len(rounds) == 4
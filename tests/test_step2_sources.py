@@ -0,0 +1,10 @@
+import step2
+
+def test_enhanced_content_is_added_to_step1_source():
+    step1 = "## 市场规模\n\n2023年规模1200亿元 [ref1]\n\n## 参考资料\n\n[ref1] 来源一"
+    enhanced = "规模继续增长[1]。\n\n## 参考资料\n1. [来源A](http://a)\n"
+    merged = step2.merge_enhanced_content(step1, enhanced)
+
+    body, references = step2.split_reference_section(merged)
+    assert "2023年规模1200亿元 [ref1]" in body and "规模继续增长[1]。" in body
+    assert "[ref1] 来源一" in references and "1. [来源A](http://a)" in references
@@ -0,0 +1,33 @@
+from text_compress import compress_text, is_boilerplate
+
+
+def test_protected_sentences_survive_boilerplate_patterns():
+    sentences = [
+        "监管部门持续关注行业数据安全，2023年合规投入同比增长80%。",
+        "公司累计取得软件著作权及版权所有权登记120项。",
+        "企业分享到海外市场的收入占比提升至20%。 [ref3]",
+        "点击率较上年提高了15个百分点。",
+    ]
+    compressed, stats = compress_text("\n".join(sentences))
+    for sentence in sentences:
+        assert sentence in compressed
+    assert stats["dropped"]["boilerplate"] == 0
+
+
+def test_footer_lines_are_dropped_even_with_numbers():
+    text = "\n".join([
+        "2024年行业市场规模达到3200亿元。 [ref1]",
+        "Copyright © 2024 Example Media. All rights reserved.",
+        "京ICP备12345678号-1",
+        "扫码关注公众号",
+        "分享到：微信 微博",
+    ])
+    compressed, stats = compress_text(text)
+    assert compressed == "2024年行业市场规模达到3200亿元。 [ref1]"
+    assert stats["dropped"]["boilerplate"] == 5
+
+
+def test_chrome_patterns_only_match_whole_short_lines():
+    assert is_boilerplate("扫码关注公众号")
+    assert not is_boilerplate("行业协会呼吁社会各界持续关注中小企业的融资难题与下载渠道建设问题。")
+    assert not is_boilerplate("关注度提升带动了下载量增长30%。", protected=True)
@@ -0,0 +1,89 @@
+import step1_5_enhance
+
+
+def make_node(parent=None, text="x"):
+    return {"text": text, "citations": [], "children": [], "parent": parent,
+            "depth": parent["depth"] + 1 if parent else 0, "visits": 0, "reward": 0}
+
+
+def test_fully_pruned_tree_stops_without_reevaluating(monkeypatch):
+    processor = step1_5_enhance.ThinkCiteProcessor(client=object(), prefilter_threshold=0.9)
+    expansions, llm_evaluations = [], []
+
+    def expansion(node, *args):
+        expansions.append(node)
+        node["children"] = [make_node(node) for _ in range(2)]
+        return node["children"]
+
+    monkeypatch.setattr(processor, "expansion", expansion)
+    monkeypatch.setattr(processor, "local_reward", lambda text, citations: (0.1, {}))
+    monkeypatch.setattr(processor, "evaluate_content_quality", lambda text: llm_evaluations.append(text) or (0, ""))
+
+    root = make_node()
+    processor.mcts_search(root, "", "市场规模", "新能源")
+
+    assert len(expansions) == 1
+    assert llm_evaluations == []
+    assert root["exhausted"]
+    assert all(child["pruned"] for child in root["children"])
+
+
+def test_prefilter_scores_only_the_new_segment(monkeypatch):
+    processor = step1_5_enhance.ThinkCiteProcessor(client=object())
+    scored = []
+    monkeypatch.setattr(processor, "local_reward", lambda text, citations: scored.append(text) or (0.0, {}))
+    parent = make_node(text="2023年市场规模达到1200亿元[1][2]。")
+    child = make_node(parent, text=parent["text"] + "\n\n头部企业份额为35%[1]。")
+    child["segment"] = "头部企业份额为35%[1]。"
+
+    processor.evaluation(child)
+
+    assert scored == ["头部企业份额为35%[1]。"]
+
+
+def test_best_path_is_assembled_with_merged_citations():
+    processor = step1_5_enhance.ThinkCiteProcessor(client=object())
+    root = make_node(text="")
+    a = make_node(root, text="A")
+    a.update(segment="规模1200亿元[1]，增速12%[2]。", visits=3,
+             citations=[{"url": "u1", "title": "t1"}, {"url": "u2", "title": "t2"}])
+    b = make_node(a, text="A B")
+    b.update(segment="龙头份额35%[1]，来源同上[2]。", visits=2,
+             citations=[{"url": "u3", "title": "t3"}, {"url": "u1", "title": "t1"}])
+    pruned = make_node(a, text="A C")
+    pruned.update(visits=5, pruned=True)
+    root["children"], a["children"] = [a], [b, pruned]
+
+    processor.mcts_iterations = 0
+    leaf = processor.mcts_search(root, "", "市场规模", "新能源")
+    text, citations = processor.assemble_path(leaf)
+
+    assert leaf is b
+    assert text == "规模1200亿元[1]，增速12%[2]。\n\n龙头份额35%[3]，来源同上[1]。"
+    assert [c["url"] for c in citations] == ["u1", "u2", "u3"]
+
+
+def test_processing_report_aggregates_prompt_savings(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / "step1", tmp_path / "step1_5"
+    input_dir.mkdir()
+    for name in ("1_1_市场规模.md", "1_2_竞争格局.md"):
+        (input_dir / name).write_text("## 标题\n\n内容 [ref1]\n", encoding="utf-8")
+
+    class Client:
+        def close(self):
+            pass
+
+    def generate_with_citations(self, content, section_title, keyword):
+        self.record_prompt_saving("evaluate_citation_quality", 1000, 400)
+        self.record_prompt_saving("expansion", 500, 250)
+        return content
+
+    monkeypatch.setattr(step1_5_enhance, "create_ds_client", Client)
+    monkeypatch.setattr(step1_5_enhance.ThinkCiteProcessor, "generate_with_citations", generate_with_citations)
+
+    report = step1_5_enhance.enhance_sections("新能源", str(input_dir), str(output_dir), max_workers=2)
+
+    savings = report["prompt_savings"]
+    assert savings["evaluate_citation_quality"] == {"calls": 2, "original_chars": 2000, "compact_chars": 800,
+                                                    "saved_chars": 1200, "saved_ratio": 0.6}
+    assert savings["total"]["calls"] == 4 and savings["total"]["saved_chars"] == 1700
@@ -0,0 +1,38 @@
+import viz_data
+
+MARKET_TABLE = """近年来市场规模如下：
+
+| 年份 | 市场规模（亿元） |
+|---|---|
+| 2021 | 1,200 |
+| 2022 | 1,350 |
+| 2023 | 1.6万 |
+"""
+
+
+def test_header_unit_is_the_base_for_bare_cells():
+    charts = viz_data.extract_charts(MARKET_TABLE, "行业概况")
+    assert charts[0]["data"]["values"] == [1200.0, 1350.0, 16000.0]
+    assert charts[0]["y_label"] == "市场规模（亿元）"
+
+
+def test_mixed_magnitudes_without_header_unit_are_not_charted():
+    table = """| 年份 | 销量 |
+|---|---|
+| 2021 | 800 |
+| 2022 | 900 |
+| 2023 | 1.1万 |
+"""
+    assert viz_data.extract_charts(table, "行业概况") == []
+
+
+def test_table_without_lead_in_does_not_inherit_previous_title():
+    shares = """
+| 企业 | 份额 |
+|---|---|
+| A公司 | 40% |
+| B公司 | 35% |
+| C公司 | 25% |
+"""
+    charts = viz_data.extract_charts(MARKET_TABLE + shares, "竞争格局")
+    assert [chart["chart_title"] for chart in charts] == ["近年来市场规模如下", "竞争格局（份额）"]
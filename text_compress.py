@@ -0,0 +1,193 @@
+# Local compression of step1 source material before it is sent to the summarizer.
+# Sources are split into sentences; page boilerplate (navigation, copyright, share/follow
+# prompts) and repeated sentences are dropped and whitespace is normalized.
+# Sentences carrying a number or a citation marker are never dropped as boilerplate,
+# near-duplicates or fragments, except for whole copyright/filing footer lines.
+# Step1 appends one marker to the end of each source snippet, so a dropped sentence hands
+# its markers to the last kept sentence of the same snippet; a snippet that was
+# boilerplate from start to end loses its marker along with its text.
+import re
+
+_CITATION = re.compile(r"\s*\[(?:ref)?\d+\]")
+_DIGIT = re.compile(r"\d")
+# Sentence ends: Chinese and Latin terminators (a Latin period only before whitespace, so
+# decimals and abbreviations inside numbers stay intact), plus any trailing citation markers
+_SENTENCE = re.compile(r".*?(?:[。！？；!?;]+|\.(?=\s)|$)(?:\s*\[(?:ref)?\d+\])*", re.S)
+_NON_WORD = re.compile(r"[\W_]+")
+
+# Page footers (copyright and filing lines); dropped even when they contain a number,
+# since they always carry a year or a filing number. Matched against the whole line only.
+FOOTER_PATTERNS = [
+    re.compile(p, re.I) for p in (
+        r"^(版权所有|copyright|©|\(c\)).{0,60}$",
+        r"^.{0,40}(all rights reserved|版权所有)[.。]?$",
+        r"^.{0,30}(icp[备证]|公网安备|增值电信业务).{0,40}$",
+    )
+]
+# Other page chrome (share/follow prompts, disclaimers, navigation). Anchored to short,
+# whole lines so that content merely mentioning "关注" or "分享到" is not matched; never
+# applied to sentences carrying a number or a citation marker.
+BOILERPLATE_PATTERNS = [
+    re.compile(p, re.I) for p in (
+        r"^(免责声明|本文仅代表作者|.{0,10}不代表本(站|网|平台)观点|转载请注明|未经授权.{0,6}(转载|使用)).{0,60}$",
+        r"^(扫码|扫描二维码|长按识别|点击|关注).{0,12}(公众号|关注|下载|订阅|阅读原文|查看更多).{0,10}$",
+        r"^(分享到|责任编辑|相关阅读|热门推荐|猜你喜欢|更多精彩)[:：]?.{0,20}$",
+        r"^(上一篇|下一篇)[:：].{0,40}$",
+        r"^(返回顶部|返回首页|联系我们|网站地图|加入收藏|设为首页).{0,10}$",
+        r"^(首页|登录|注册|搜索)(\s*[|/>｜·]\s*\S{1,8})+$",
+    )
+]
+# Breadcrumb / menu lines: several short items separated by | > / ·
+_MENU_LINE = re.compile(r"^(\S{1,8}\s*[|>｜·/»]\s*){2,}\S{1,8}$")
+
+# Minimum normalized length for a sentence to count as content rather than a fragment
+MIN_SENTENCE_CHARS = 6
+# Character-trigram Jaccard similarity above which a sentence repeats an earlier one
+NEAR_DUPLICATE_RATIO = 0.8
+
+
+def split_sentences(text):
+    """Split a paragraph into sentences, keeping terminators and trailing citation markers"""
+    return [s for s in (m.group(0).strip() for m in _SENTENCE.finditer(text)) if s]
+
+def normalize_whitespace(text):
+    """Collapse runs of spaces (including full-width ones) and blank lines"""
+    text = text.replace("　", " ").replace("\xa0", " ").replace("\r\n", "\n")
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+def is_boilerplate(sentence, protected=False):
+    """
+    Copyright, filing, share/follow and navigation text. A protected sentence (one with a
+    number or a citation marker) only counts as boilerplate when it is a whole footer line.
+    """
+    bare = _CITATION.sub("", sentence).strip()
+    if any(p.match(bare) for p in FOOTER_PATTERNS):
+        return True
+    if protected:
+        return False
+    return any(p.match(bare) for p in BOILERPLATE_PATTERNS) or bool(_MENU_LINE.match(bare))
+
+def _shingles(key):
+    return {key[i:i+3] for i in range(len(key) - 2)} if len(key) > 3 else {key}
+
+class _SentenceIndex:
+    """Sentences kept so far, for exact and near-duplicate lookups"""
+    def __init__(self):
+        self.exact = {}
+        self.shingles = []
+        self.by_shingle = {}
+
+    def find(self, key):
+        """Position of an earlier sentence equal or nearly equal to key, or None"""
+        if key in self.exact:
+            return self.exact[key]
+        grams = _shingles(key)
+        overlaps = {}
+        for gram in grams:
+            for position in self.by_shingle.get(gram, ()):
+                overlaps[position] = overlaps.get(position, 0) + 1
+        for position, shared in overlaps.items():
+            union = len(grams) + len(self.shingles[position][1]) - shared
+            if union and shared / union >= NEAR_DUPLICATE_RATIO:
+                return self.shingles[position][0]
+        return None
+
+    def add(self, key, target):
+        self.exact.setdefault(key, target)
+        position = len(self.shingles)
+        grams = _shingles(key)
+        self.shingles.append((target, grams))
+        for gram in grams:
+            self.by_shingle.setdefault(gram, []).append(position)
+
+def _attach(sentence, markers):
+    """Append citation markers a sentence does not already carry"""
+    for marker in markers:
+        if marker not in sentence:
+            sentence += " " + marker
+    return sentence
+
+def compress_text(text):
+    """
+    Compress source material. Returns (compressed_text, stats) where stats holds the
+    original/compressed character counts, their ratio and the dropped sentence counts.
+    Markdown headings and table rows are kept verbatim.
+    """
+    text = normalize_whitespace(text or "")
+    paragraphs = []     # each a list of sentences, verbatim lines and "\n" line breaks
+    index = _SentenceIndex()
+    # (paragraph, sentence) position of the latest kept sentence of the current snippet;
+    # a sentence ending in a citation marker closes the snippet
+    last_kept = None
+    dropped = {"boilerplate": 0, "duplicate": 0, "fragment": 0}
+
+    for block in re.split(r"\n\s*\n", text):
+        paragraph = []
+        paragraphs.append(paragraph)
+        for line in block.split("\n"):
+            if paragraph and paragraph[-1] != "\n":
+                paragraph.append("\n")
+            if line.lstrip().startswith(("#", "|")):
+                paragraph.append(line)
+                continue
+            for sentence in split_sentences(line):
+                bare = _CITATION.sub("", sentence)
+                markers = [m.strip() for m in _CITATION.findall(sentence)]
+                key = _NON_WORD.sub("", bare).lower()
+                protected = bool(markers) or bool(_DIGIT.search(bare))
+
+                if is_boilerplate(sentence, protected):
+                    reason = "boilerplate"
+                elif not key or (len(key) < MIN_SENTENCE_CHARS and not protected):
+                    reason = "fragment"
+                else:
+                    original = index.find(key)
+                    # Near-duplicates with numbers may differ in exactly those numbers
+                    if original is not None and (not protected or key in index.exact):
+                        # The repeated sentence is now backed by this source as well
+                        p, s = original
+                        paragraphs[p][s] = _attach(paragraphs[p][s], markers)
+                        dropped["duplicate"] += 1
+                        if markers:
+                            last_kept = None
+                        continue
+                    reason = None
+
+                if reason:
+                    dropped[reason] += 1
+                    if markers:
+                        if last_kept is not None:
+                            p, s = last_kept
+                            paragraphs[p][s] = _attach(paragraphs[p][s], markers)
+                        last_kept = None
+                    continue
+
+                paragraph.append(sentence)
+                index.add(key, (len(paragraphs) - 1, len(paragraph) - 1))
+                last_kept = None if markers else (len(paragraphs) - 1, len(paragraph) - 1)
+        while paragraph and paragraph[-1] == "\n":
+            paragraph.pop()
+
+    compressed = "\n\n".join(rendered for rendered in (_render(p) for p in paragraphs) if rendered)
+    stats = {
+        "original_chars": len(text),
+        "compressed_chars": len(compressed),
+        "ratio": round(len(compressed) / len(text), 3) if text else 1.0,
+        "dropped": dropped,
+    }
+    return compressed, stats
+
+def _render(paragraph):
+    """Join the sentences of a paragraph, with a space only between Latin text"""
+    output = ""
+    for item in paragraph:
+        if item == "\n":
+            if output and not output.endswith("\n"):
+                output += "\n"
+        elif output and not output.endswith("\n") and output[-1].isascii() and item[0].isascii():
+            output += " " + item
+        else:
+            output += item
+    return output.strip()
@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+
+import llm_providers
+from llm_utils import estimate_tokens
+
+# 各模型价格（美元 / 百万token）：输入命中缓存、输入未命中缓存、输出
+MODEL_PRICES = {
+    "deepseek-chat": {"cache_hit": 0.07, "cache_miss": 0.27, "output": 1.10},
+    "deepseek-reasoner": {"cache_hit": 0.14, "cache_miss": 0.55, "output": 2.19},
+}
+DEFAULT_MODEL_PRICES = MODEL_PRICES["deepseek-reasoner"]
+
+# 每个章节至少分得平均份额的这一比例，其余按 原始资料规模 × 章节权重 分配
+MIN_SHARE = 0.3
+
+
+def call_cost(model, prompt_tokens, completion_tokens, cache_hit_tokens=0):
+    """一次调用的费用（美元）"""
+    prices = MODEL_PRICES.get(model, DEFAULT_MODEL_PRICES)
+    cache_hit_tokens = min(cache_hit_tokens, prompt_tokens)
+    return (cache_hit_tokens * prices["cache_hit"]
+            + (prompt_tokens - cache_hit_tokens) * prices["cache_miss"]
+            + completion_tokens * prices["output"]) / 1_000_000
+
+
+class SectionBudget:
+    """
+    一个章节（或一个阶段）可用的token / 费用额度；tokens 与 usd 均为 None 时不限额
+
+    各阶段调用前用 can_afford 判断额度是否足够，不够时跳过或降级；调用后用 charge 记账
+    """
+    def __init__(self, name, tokens=None, usd=None):
+        self.name = name
+        self.tokens = tokens
+        self.usd = usd
+        self.spent_tokens = 0
+        self.spent_usd = 0.0
+        self.by_stage = {}
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.tokens is not None or self.usd is not None
+
+    def remaining_tokens(self):
+        """剩余token数；只按费用限额时，按输出价格折算"""
+        with self._lock:
+            remaining = []
+            if self.tokens is not None:
+                remaining.append(self.tokens - self.spent_tokens)
+            if self.usd is not None:
+                remaining.append((self.usd - self.spent_usd) * 1_000_000 / DEFAULT_MODEL_PRICES["output"])
+        return max(0, int(min(remaining))) if remaining else None
+
+    def can_afford(self, model, input_tokens, output_tokens):
+        """按估算的输入/输出token数判断一次调用是否在剩余额度内"""
+        with self._lock:
+            if self.tokens is not None and self.spent_tokens + input_tokens + output_tokens > self.tokens:
+                return False
+            if self.usd is not None and self.spent_usd + call_cost(model, input_tokens, output_tokens) > self.usd:
+                return False
+        return True
+
+    def cap_output(self, builder):
+        """把 PromptBuilder 的输出上限压到剩余额度内（不低于其 min_output），用于必须执行的调用"""
+        remaining = self.remaining_tokens()
+        if remaining is not None:
+            builder.max_output = max(builder.min_output, min(builder.max_output, remaining))
+
+    def skip(self, stage):
+        """记录因额度不足而跳过或降级的阶段"""
+        with self._lock:
+            self.skipped.append(stage)
+        print(f"[{self.name}] Token budget exhausted, degrading stage: {stage}")
+
+    def charge(self, stage, model, response=None, input_tokens=0, output_text=""):
+        """按 API 返回的 usage 记账；没有 usage 时按估算的输入token数与输出文本记账"""
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            prompt_tokens = usage.prompt_tokens or 0
+            completion_tokens = usage.completion_tokens or 0
+            cache_hit_tokens = getattr(usage, "prompt_cache_hit_tokens", 0) or 0
+        else:
+            if response is not None and not output_text:
+                try:
+                    output_text = response.choices[0].message.content or ""
+                except (AttributeError, IndexError):
+                    output_text = ""
+            prompt_tokens, completion_tokens, cache_hit_tokens = input_tokens, estimate_tokens(output_text), 0
+        cost = call_cost(model, prompt_tokens, completion_tokens, cache_hit_tokens)
+        with self._lock:
+            self.spent_tokens += prompt_tokens + completion_tokens
+            self.spent_usd += cost
+            stage_stats = self.by_stage.setdefault(stage, {"calls": 0, "tokens": 0, "usd": 0.0})
+            stage_stats["calls"] += 1
+            stage_stats["tokens"] += prompt_tokens + completion_tokens
+            stage_stats["usd"] += cost
+
+    def meter(self, client, stage):
+        """包装客户端：经由它发出的调用都记入本额度的 stage 阶段"""
+        return _MeteredClient(client, self, stage)
+
+    def report(self):
+        with self._lock:
+            return {
+                "allowance_tokens": self.tokens,
+                "allowance_usd": None if self.usd is None else round(self.usd, 4),
+                "spent_tokens": self.spent_tokens,
+                "spent_usd": round(self.spent_usd, 4),
+                "by_stage": {stage: dict(stats, usd=round(stats["usd"], 4)) for stage, stats in self.by_stage.items()},
+                "skipped": list(self.skipped),
+            }
+
+
+class _MeteredClient:
+    """
+    与 OpenAI 客户端接口一致（chat.completions.create），每次调用后记账；
+    底层为开启对冲的 ProviderPool 时，落败的那次调用完成后同样记入本阶段
+    """
+    def __init__(self, client, budget, stage):
+        self._client = client
+        self._budget = budget
+        self._stage = stage
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        input_tokens = sum(estimate_tokens(m.get("content", "")) for m in kwargs.get("messages", []))
+        token = llm_providers.discarded_attempt_handler.set(
+            lambda response: self._budget.charge(self._stage, model, response, input_tokens=input_tokens))
+        try:
+            response = self._client.chat.completions.create(**kwargs)
+        finally:
+            llm_providers.discarded_attempt_handler.reset(token)
+        self._budget.charge(self._stage, model, response, input_tokens=input_tokens)
+        return response
+
+
+class ReportBudget:
+    """
+    报告级token / 费用预算，按章节分配
+
+    allocate 按 原始资料token数 × 章节权重 把总额分给各章节（每个章节保底 MIN_SHARE 的平均份额）；
+    未设置预算时各章节不限额。weights 为 {章节标题关键词: 权重}，标题包含关键词即使用该权重
+    """
+    def __init__(self, total_tokens=None, total_usd=None, weights=None):
+        self.total_tokens = total_tokens
+        self.total_usd = total_usd
+        self.weights = weights or {}
+        self.sections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, share=1.0):
+        """
+        从 REPORT_TOKEN_BUDGET / REPORT_USD_BUDGET / REPORT_SECTION_WEIGHTS（JSON）读取预算；
+        share 为当前阶段分得的比例
+        """
+        tokens = os.environ.get("REPORT_TOKEN_BUDGET")
+        usd = os.environ.get("REPORT_USD_BUDGET")
+        weights = os.environ.get("REPORT_SECTION_WEIGHTS")
+        return cls(
+            total_tokens=int(float(tokens) * share) if tokens else None,
+            total_usd=float(usd) * share if usd else None,
+            weights=json.loads(weights) if weights else None,
+        )
+
+    @property
+    def enabled(self):
+        return self.total_tokens is not None or self.total_usd is not None
+
+    def weight_for(self, name):
+        for key, weight in self.weights.items():
+            if key in name:
+                return float(weight)
+        return 1.0
+
+    def allocate(self, source_tokens):
+        """source_tokens 为 {章节名: 原始资料token数}；返回 {章节名: SectionBudget}"""
+        demand = {name: max(tokens, 1) * self.weight_for(name) for name, tokens in source_tokens.items()}
+        total_demand = sum(demand.values()) or 1.0
+        count = len(demand) or 1
+        with self._lock:
+            for name, value in demand.items():
+                share = MIN_SHARE / count + (1 - MIN_SHARE) * value / total_demand
+                self.sections[name] = SectionBudget(
+                    name,
+                    tokens=int(self.total_tokens * share) if self.total_tokens is not None else None,
+                    usd=self.total_usd * share if self.total_usd is not None else None,
+                )
+            return dict(self.sections)
+
+    def section(self, name):
+        """章节的额度；未分配的章节不限额"""
+        with self._lock:
+            if name not in self.sections:
+                self.sections[name] = SectionBudget(name)
+            return self.sections[name]
+
+    def report(self):
+        with self._lock:
+            sections = {name: budget.report() for name, budget in self.sections.items()}
+        return {
+            "total_tokens": self.total_tokens,
+            "total_usd": self.total_usd,
+            "spent_tokens": sum(item["spent_tokens"] for item in sections.values()),
+            "spent_usd": round(sum(item["spent_usd"] for item in sections.values()), 4),
+            "sections": sections,
+        }
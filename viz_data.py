@@ -0,0 +1,411 @@
+# Local extraction of chart specs from section summaries.
+# The summarize prompt asks for key data in markdown tables, so most sections can be charted
+# without an LLM call: tables and obvious numeric series (years vs values, shares) are parsed
+# here and turned into the same spec format that extract_data_for_visualization returns.
+# Chart specs that do come from the LLM are parsed tolerantly and repaired here as well.
+import re
+import json
+import numpy as np
+
+# Numeric cell: optional sign, thousands separators, decimals, Chinese magnitude and unit suffix
+_NUMBER_PATTERN = re.compile(
+    r"^[约近超逾达~≈+]*\s*(-?\d[\d,，]*(?:\.\d+)?)\s*(万亿|亿|万|千)?\s*([^\d\s]{0,6})$"
+)
+_MAGNITUDES = {"千": 1e3, "万": 1e4, "亿": 1e8, "万亿": 1e12}
+# Magnitude of a header unit in parentheses: '市场规模（亿元）' -> 亿
+_HEADER_MAGNITUDE = re.compile(r"[（(]\s*(万亿|亿|万|千)")
+
+_TABLE_ROW = re.compile(r"^\s*\|(.+)\|\s*$")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_HEADING = re.compile(r"^\s*(?:#{1,6}\s+|\*\*)(.+?)(?:\*\*)?\s*[:：]?\s*$")
+_MARKERS = re.compile(r"\[ref\d+\]|\*\*|\[\d+\]")
+
+# Period labels: 2023, 2023年, 2023E, 2023Q1, 2023年上半年, Q3, 1月 ...
+_PERIOD_LABEL = re.compile(r"^((19|20)\d{2}(年|E|e|F)?.*|Q[1-4].*|\d{1,2}月|第[一二三四1-4]季度.*)$")
+
+# Inline series: "2021年市场规模达到150.8亿元"
+_YEAR_VALUE = re.compile(
+    r"((?:19|20)\d{2})年[^，。；,;\d]{0,16}?(?:达到|达|为|约|增至|突破|升至|降至)?\s*"
+    r"(-?\d[\d,]*(?:\.\d+)?)\s*(万亿|亿|万)?(元|美元|台|辆|吨|件|家|人|GW|GWh|%)"
+)
+# Inline shares: "头部企业占比35.2%"
+_SHARE = re.compile(
+    r"([\u4e00-\u9fa5A-Za-z0-9]{2,12}?)(?:的)?(?:占比|份额|市场份额|占)(?:为|约|达)?\s*(\d+(?:\.\d+)?)%"
+)
+
+_TOTAL_LABELS = {"合计", "总计", "总体", "合计/平均", "Total", "total"}
+
+# A column counts as numeric when at least this share of its cells parse
+NUMERIC_COLUMN_RATIO = 0.8
+MAX_CHARTS_PER_SECTION = 5
+
+
+def _clean_cell(cell):
+    return _MARKERS.sub("", cell).strip()
+
+def coerce_numbers(cells):
+    """
+    Parse an array of strings like '12.5%', '1,234亿', '约120亿元' in one pass.
+    Returns (values, magnitudes, units) as numpy arrays; unparseable cells are NaN,
+    as are the magnitudes of cells without a 万/亿 suffix.
+    """
+    cells = np.asarray(cells, dtype=str)
+    flat = cells.ravel()
+    matches = [_NUMBER_PATTERN.match(cell.strip()) for cell in flat]
+    parsed = np.array([m is not None for m in matches])
+    numbers = np.array(
+        [m.group(1).replace(",", "").replace("，", "") if m else "nan" for m in matches], dtype=str
+    ).astype(float)
+    magnitudes = np.array([_MAGNITUDES[m.group(2)] if m and m.group(2) else np.nan for m in matches])
+    units = np.array([m.group(3) if m else "" for m in matches], dtype=object)
+    numbers[~parsed] = np.nan
+    return numbers.reshape(cells.shape), magnitudes.reshape(cells.shape), units.reshape(cells.shape)
+
+def _normalize_magnitudes(values, magnitudes, header=""):
+    """
+    Rescale a column to one magnitude, so '8000万' and '1.2亿' become comparable.
+    Returns (values, magnitude_unit), or (None, "") when the magnitudes are ambiguous.
+    A magnitude in the header unit ('市场规模（亿元）') is the base: bare cells are in it,
+    larger cell magnitudes are converted ('1.2亿' under 万元) and 万 under 亿 reads as 万亿.
+    Without one, a column is rescaled only when every cell states its magnitude.
+    """
+    valid = ~np.isnan(magnitudes)
+    header_match = _HEADER_MAGNITUDE.search(header)
+    if header_match:
+        base = _MAGNITUDES[header_match.group(1)]
+        factors = np.ones(len(values))
+        for k in np.flatnonzero(valid):
+            if magnitudes[k] > base:
+                factors[k] = magnitudes[k] / base
+            elif magnitudes[k] < base and magnitudes[k] * base in _MAGNITUDES.values():
+                factors[k] = magnitudes[k]
+            elif magnitudes[k] != base:
+                return None, ""
+        return values * factors, header_match.group(1)
+    if not valid.any():
+        return values, ""
+    if not valid.all():
+        return None, ""
+    present, counts = np.unique(magnitudes[valid], return_counts=True)
+    common = present[np.argmax(counts)]
+    scaled = values * np.where(valid, magnitudes, common) / common
+    unit = next((name for name, factor in _MAGNITUDES.items() if factor == common), "")
+    return scaled, unit
+
+def parse_markdown_tables(content):
+    """
+    Find markdown tables; returns [(context, header, rows)] where context is the heading or
+    lead-in line between the previous table and this one, or "" when there is none
+    """
+    tables = []
+    lines = content.splitlines()
+    context = ""
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        is_table = (
+            _TABLE_ROW.match(line) and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1])
+        )
+        if not is_table:
+            heading = _HEADING.match(line)
+            if heading:
+                context = _clean_cell(heading.group(1))
+            elif line.strip().endswith(("：", ":")):
+                context = _clean_cell(line.strip().rstrip("：:"))[-30:]
+            i += 1
+            continue
+
+        header = [_clean_cell(c) for c in _TABLE_ROW.match(line).group(1).split("|")]
+        rows = []
+        i += 2
+        while i < len(lines) and _TABLE_ROW.match(lines[i]):
+            cells = [_clean_cell(c) for c in _TABLE_ROW.match(lines[i]).group(1).split("|")]
+            if len(cells) == len(header):
+                rows.append(cells)
+            i += 1
+        if rows:
+            tables.append((context, header, rows))
+        # A lead-in belongs to one table only; later tables without one fall back to the section title
+        context = ""
+    return tables
+
+def _infer_chart_type(labels, series_count, values, unit):
+    """Pick a chart type from the shape of the data"""
+    if all(_PERIOD_LABEL.match(label) for label in labels) and len(labels) >= 3:
+        return "line"
+    if (series_count == 1 and unit == "%" and 2 <= len(labels) <= 7
+            and values.min() >= 0 and 90 <= values.sum() <= 110):
+        return "pie"
+    if max(len(label) for label in labels) > 8:
+        return "horizontal_bar"
+    return "bar"
+
+def _axis_label(header, unit, magnitude_unit):
+    """Column header plus the unit found in the cells, unless the header already carries it"""
+    suffix = f"{magnitude_unit}{unit}"
+    if suffix and suffix not in header:
+        return f"{header}（{suffix}）"
+    return header
+
+def _series_name(header):
+    """Column header without a trailing unit in parentheses: '市场规模（亿元）' -> '市场规模'"""
+    return re.sub(r"\s*[（(][^（）()]*[）)]\s*$", "", header) or header
+
+def _chart_title(title_prefix, name):
+    if not title_prefix:
+        return name
+    return title_prefix if name in title_prefix else f"{title_prefix}（{name}）"
+
+def table_to_charts(context, header, rows, sub_title=""):
+    """Turn one parsed table into chart specs (one per numeric column, or one multi-series line chart)"""
+    cells = np.array(rows, dtype=str)
+    values, magnitudes, units = coerce_numbers(cells)
+    numeric_ratio = (~np.isnan(values)).mean(axis=0)
+    # The label column is a leading year/period column, else the first mostly non-numeric column
+    if all(_PERIOD_LABEL.match(cell) for cell in cells[:, 0]):
+        label_column = 0
+    else:
+        label_column = next((j for j in range(cells.shape[1]) if numeric_ratio[j] < NUMERIC_COLUMN_RATIO), None)
+    if label_column is None:
+        return []
+    numeric_columns = [j for j in range(cells.shape[1])
+                       if j != label_column and numeric_ratio[j] >= NUMERIC_COLUMN_RATIO]
+    if not numeric_columns:
+        return []
+
+    # Total rows would distort shares and scales
+    not_total = ~np.isin(cells[:, label_column], list(_TOTAL_LABELS))
+    series = []
+    for j in numeric_columns:
+        mask = not_total & ~np.isnan(values[:, j])
+        if mask.sum() < 2:
+            continue
+        column_values, magnitude_unit = _normalize_magnitudes(values[mask, j], magnitudes[mask, j], header[j])
+        if column_values is None:
+            # Mixed bare and suffixed cells without a base unit cannot be put on one scale
+            continue
+        column_units = [u for u in units[mask, j] if u]
+        unit = max(set(column_units), key=column_units.count) if column_units else ""
+        series.append({
+            "name": _series_name(header[j]),
+            "mask": mask,
+            "values": [round(float(v), 4) for v in column_values],
+            "axis_label": _axis_label(header[j], unit, magnitude_unit),
+            "unit": f"{magnitude_unit}{unit}",
+        })
+    if not series:
+        return []
+
+    title_prefix = context or sub_title
+    first = series[0]
+    first_labels = [str(label) for label in cells[first["mask"], label_column]]
+    chart_type = _infer_chart_type(first_labels, len(series), np.array(first["values"]), first["unit"])
+    if chart_type == "line":
+        # Time series: columns with the first column's unit and rows become additional lines
+        same_unit = [s for s in series[1:]
+                     if s["unit"] == first["unit"] and np.array_equal(s["mask"], first["mask"])]
+        return [{
+            "chart_title": _chart_title(title_prefix, first["name"]),
+            "chart_type": "line",
+            "x_label": header[label_column],
+            "y_label": first["axis_label"],
+            "data": {
+                "labels": first_labels,
+                "values": first["values"],
+                "additional_series": [{"name": s["name"], "values": s["values"]} for s in same_unit],
+            },
+            "source": "local_table",
+        }]
+
+    charts = []
+    for s in series[:2]:
+        labels = [str(label) for label in cells[s["mask"], label_column]]
+        charts.append({
+            "chart_title": _chart_title(title_prefix, s["name"]),
+            "chart_type": _infer_chart_type(labels, 1, np.array(s["values"]), s["unit"]),
+            "x_label": header[label_column],
+            "y_label": s["axis_label"],
+            "data": {"labels": labels, "values": s["values"]},
+            "source": "local_table",
+        })
+    return charts
+
+def extract_inline_series(content, sub_title=""):
+    """
+    Numeric series written in prose: per paragraph, years with values in one unit
+    (line chart) and category shares in percent (pie or bar)
+    """
+    charts = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        if _TABLE_ROW.search(paragraph):
+            continue
+        text = _MARKERS.sub("", paragraph)
+
+        by_unit = {}
+        for year, number, magnitude, unit in _YEAR_VALUE.findall(text):
+            points = by_unit.setdefault((magnitude, unit), {})
+            points.setdefault(year, float(number.replace(",", "")))
+        for (magnitude, unit), points in by_unit.items():
+            if len(points) >= 3:
+                years = sorted(points)
+                charts.append({
+                    "chart_title": f"{sub_title}历年数据（{magnitude}{unit}）" if sub_title else f"历年数据（{magnitude}{unit}）",
+                    "chart_type": "line",
+                    "x_label": "年份",
+                    "y_label": f"{magnitude}{unit}",
+                    "data": {"labels": [f"{y}年" for y in years], "values": [points[y] for y in years]},
+                    "source": "local_text",
+                })
+
+        shares = {}
+        for name, share in _SHARE.findall(text):
+            shares.setdefault(name, float(share))
+        if len(shares) >= 3:
+            values = np.array(list(shares.values()))
+            charts.append({
+                "chart_title": f"{sub_title}占比分布" if sub_title else "占比分布",
+                "chart_type": "pie" if values.sum() <= 100.5 and len(shares) <= 7 else "bar",
+                "x_label": "类别",
+                "y_label": "占比（%）",
+                "data": {"labels": list(shares), "values": [float(v) for v in values]},
+                "source": "local_text",
+            })
+    return charts
+
+def extract_charts(content, sub_title="", max_charts=MAX_CHARTS_PER_SECTION):
+    """
+    Chart specs found locally in a summary: markdown tables first, then inline series.
+    Returns [] when nothing chartable is found, so the caller can fall back to the LLM.
+    """
+    charts = []
+    for context, header, rows in parse_markdown_tables(content):
+        charts.extend(table_to_charts(context, header, rows, sub_title))
+    charts.extend(extract_inline_series(content, sub_title))
+
+    # Drop duplicates: prose often repeats (part of) the numbers of a table
+    unique = []
+    seen = []
+    for chart in charts:
+        data = chart["data"]
+        numbers = set(data["values"])
+        if any(numbers <= previous for previous in seen):
+            continue
+        for series in data.get("additional_series", []):
+            numbers |= set(series["values"])
+        seen.append(numbers)
+        unique.append(chart)
+    return unique[:max_charts]
+
+
+# ---- Validation and repair of LLM chart output ----
+
+CHART_TYPES = {"bar", "horizontal_bar", "stacked_bar", "line", "area", "pie", "donut", "scatter", "bubble", "radar"}
+
+def parse_chart_json(text):
+    """
+    Tolerant parse of an LLM chart reply: fenced or bare JSON, {"charts": [...]}, a list,
+    or a single chart object; repairs comments, trailing commas and full-width quotes.
+    Returns a list of chart dicts, or None when nothing parses.
+    """
+    if not text:
+        return None
+    fenced = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+    candidate = fenced.group(1) if fenced else text
+    starts = [i for i in (candidate.find("{"), candidate.find("[")) if i >= 0]
+    if not starts:
+        return None
+    candidate = candidate[min(starts):candidate.rfind("}" if candidate[min(starts)] == "{" else "]") + 1]
+
+    attempts = [candidate]
+    repaired = re.sub(r"(?m)\s*//[^\n\"]*$", "", candidate)
+    repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
+    repaired = repaired.replace("“", '"').replace("”", '"')
+    attempts.append(repaired)
+    for attempt in attempts:
+        try:
+            parsed = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            parsed = parsed.get("charts", [parsed] if "data" in parsed else [])
+        if isinstance(parsed, list):
+            return [chart for chart in parsed if isinstance(chart, dict)]
+    return None
+
+def split_fused_charts(reply):
+    """
+    Split a fused summarize reply into (summary, chart_json); chart_json is the last fenced
+    JSON block that holds a "charts" key, or None when there is none
+    """
+    blocks = list(re.finditer(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", reply or ""))
+    for block in reversed(blocks):
+        if '"charts"' in block.group(1):
+            summary = (reply[:block.start()] + reply[block.end():]).strip()
+            return summary, block.group(1)
+    return reply, None
+
+def _coerce_series(raw_values):
+    """Numbers from a list of numbers or strings like '12.5%' / '1,234亿'; NaN where unparseable"""
+    cells = ["nan" if v is None else str(v) for v in raw_values]
+    if not cells:
+        return np.array([])
+    values, magnitudes, _ = coerce_numbers(cells)
+    values, _ = _normalize_magnitudes(values, magnitudes)
+    return values
+
+def validate_chart(chart):
+    """Problems that would make the renderer skip the chart; an empty list means valid"""
+    problems = []
+    data = chart.get("data")
+    if not isinstance(data, dict):
+        return ["missing data object"]
+    labels, values = data.get("labels") or [], data.get("values") or []
+    if len(labels) < 2:
+        problems.append("fewer than 2 labels")
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        problems.append("non-numeric values")
+    if len(labels) != len(values):
+        problems.append(f"{len(labels)} labels but {len(values)} values")
+    if chart.get("chart_type") in ("pie", "donut") and values and (min(values, default=0) < 0 or sum(values) <= 0):
+        problems.append("pie chart needs non-negative shares")
+    return problems
+
+def repair_chart(chart):
+    """
+    Coerce numbers, normalize the chart type and reconcile label/value lengths locally.
+    Returns (chart, problems) where problems lists what is still invalid.
+    """
+    chart = dict(chart)
+    chart_type = str(chart.get("chart_type", "bar")).lower().strip()
+    chart["chart_type"] = chart_type if chart_type in CHART_TYPES else "bar"
+    data = chart.get("data")
+    if not isinstance(data, dict):
+        return chart, validate_chart(chart)
+
+    labels = [str(label) for label in data.get("labels") or []]
+    values = _coerce_series(data.get("values") or [])
+    # Pair labels with values up to the shorter list, then drop pairs without a number
+    length = min(len(labels), len(values))
+    keep = ~np.isnan(values[:length])
+    labels = [label for label, k in zip(labels[:length], keep) if k]
+    repaired = {"labels": labels, "values": [round(float(v), 4) for v in values[:length][keep]]}
+
+    additional_series = []
+    for j, series in enumerate(data.get("additional_series") or []):
+        if not isinstance(series, dict):
+            continue
+        series_values = _coerce_series(series.get("values") or [])
+        if len(series_values) < length or np.isnan(series_values[:length][keep]).any():
+            continue
+        additional_series.append({
+            "name": str(series.get("name", f"系列 {j+1}")),
+            "values": [round(float(v), 4) for v in series_values[:length][keep]],
+        })
+    if additional_series:
+        repaired["additional_series"] = additional_series
+    sizes = _coerce_series(data.get("sizes") or [])
+    if len(sizes) >= length and not np.isnan(sizes[:length][keep]).any() and length:
+        repaired["sizes"] = [float(v) for v in sizes[:length][keep]]
+
+    chart["data"] = repaired
+    return chart, validate_chart(chart)